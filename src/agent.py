@@ -1,5 +1,7 @@
 from typing import Union
 from game_state import GameState
+from anytime import AnytimeDecider
+from mcts import MCTSPlanner
 import asyncio
 import random
 import os
@@ -9,8 +11,14 @@ import classes
 uri = os.environ.get(
     'GAME_CONNECTION_STRING') or "ws://127.0.0.1:3000/?role=agent&agentId=agentA&name=defaultName"
 
+# "mcts" plays with the tree search agent (mcts.py), anything else random moves
+agent_kind = os.environ.get("AGENT") or "random"
+
 actions = ["up", "down", "left", "right", "bomb", "detonate"]
 
+# print the tick latency percentiles every this many ticks, 0 to never
+trace_summary_every = int(os.environ.get("TRACE_SUMMARY_EVERY") or 100)
+
 def log(title, message):
     for x in range(5):
         print("================================")
@@ -21,12 +29,17 @@ def log(title, message):
         print("================================")
 
 
+# With `decide`, the agent runs it as an anytime search against the tick
+# deadline (see anytime.py) instead of the random moves below.
 class Agent():
-    def __init__(self):
+    def __init__(self, decide=None):
         self._client = GameState(uri)
 
         # any initialization code can go here
-        self._client.set_game_tick_callback(self._on_game_tick)
+        if decide is not None:
+            self._client.set_game_tick_callback(AnytimeDecider(self._client, decide))
+        else:
+            self._client.set_game_tick_callback(self._on_game_tick)
 
         loop = asyncio.get_event_loop()
         connection = loop.run_until_complete(self._client.connect())
@@ -37,10 +50,7 @@ class Agent():
 
     # returns coordinates of the first bomb placed by a unit
     def _get_bomb_to_detonate(self, unit) -> Union[int, int] or None:
-        entities = self._client._state.get("entities")
-        bombs = list(filter(lambda entity: entity.get(
-            "unit_id") == unit and entity.get("type") == "b", entities))
-        bomb = next(iter(bombs or []), None)
+        bomb = next(iter(self._client.bombs_of(unit)), None)
         if bomb != None:
             return [bomb.get("x"), bomb.get("y")]
         else:
@@ -52,29 +62,20 @@ class Agent():
         my_agent_id = game_state.get("connection").get("agent_id")
         my_units = game_state.get("agents").get(my_agent_id).get("unit_ids")
 
-        # send each unit a random action
-        for unit_id in my_units:
-
-            action = random.choice(actions)
+        # pick every unit's random action first, then send them together
+        # ("detonate" sets off the unit's oldest bomb, if it has one)
+        tick_actions = {unit_id: random.choice(actions) for unit_id in my_units}
+        await self._client.send_actions(tick_actions)
 
-            if action in ["up", "left", "right", "down"]:
-                await self._client.send_move(action, unit_id)
-            elif action == "bomb":
-                await self._client.send_bomb(unit_id)
-            elif action == "detonate":
-                bomb_coordinates = self._get_bomb_to_detonate(unit_id)
-                if bomb_coordinates != None:
-                    x, y = bomb_coordinates
-                    await self._client.send_detonate(x, y, unit_id)
-            else:
-                print(f"Unhandled action: {action} for unit {unit_id}")
+        if trace_summary_every and tick_number % trace_summary_every == 0:
+            print(self._client.tracer.summary())
 
 
 def main():
     for i in range(0,10):
         while True:
             try:
-                Agent()
+                Agent(MCTSPlanner() if agent_kind == "mcts" else None)
             except Exception as e:
                 print(e)
                 time.sleep(5)
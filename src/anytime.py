@@ -0,0 +1,103 @@
+## Anytime decisions against the tick deadline.
+##
+## A plain tick callback is awaited for as long as it takes, so a slow planner
+## misses ticks. AnytimeDecider is a tick callback that gives the decision
+## function a Decision with a deadline instead. The function keeps improving
+## its answer and publishes the best actions found so far. When it returns, or
+## the deadline comes (whichever is first), the last published actions are sent.
+##
+## The deadline is the time the tick frame was received plus the tick budget
+## (1 / config["tick_rate_hz"]), minus the time sending the actions took on
+## recent ticks and a safety margin. Decoding and applying the frame needs no
+## allowance of its own, it is already behind us when counting from the receive.
+##
+## The decision function can be:
+##   async def decide(decision, tick, game_state)  runs on the event loop, should
+##       await now and then (asyncio.sleep(0)) so the deadline can fire, and is
+##       cancelled at the deadline
+##   def decide(decision, tick, game_state)  runs in a worker thread and should
+##       stop when decision.expired is set, publishing after that does nothing
+
+import asyncio
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional
+
+from classes import Action
+
+## budget when the game config has no tick_rate_hz yet
+DEFAULT_TICK_RATE_HZ = 10
+
+
+class Decision:
+    def __init__(self, tick: int, deadline: float):
+        self.tick = tick
+        ## time.perf_counter() the actions have to be sent by
+        self.deadline = deadline
+        self.best: Dict[str, Action] = {}
+        ## number of publish calls that were taken
+        self.improvements = 0
+        self.expired = False
+
+    def time_left(self) -> float:
+        return self.deadline - time.perf_counter()
+
+    ## Replace the best-so-far actions ({unit_id: action}), units left out do nothing
+    def publish(self, actions: Dict[str, Action]):
+        if self.expired:
+            return
+        self.best = dict(actions)
+        self.improvements += 1
+
+
+class AnytimeDecider:
+    def __init__(self, client, decide: Callable, safety_margin: float = 0.005, overhead_window: int = 64):
+        self._client = client
+        self._decide = decide
+        self.safety_margin = safety_margin
+        ## seconds spent sending the actions on recent ticks, the largest is used
+        self._overheads: Deque[float] = deque(maxlen=overhead_window)
+        ## ticks where the decision function was still running at the deadline
+        self.cut_short = 0
+        self.last_decision: Optional[Decision] = None
+
+    @property
+    def overhead(self) -> float:
+        return max(self._overheads, default=0.0)
+
+    def budget(self) -> float:
+        config = self._client.config or {}
+        return 1.0 / (config.get("tick_rate_hz") or DEFAULT_TICK_RATE_HZ)
+
+    async def __call__(self, tick_number: int, game_state: dict):
+        started = time.perf_counter()
+        trace = self._client.current_trace
+        received_at = started if trace is None else trace.received_at
+        deadline = received_at + self.budget() - self.overhead - self.safety_margin
+        decision = self.last_decision = Decision(tick_number, deadline)
+
+        if asyncio.iscoroutinefunction(self._decide):
+            task = asyncio.ensure_future(self._decide(decision, tick_number, game_state))
+        else:
+            task = asyncio.get_running_loop().run_in_executor(None, self._decide, decision, tick_number, game_state)
+        try:
+            done, _ = await asyncio.wait({task}, timeout=max(0.0, deadline - time.perf_counter()))
+        except asyncio.CancelledError:
+            ## superseded by a newer tick (GameState._schedule_decision), nothing is sent
+            decision.expired = True
+            task.cancel()
+            raise
+        decision.expired = True
+        if not done:
+            self.cut_short += 1
+            ## a thread can't be cancelled, it sees decision.expired instead
+            task.cancel()
+        elif not task.cancelled() and task.exception() is not None:
+            print(f"decision for tick {tick_number} failed: {task.exception()!r}")
+
+        sending = time.perf_counter()
+        await self.send(decision.best)
+        self._overheads.append(time.perf_counter() - sending)
+
+    async def send(self, actions: Dict[str, Action]):
+        await self._client.send_actions(actions)
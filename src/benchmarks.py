@@ -0,0 +1,415 @@
+## Throughput benchmarks for the client's hot paths.
+##
+##   python benchmarks.py [--out results.json] [--min-time 1.0] [--only decode,...]
+##   python benchmarks.py compare before.json after.json
+##
+## Every case times one operation at a time with perf_counter_ns and reports
+## ops/sec (operations over the time spent in them) and latency percentiles in
+## microseconds. The results file also records the commit, python and numpy
+## versions, so runs from different commits can be put side by side with
+## `compare`.
+##
+## Fixtures are the states the tests already use: mock_state from the starter
+## test_game_state.py, mock_6x6_state from dev_gym.py (both read out of the files
+## with ast, the starter modules aren't imported) and the replay at
+## starter/agents/replay.json, whose 200 ticks of events drive the per-tick cases.
+##
+## Cases:
+##   decode/*       parsing game_state and tick frames with each installed JSON backend
+##   apply/*        GameState._on_game_tick, one op per replay tick
+##   observation/*  ObservationBuilder builds, per tick patching, to_array and the
+##                  compact uint8 layout
+##   successors/*   simulator.successors of the first agent's units, one op per state
+##   forward/*      Gym env.step round trips against a local_server.LocalServer on 127.0.0.1
+##   send/*         one tick's actions for three units, sent one by one and with send_actions
+##   policy/*       PolicyRunner over 16 games of three units: one batch against one pass per unit
+
+import argparse
+import ast
+import asyncio
+import contextlib
+import copy
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+import packets
+from game_state import GameState
+from local_server import LocalServer
+from observation import ObservationBuilder, observation_buffer
+from simulator import SimState, successors
+
+_here = os.path.dirname(os.path.abspath(__file__))
+STARTER_DIR = os.path.join(_here, "..", "starter", "agents", "python3")
+REPLAY_PATH = os.path.join(_here, "..", "starter", "agents", "replay.json")
+
+PERCENTILES = (50, 90, 99)
+
+
+## Top level assignments of literal values in a python file
+def _literals(path: str, names: Iterable[str]) -> Dict[str, object]:
+    wanted = set(names)
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    found = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1:
+            target, value = node.targets[0], node.value
+        elif isinstance(node, ast.AnnAssign):
+            target, value = node.target, node.value
+        else:
+            continue
+        if isinstance(target, ast.Name) and target.id in wanted:
+            found[target.id] = ast.literal_eval(value)
+    missing = wanted - set(found)
+    if missing:
+        raise Exception(f"{path} has no literal {', '.join(sorted(missing))}")
+    return found
+
+
+## name -> game_state payload with a connection, as the server sends it
+def load_fixtures() -> Dict[str, dict]:
+    mock_state = _literals(os.path.join(STARTER_DIR, "test_game_state.py"), ["mock_state"])["mock_state"]
+    mock_6x6 = _literals(os.path.join(STARTER_DIR, "dev_gym.py"), ["mock_6x6_state"])["mock_6x6_state"]
+    replay = load_replay()
+    fixtures = {"mock_state": mock_state, "mock_6x6_state": mock_6x6, "replay": replay["initial_state"]}
+    for state in fixtures.values():
+        state.setdefault("connection", {"id": 1, "role": "agent", "agent_id": "a"})
+        ## mock_state predates the current schema's unit fields
+        for unit in state["unit_state"].values():
+            unit.setdefault("invulnerable", unit.pop("invulnerability", 0))
+            unit.setdefault("stunned", 0)
+    return fixtures
+
+
+def load_replay() -> dict:
+    with open(REPLAY_PATH) as f:
+        return json.load(f)["payload"]
+
+
+def summarise(samples_ns: List[int]) -> dict:
+    samples = np.asarray(samples_ns, dtype=np.float64) / 1000.0
+    total = samples.sum()
+    result = {"ops": len(samples), "ops_per_sec": len(samples) / (total / 1e6) if total > 0 else float("inf"),
+              "mean_us": float(samples.mean())}
+    for p, value in zip(PERCENTILES, np.percentile(samples, PERCENTILES)):
+        result[f"p{p}_us"] = float(value)
+    return result
+
+
+## Time op() until min_time seconds of it were measured (at least min_ops calls)
+def measure(op: Callable[[], object], min_time: float, min_ops: int = 10) -> dict:
+    samples = []
+    spent, deadline = 0, min_time * 1e9
+    while spent < deadline or len(samples) < min_ops:
+        start = time.perf_counter_ns()
+        op()
+        elapsed = time.perf_counter_ns() - start
+        samples.append(elapsed)
+        spent += elapsed
+    return summarise(samples)
+
+
+## Time a stream of operations: each pass calls prepare() untimed, then times
+## every op in the sequence it returns. For ops that depend on the ones before
+## them, like the ticks of a replay
+def measure_passes(prepare: Callable[[], Iterable[Callable[[], object]]], min_time: float) -> dict:
+    samples, spent = [], 0
+    while spent < min_time * 1e9 or not samples:
+        for op in prepare():
+            start = time.perf_counter_ns()
+            op()
+            elapsed = time.perf_counter_ns() - start
+            samples.append(elapsed)
+            spent += elapsed
+    return summarise(samples)
+
+
+async def measure_passes_async(prepare, min_time: float) -> dict:
+    samples, spent = [], 0
+    while spent < min_time * 1e9 or not samples:
+        for op in await prepare():
+            start = time.perf_counter_ns()
+            await op()
+            elapsed = time.perf_counter_ns() - start
+            samples.append(elapsed)
+            spent += elapsed
+    return summarise(samples)
+
+
+def bench_decode(fixtures: Dict[str, dict], replay: dict, min_time: float) -> Dict[str, dict]:
+    ticks = [json.dumps({"type": "tick", "payload": tick}) for tick in replay["history"]]
+    results = {}
+    for backend, loads in packets.BACKENDS.items():
+        for name, state in fixtures.items():
+            raw = json.dumps({"type": "game_state", "payload": state})
+            results[f"decode/game_state/{name}/{backend}"] = measure(lambda: loads(raw), min_time)
+        results[f"decode/tick/replay/{backend}"] = measure_passes(
+            lambda: [lambda raw=raw: loads(raw) for raw in ticks], min_time)
+    return results
+
+
+## A GameState that has taken the game_state packet, as after the first frame
+def _client(state: dict) -> GameState:
+    client = GameState("")
+    client._on_game_state(copy.deepcopy(state))
+    return client
+
+
+def bench_apply(replay: dict, min_time: float) -> Dict[str, dict]:
+    state = dict(replay["initial_state"], connection={"id": 1, "role": "agent", "agent_id": "a"})
+
+    async def prepare():
+        client = _client(state)
+        history = copy.deepcopy(replay["history"])
+        return [lambda tick=tick: client._on_game_tick(tick) for tick in history]
+
+    return {"apply/tick/replay": asyncio.run(measure_passes_async(prepare, min_time))}
+
+
+def bench_observation(fixtures: Dict[str, dict], replay: dict, min_time: float) -> Dict[str, dict]:
+    results = {}
+    for name, state in fixtures.items():
+        results[f"observation/from_game_state/{name}"] = measure(lambda: ObservationBuilder.from_game_state(state),
+                                                               min_time)
+
+    def prepare():
+        builder = ObservationBuilder.from_game_state(replay["initial_state"])
+        return [lambda tick=tick: builder.on_tick(tick) for tick in copy.deepcopy(replay["history"])]
+
+    results["observation/on_tick/replay"] = measure_passes(prepare, min_time)
+    builder = ObservationBuilder.from_game_state(replay["initial_state"])
+    out = np.empty_like(builder.to_array())
+    results["observation/to_array/replay"] = measure(lambda: builder.to_array(out), min_time)
+    compact = observation_buffer(builder.width, builder.height)
+    results["observation/write_compact/replay"] = measure(lambda: builder.write_compact(compact), min_time)
+    board = SimState.from_game_state(replay["initial_state"]).to_board_state()
+    results["observation/to_observation/replay"] = measure(lambda: board.to_observation(compact), min_time)
+    return results
+
+
+def bench_successors(fixtures: Dict[str, dict], min_time: float) -> Dict[str, dict]:
+    results = {}
+    for name, state in fixtures.items():
+        sim = SimState.from_game_state(state)
+        ## units can't act on tick 0
+        sim.tick = max(sim.tick, 1)
+        unit_ids = state["agents"][sim.agent_ids[0]]["unit_ids"]
+        counts = []
+        results[f"successors/{name}"] = measure(lambda: counts.append(sum(1 for _ in successors(sim, unit_ids))),
+                                                min_time, min_ops=3)
+        results[f"successors/{name}"]["successors"] = counts[0]
+    return results
+
+
+async def _bench_forward(fixtures: Dict[str, dict], min_time: float, concurrency: Iterable[int]) -> Dict[str, dict]:
+    if STARTER_DIR not in sys.path:
+        ## after src, the starter has a game_state module of its own
+        sys.path.append(STARTER_DIR)
+    from gym import Gym
+
+    server = LocalServer()
+    uri = await server.start()
+    results = {}
+    try:
+        gym = Gym(uri + "/?role=admin")
+        await gym.connect()
+        for name, state in fixtures.items():
+            initial = {key: value for key, value in state.items() if key != "connection"}
+            for n_envs in concurrency:
+                envs = [gym.make(f"{name}-{n_envs}-{i}", copy.deepcopy(initial)) for i in range(n_envs)]
+
+                async def step_all():
+                    return await asyncio.gather(*(env.step([]) for env in envs))
+
+                samples, spent = [], 0
+                while spent < min_time * 1e9 or len(samples) < 10:
+                    start = time.perf_counter_ns()
+                    await step_all()
+                    elapsed = time.perf_counter_ns() - start
+                    samples.append(elapsed)
+                    spent += elapsed
+                result = summarise(samples)
+                ## one op is a round of n_envs steps, count steps
+                result["steps_per_sec"] = result["ops_per_sec"] * n_envs
+                results[f"forward/step/{name}/x{n_envs}"] = result
+                for env in envs:
+                    await env.reset()
+        await gym.close()
+    finally:
+        await server.close()
+    return results
+
+
+def bench_forward(fixtures: Dict[str, dict], min_time: float, concurrency: Iterable[int] = (1, 16)) -> Dict[str, dict]:
+    ## Gym prints on reset
+    with contextlib.redirect_stdout(io.StringIO()):
+        return asyncio.run(_bench_forward(fixtures, min_time, concurrency))
+
+
+async def _bench_send(state: dict, min_time: float) -> Dict[str, dict]:
+    ## a game that never starts, the server reads the actions and drops them
+    server = LocalServer(initial_state=state, wait_for=("a", "b"))
+    uri = await server.start()
+    client = GameState(uri + "/?role=agent&agentId=agentA")
+    connection = await client.connect()
+    receiving = asyncio.ensure_future(client._handle_messages(connection))
+    try:
+        unit_ids = state["agents"]["a"]["unit_ids"]
+        tick_actions = dict(zip(unit_ids, ("up", "bomb", "left")))
+
+        async def serial():
+            for unit_id, action in tick_actions.items():
+                if action == "bomb":
+                    await client.send_bomb(unit_id)
+                else:
+                    await client.send_move(action, unit_id)
+
+        async def batch():
+            await client.send_actions(tick_actions)
+
+        results = {}
+        for name, op in (("serial", serial), ("batch", batch)):
+            async def prepare():
+                return [op] * 100
+            results[f"send/tick_actions/{name}"] = await measure_passes_async(prepare, min_time)
+        return results
+    finally:
+        await connection.close()
+        await receiving
+        await server.close()
+
+
+## Time to get one tick's actions for all of an agent's units on the wire, one
+## awaited send per unit against GameState.send_actions
+def bench_send(fixtures: Dict[str, dict], min_time: float) -> Dict[str, dict]:
+    with contextlib.redirect_stdout(io.StringIO()):
+        return asyncio.run(_bench_send(fixtures["replay"], min_time))
+
+
+## One forward pass for every unit of 16 games against one pass per unit, with
+## the model as it is, scripted and quantized (policy_runner.ConvPolicy)
+def bench_policy(replay: dict, min_time: float, games: int = 16) -> Dict[str, dict]:
+    import torch
+    from policy_runner import ConvPolicy, PolicyRunner
+
+    state = replay["initial_state"]
+    observation = ObservationBuilder.from_game_state(state).to_array()
+    observations = np.stack([observation] * games)
+    coordinates = [unit["coordinates"] for unit in state["unit_state"].values()][:3]
+    game_index = np.repeat(np.arange(games), len(coordinates))
+    xs = np.array([x for x, _ in coordinates] * games)
+    ys = np.array([y for _, y in coordinates] * games)
+    torch.manual_seed(0)
+    model = ConvPolicy(state["world"]["width"], state["world"]["height"])
+    results = {}
+    for name, options in (("eager", {}), ("script", {"script": True}), ("quantized", {"quantize": True, "script": True})):
+        runner = PolicyRunner(model, **options)
+        results[f"policy/batch/{name}"] = measure(lambda: runner.act(observations, game_index, xs, ys), min_time)
+        results[f"policy/per_unit/{name}"] = measure(
+            lambda: [runner.act(observations, game_index[i:i + 1], xs[i:i + 1], ys[i:i + 1])
+                     for i in range(len(game_index))], min_time)
+        runner.close()
+    for result in results.values():
+        result["units"] = len(game_index)
+    return results
+
+
+GROUPS = ("decode", "apply", "observation", "successors", "forward", "send", "policy")
+
+
+def run(groups: Iterable[str] = GROUPS, min_time: float = 1.0) -> dict:
+    groups = list(groups)
+    unknown = set(groups) - set(GROUPS)
+    if unknown:
+        raise Exception(f"unknown benchmark groups {', '.join(sorted(unknown))}, expected some of {', '.join(GROUPS)}")
+    fixtures = load_fixtures()
+    replay = load_replay()
+    results = {}
+    for group in groups:
+        if group == "decode":
+            results.update(bench_decode(fixtures, replay, min_time))
+        elif group == "apply":
+            results.update(bench_apply(replay, min_time))
+        elif group == "observation":
+            results.update(bench_observation(fixtures, replay, min_time))
+        elif group == "successors":
+            results.update(bench_successors(fixtures, min_time))
+        elif group == "forward":
+            results.update(bench_forward(fixtures, min_time))
+        elif group == "send":
+            results.update(bench_send(fixtures, min_time))
+        elif group == "policy":
+            results.update(bench_policy(replay, min_time))
+    return {"meta": environment(), "results": results}
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=_here, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "python": platform.python_version(),
+            "numpy": np.__version__, "machine": platform.machine(), "packet_backend": packets.BACKEND}
+
+
+## Lines comparing two results files case by case, speedup is new ops/sec over old
+def compare(old: dict, new: dict) -> List[str]:
+    lines = [f"{'case':<48} {'old ops/s':>12} {'new ops/s':>12} {'speedup':>8} {'old p99':>10} {'new p99':>10}"]
+    old_results, new_results = old["results"], new["results"]
+    for case in sorted(set(old_results) | set(new_results)):
+        before, after = old_results.get(case), new_results.get(case)
+        if before is None or after is None:
+            lines.append(f"{case:<48} {'only in ' + ('new' if before is None else 'old'):>12}")
+            continue
+        lines.append(f"{case:<48} {before['ops_per_sec']:12.1f} {after['ops_per_sec']:12.1f}"
+                     f" {after['ops_per_sec'] / before['ops_per_sec']:7.2f}x"
+                     f" {before['p99_us']:8.1f}us {after['p99_us']:8.1f}us")
+    return lines
+
+
+def format_results(results: dict) -> List[str]:
+    lines = [f"{'case':<48} {'ops/s':>12} " + " ".join(f"{f'p{p}':>10}" for p in PERCENTILES)]
+    for case, result in results["results"].items():
+        lines.append(f"{case:<48} {result['ops_per_sec']:12.1f} "
+                     + " ".join(f"{result[f'p{p}_us']:8.1f}us" for p in PERCENTILES))
+    return lines
+
+
+def main(argv: Optional[List[str]] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["compare"]:
+        if len(argv) != 3:
+            raise SystemExit("usage: benchmarks.py compare OLD.json NEW.json")
+        with open(argv[1]) as f:
+            old = json.load(f)
+        with open(argv[2]) as f:
+            new = json.load(f)
+        print(f"old {old['meta'].get('commit')}, new {new['meta'].get('commit')}")
+        print("\n".join(compare(old, new)))
+        return
+
+    parser = argparse.ArgumentParser(description="Benchmark decoding, event application, observations, "
+                                                 "successor generation and forward model round trips")
+    parser.add_argument("--out", help="write the results as JSON to this file")
+    parser.add_argument("--min-time", type=float, default=1.0, help="seconds measured per case")
+    parser.add_argument("--only", default=",".join(GROUPS), help=f"comma separated groups of {', '.join(GROUPS)}")
+    args = parser.parse_args(argv)
+
+    results = run([group for group in args.only.split(",") if group], args.min_time)
+    print("\n".join(format_results(results)))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
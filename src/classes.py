@@ -1,6 +1,13 @@
 from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 import torch
 
+## Actions a unit can take on a tick. A detonate can carry the coordinates of
+## the bomb to set off as ("detonate", x, y); a bare "detonate" targets the
+## unit's oldest bomb
+Action = Union[str, Tuple[str, int, int]]
+ACTIONS = ("up", "down", "left", "right", "bomb", "detonate")
+
 
 @dataclass
 class Coordinate:
@@ -17,6 +24,11 @@ class UnitState:
     bomb: int
     ammunition: int
     invulnerability: int
+    stunned: int = 0
+
+    ## units are drawn as a 1 where they stand, like the other markers
+    def update_map(self, target: torch.Tensor):
+        target[self.coord.x, self.coord.y] = 1
 
 
 # state = UnitState(
@@ -44,6 +56,7 @@ class Entity:
     #   o: oreBlock (destructible)
     #   a: ammo
     #   bp:blast radius powerup
+    #   fp: freeze powerup
     #   b: bomb
     #   x: explosion
     #   x: end game fire
@@ -90,6 +103,12 @@ class Ammo(Pickup):
     hp: int
     pass
 
+@dataclass
+class Freeze(Pickup):
+    expires: int
+    hp: int
+    pass
+
 @dataclass
 class Bomb(Entity):
     owner: str
@@ -101,7 +120,7 @@ class Bomb(Entity):
     ## so we can't just use the initial plan of
     ## the bomb map being the fire map
     def call(self):
-        return torch.tensor([self.expires, self.hp, self.blastDiamter])
+        return torch.tensor([self.expires, self.hp, self.blastDiameter])
 
     def update_map(self, target: torch.Tensor):
         target[..., self.coord.x, self.coord.y] = self.call()
@@ -118,7 +137,8 @@ class Fire(Entity):
     owner: str = None
 
     def call(self):
-        return torch.tensor(self.expires)
+        ## end game fire has no expiry, it gets the largest int32 like in observation.py
+        return torch.tensor(self.expires if self.expires is not None else torch.iinfo(torch.int32).max)
 
 ## Every turn, we will get a response from the api. With this class:
 ## 1. We parse the API response into a board state that contains python objects
@@ -132,16 +152,39 @@ class BoardState:
     width: int
     height: int
     tick: int
-    entities: List[Entity]
+    ## a list of entity dataclasses or an entity_store.EntityStore
+    entities: Sequence[Entity]
+    ## the "config" block of the game state (game_duration_ticks, etc.)
+    config: Optional[Dict] = None
 
     ## Determine all possible board permutations from this state for a tree-search agent
-    ## Essentially generates all possible results of the "tick" function
-    def permute_all(self) -> list['BoardState']:
-        return None
-        ## return <all possible moved states>
-
-
-    ## Convert to tensors to use in an RL model
+    ## Essentially generates all possible results of the "next_state" function:
+    ## yields (actions, state) for each distinct successor, see simulator.successors
+    ## for what is pruned. Only units in unit_ids act (default: all of them)
+    def permute_all(self, unit_ids: Optional[Iterable[str]] = None) -> Iterator[Tuple[Dict[str, Action], 'BoardState']]:
+        from simulator import SimState, successors
+        for actions, state in successors(SimState.from_board_state(self), unit_ids):
+            yield actions, state.to_board_state()
+
+
+    ## Zobrist hash of the cells, units and tick, so states can be used as cache keys
+    ## even though entities is a list. Entity order does not matter
+    def zobrist_hash(self) -> int:
+        from simulator import SimState
+        return SimState.from_board_state(self).zobrist_hash()
+
+    def __hash__(self) -> int:
+        return self.zobrist_hash()
+
+    ## Fixed channel layout observation written into `out`, one compact uint8
+    ## [len(COMPACT_CHANNELS), W, H] buffer that can be reused from tick to tick.
+    ## See observation.py for the channel spec
+    def to_observation(self, out: Optional['np.ndarray'] = None) -> 'np.ndarray':
+        from observation import write_board_observation
+        return write_board_observation(self, out)
+
+    ## Convert to tensors to use in an RL model, one int32 map per class
+    ## (to_observation is the compact single buffer version)
     # def to_learnable(self) -> None:
     def to_learnable(self) -> dict[type, torch.Tensor]:
         unit_map = torch.zeros([self.width, self.height], dtype=torch.int32)
@@ -150,7 +193,8 @@ class BoardState:
         # pickup_map = torch.zeros([self.width, self.height], dtype=torch.int32)
         radius_map = torch.zeros([self.width, self.height], dtype=torch.int32)
         ammo_map = torch.zeros([self.width, self.height], dtype=torch.int32)
-        bomb_map = torch.zeros([2, self.width, self.height], dtype=torch.int32)
+        freeze_map = torch.zeros([self.width, self.height], dtype=torch.int32)
+        bomb_map = torch.zeros([3, self.width, self.height], dtype=torch.int32)
         fire_map = torch.zeros([self.width, self.height], dtype=torch.int32)
         
         table = {
@@ -160,12 +204,14 @@ class BoardState:
             # Pickup: pickup_map,
             Ammo: ammo_map,
             Radius: radius_map,
+            Freeze: freeze_map,
             Bomb: bomb_map,
             Fire: fire_map
         }
 
         for entity in self.entities:
-            class_map = table[type(entity)]
+            ## entities from an EntityStore are view subclasses of these classes
+            class_map = table[next(cls for cls in type(entity).__mro__ if cls in table)]
             entity.update_map(class_map)
 
             ## just have a method in entity class that takes a map and updates it with the result of its call
@@ -175,6 +221,11 @@ class BoardState:
         return table
 
     ## Move units, etc
-    def tick(actions: Dict[Entity, Action]) -> BoardState:
-        pass
+    ## actions are keyed by unit id, units without an entry do nothing this tick.
+    ## Runs the in-process simulator (see simulator.py) so no engine round trip
+    ## is needed; random item drops are skipped unless an rng is given.
+    ## (named next_state since `tick` is the tick number field)
+    def next_state(self, actions: Dict[str, Action], rng=None) -> 'BoardState':
+        from simulator import SimState, step
+        return step(SimState.from_board_state(self), actions, rng).to_board_state()
 
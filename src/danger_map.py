@@ -0,0 +1,191 @@
+## Where and when the board will be on fire.
+##
+## DangerMap works out, for every cell, the ticks at which it will burn given the
+## bombs and fire on the board now. A bomb goes off when it expires, or earlier
+## when the blast of a bomb that goes off before it reaches it (chains are
+## followed to the end). A blast covers its cell and travels (diameter - 1) // 2
+## cells along each axis, stopping at the first cell that is not empty or fire;
+## that cell is hit (a bomb there is set off) but the blast goes no further. Hit
+## cells burn from the tick of the blast for blast_duration_ticks.
+##
+## Times are ticks from the state's tick: 0 is now, 1 the next tick. `earliest`
+## is the [W, H] first tick a cell burns (NEVER if it doesn't), fire_times(T) is
+## the [T, W, H] earliest-fire-time tensor: for each of the next T ticks t, the
+## first tick from t on that the cell burns (NEVER if not before T), and
+## burning(T) is the [T, W, H] mask of cells burning at each of those ticks.
+##
+## Blocks are taken as they are now: a block that an earlier blast destroys
+## still stops a later one. Bombs a unit could detonate early are only counted at
+## their expiry unless assume_detonation is set, then every armed bomb (and every
+## bomb once it is armed) is taken to go off as soon as it can.
+##
+## The map is kept up to date as the board changes: add_bomb / remove_bomb,
+## add_fire and clear_block only recompute the blasts they touch (the bomb's own
+## and those that cross its cell), then re-run the
+## chain resolution, which is a fixed point over a [B, B] matrix.
+
+from typing import Optional
+
+import numpy as np
+
+from classes import BoardState
+from simulator import (SimState, SimConfig, EMPTY, FIRE, BOMB, KIND, EXPIRES, CREATED, DIAMETER, NO_EXPIRY)
+
+## earliest time of cells that never burn
+NEVER = int(np.iinfo(np.int32).max)
+_DIRECTIONS = ((0, 1), (0, -1), (-1, 0), (1, 0))
+
+
+class DangerMap:
+    def __init__(self, width: int, height: int, tick: int, blocking: np.ndarray, config: SimConfig = SimConfig(),
+                 assume_detonation: bool = False):
+        self.width = width
+        self.height = height
+        self.tick = tick
+        self.config = config
+        self.assume_detonation = assume_detonation
+        ## [W, H] cells a blast stops at (bombs included)
+        self._blocking = blocking.astype(bool)
+        ## one row per bomb: x, y, radius and the tick it goes off by itself
+        self._bombs = np.zeros((0, 4), dtype=np.int64)
+        ## [B, W, H] cells each bomb's blast reaches
+        self._cover = np.zeros((0, width, height), dtype=bool)
+        ## [W, H] ticks from now that the fire already on the board burns until
+        self._fire_until = np.full((width, height), -1, dtype=np.int64)
+        ## [B] tick each bomb goes off once chains are resolved
+        self.times = np.zeros(0, dtype=np.int64)
+
+    @staticmethod
+    def from_sim_state(state: SimState, assume_detonation: bool = False) -> 'DangerMap':
+        board = state.board
+        kind = board[KIND]
+        danger = DangerMap(state.width, state.height, state.tick, (kind != EMPTY) & (kind != FIRE),
+                           state.config, assume_detonation)
+        xs, ys = np.nonzero(kind == FIRE)
+        for x, y in zip(xs.tolist(), ys.tolist()):
+            danger.add_fire(x, y, board.item(EXPIRES, x, y))
+        xs, ys = np.nonzero(kind == BOMB)
+        danger._add_bombs(xs, ys, board[DIAMETER, xs, ys], board[EXPIRES, xs, ys], board[CREATED, xs, ys])
+        return danger
+
+    @staticmethod
+    def from_board_state(state: BoardState, assume_detonation: bool = False) -> 'DangerMap':
+        return DangerMap.from_sim_state(SimState.from_board_state(state), assume_detonation)
+
+    ## A bomb placed at (x, y) (created is the tick it was placed)
+    def add_bomb(self, x: int, y: int, diameter: int, expires: int, created: Optional[int] = None):
+        self._blocking[x, y] = True
+        ## blasts that passed through the cell now stop at the new bomb
+        self._recover(x, y)
+        self._add_bombs(np.array([x]), np.array([y]), np.array([diameter]), np.array([expires]),
+                        np.array([self.tick if created is None else created]))
+
+    ## A bomb that went off or is gone, its blast is not coming any more
+    def remove_bomb(self, x: int, y: int):
+        keep = ~((self._bombs[:, 0] == x) & (self._bombs[:, 1] == y))
+        self._bombs, self._cover = self._bombs[keep], self._cover[keep]
+        self._blocking[x, y] = False
+        self._recover(x, y)
+        self._resolve_chains()
+
+    ## Fire at (x, y) until the `expires` tick (NO_EXPIRY for end game fire)
+    def add_fire(self, x: int, y: int, expires: int):
+        until = NEVER if expires == NO_EXPIRY else expires - self.tick - 1
+        self._fire_until[x, y] = max(self._fire_until[x, y], until)
+
+    ## A block (or pickup) at (x, y) is gone, blasts may now travel through it
+    def clear_block(self, x: int, y: int):
+        self._blocking[x, y] = False
+        self._recover(x, y)
+        self._resolve_chains()
+
+    ## Move the map on to a later tick, times stay relative to the current tick
+    def advance(self, ticks: int = 1):
+        self.tick += ticks
+        self._bombs[:, 3] -= ticks
+        self._fire_until = np.where(self._fire_until == NEVER, NEVER, self._fire_until - ticks)
+        self._resolve_chains()
+
+    ## [W, H] first tick from now each cell burns, NEVER if it doesn't
+    @property
+    def earliest(self) -> np.ndarray:
+        earliest = np.where(self._fire_until >= 0, 0, NEVER)
+        if len(self.times):
+            blast = np.where(self._cover, self.times[:, None, None], NEVER).min(axis=0)
+            earliest = np.minimum(earliest, blast)
+        return earliest
+
+    ## [horizon, W, H] whether each cell burns at each of the next `horizon` ticks
+    def burning(self, horizon: int) -> np.ndarray:
+        out = np.zeros((horizon, self.width, self.height), dtype=bool)
+        ticks = np.arange(horizon)[:, None, None]
+        out |= ticks <= self._fire_until[None]
+        duration = self.config.blast_duration_ticks
+        for cover, start in zip(self._cover, self.times.tolist()):
+            if start < horizon:
+                out[max(start, 0):start + duration] |= cover
+        return out
+
+    ## [horizon, W, H] first tick from t on that each cell burns, for each of the
+    ## next `horizon` ticks t. NEVER if it doesn't burn before the horizon
+    def fire_times(self, horizon: int) -> np.ndarray:
+        ticks = np.arange(horizon, dtype=np.int64)[:, None, None]
+        times = np.where(self.burning(horizon), ticks, NEVER)
+        return np.minimum.accumulate(times[::-1], axis=0)[::-1]
+
+    def _add_bombs(self, xs, ys, diameters, expires, created):
+        if len(xs) == 0:
+            return
+        start = expires - self.tick
+        if self.assume_detonation:
+            armed_at = created + self.config.bomb_armed_ticks + 1 - self.tick
+            start = np.minimum(start, np.maximum(armed_at, 1))
+        rows = np.stack([xs, ys, (np.asarray(diameters) - 1) // 2, start], axis=1).astype(np.int64)
+        self._bombs = np.concatenate([self._bombs, rows])
+        self._cover = np.concatenate([self._cover, self._blast_cover(rows)])
+        self._resolve_chains()
+
+    ## [len(rows), W, H] cells reached by each bomb, all bombs stepped together
+    def _blast_cover(self, rows: np.ndarray) -> np.ndarray:
+        n = len(rows)
+        cover = np.zeros((n, self.width, self.height), dtype=bool)
+        bombs = np.arange(n)
+        x, y, radius = rows[:, 0], rows[:, 1], rows[:, 2]
+        cover[bombs, x, y] = True
+        for dx, dy in _DIRECTIONS:
+            travelling = np.ones(n, dtype=bool)
+            for distance in range(1, int(radius.max(initial=0)) + 1):
+                cx, cy = x + dx * distance, y + dy * distance
+                travelling &= (distance <= radius) & (cx >= 0) & (cx < self.width) & (cy >= 0) & (cy < self.height)
+                if not travelling.any():
+                    break
+                b, cx, cy = bombs[travelling], cx[travelling], cy[travelling]
+                cover[b, cx, cy] = True
+                ## the blast hits the blocking cell and stops there
+                travelling[b[self._blocking[cx, cy]]] = False
+        return cover
+
+    ## Recompute the blasts that reach (x, y), whether it blocks changed
+    def _recover(self, x: int, y: int):
+        touched = np.nonzero(self._cover[:, x, y])[0]
+        if len(touched):
+            self._cover[touched] = self._blast_cover(self._bombs[touched])
+
+    def _resolve_chains(self):
+        bombs = self._bombs
+        times = bombs[:, 3].copy()
+        if len(bombs) > 1:
+            ## reaches[a, b]: a's blast sets off b
+            reaches = self._cover[:, bombs[:, 0], bombs[:, 1]]
+            np.fill_diagonal(reaches, False)
+            while True:
+                chained = np.minimum(times, np.where(reaches, times[:, None], NEVER).min(axis=0))
+                if np.array_equal(chained, times):
+                    break
+                times = chained
+        self.times = times
+
+
+## [horizon, W, H] earliest-fire-time tensor of the state, see DangerMap.fire_times
+def danger_map(state: BoardState, horizon: int, assume_detonation: bool = False) -> np.ndarray:
+    return DangerMap.from_board_state(state, assume_detonation).fire_times(horizon)
@@ -0,0 +1,173 @@
+## Cached shortest-path distances over the board.
+##
+## A distance field is the number of moves from the nearest of a set of source
+## cells to every cell, walking through cells units can enter (empty, pickups and
+## fire; metal, wooden and ore blocks and bombs are in the way). UNREACHABLE
+## marks cells that can't be reached. Fields are computed by multi-source BFS on
+## whole boards at a time (one array shift per direction per step), and several
+## fields can be grown together as a [N, W, H] stack.
+##
+## Fields are cached by their source cells for the current blocking layer. When
+## the layer changes (set_cell, on_event, sync) only the fields the change can
+## affect are dropped:
+##   a cell opens (a block burnt, a bomb gone): fields with a reachable neighbour
+##   a cell closes (a bomb placed): fields that reached the cell
+## Metal never changes, so most fields live for many ticks, and fields of the
+## same sources are shared by every agent that asks for them. At most
+## `max_fields` fields are kept, the least recently used go first, so a long game
+## with units all over the board doesn't pile up fields (each of which set_cell
+## has to look at).
+
+from collections import OrderedDict
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+
+from classes import BoardState
+from simulator import (SimState, ENTITY_CODES, PASSABLE, KIND, EMPTY, AMMO, BLAST_POWERUP, FREEZE_POWERUP,
+                       UX, UY, UHP)
+
+UNREACHABLE = int(np.iinfo(np.int32).max)
+_PASSABLE = np.array([kind in PASSABLE for kind in range(max(ENTITY_CODES.values()) + 1)])
+_PICKUPS = (AMMO, BLAST_POWERUP, FREEZE_POWERUP)
+
+
+## [N, W, H] distances from the sources ([N, W, H] or [W, H] bool) through passable [W, H]
+def bfs(sources: np.ndarray, passable: np.ndarray) -> np.ndarray:
+    frontier = sources.astype(bool)
+    distances = np.where(frontier, 0, UNREACHABLE).astype(np.int32)
+    seen = frontier.copy()
+    distance = 0
+    while frontier.any():
+        distance += 1
+        grown = np.zeros_like(frontier)
+        grown[..., 1:, :] |= frontier[..., :-1, :]
+        grown[..., :-1, :] |= frontier[..., 1:, :]
+        grown[..., :, 1:] |= frontier[..., :, :-1]
+        grown[..., :, :-1] |= frontier[..., :, 1:]
+        frontier = grown & passable & ~seen
+        seen |= frontier
+        distances[frontier] = distance
+    return distances
+
+
+class DistanceFields:
+    ## kind is the [W, H] KIND layer of a SimState board
+    def __init__(self, kind: np.ndarray, max_fields: int = 256):
+        self.kind = kind.copy()
+        self.passable = _PASSABLE[self.kind]
+        self.max_fields = max_fields
+        ## packed source mask -> field, all for the current passable layer, least
+        ## recently used first
+        self._fields: 'OrderedDict[bytes, np.ndarray]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self.evicted = 0
+
+    @staticmethod
+    def from_sim_state(state: SimState, max_fields: int = 256) -> 'DistanceFields':
+        return DistanceFields(state.board[KIND], max_fields)
+
+    @staticmethod
+    def from_board_state(state: BoardState, max_fields: int = 256) -> 'DistanceFields':
+        return DistanceFields.from_sim_state(SimState.from_board_state(state), max_fields)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.kind.shape
+
+    ## Field from a [W, H] bool mask of source cells
+    def field(self, sources: np.ndarray) -> np.ndarray:
+        return self.fields([sources])[0]
+
+    ## [N, W, H] fields of several source masks, the missing ones grown together.
+    ## The result is a copy, the cache can't be changed through it
+    def fields(self, sources: Iterable[np.ndarray]) -> np.ndarray:
+        sources = [np.asarray(mask, dtype=bool) for mask in sources]
+        keys = [np.packbits(mask).tobytes() for mask in sources]
+        missing = {key: mask for key, mask in zip(keys, sources) if key not in self._fields}
+        self.misses += len(missing)
+        self.hits += len(keys) - len(missing)
+        for key in keys:
+            if key in self._fields:
+                self._fields.move_to_end(key)
+        if missing:
+            grown = bfs(np.stack(list(missing.values())), self.passable)
+            self._fields.update(zip(missing, grown))
+        result = np.stack([self._fields[key] for key in keys])
+        while len(self._fields) > self.max_fields:
+            self._fields.popitem(last=False)
+            self.evicted += 1
+        return result
+
+    ## Field of a single cell
+    def from_cell(self, x: int, y: int) -> np.ndarray:
+        sources = np.zeros(self.shape, dtype=bool)
+        sources[x, y] = True
+        return self.field(sources)
+
+    ## unit_id -> field from where the unit stands, for units with hp left
+    def unit_fields(self, state: SimState) -> Dict[str, np.ndarray]:
+        alive = [(unit_id, unit) for unit_id, unit in zip(state.unit_ids, state.units) if unit[UHP] > 0]
+        masks = []
+        for _, unit in alive:
+            mask = np.zeros(self.shape, dtype=bool)
+            mask[unit[UX], unit[UY]] = True
+            masks.append(mask)
+        if not masks:
+            return {}
+        return dict(zip((unit_id for unit_id, _ in alive), self.fields(masks)))
+
+    ## Field from the nearest pickup
+    def pickup_field(self) -> np.ndarray:
+        return self.field(np.isin(self.kind, _PICKUPS))
+
+    ## Field from the nearest safe cell, e.g. DangerMap.earliest == NEVER
+    def safe_field(self, safe: np.ndarray) -> np.ndarray:
+        return self.field(safe & self.passable)
+
+    ## The cell now holds `kind` (a simulator entity code, EMPTY when cleared)
+    def set_cell(self, x: int, y: int, kind: int):
+        was = self.passable[x, y]
+        self.kind[x, y] = kind
+        now = self.passable[x, y] = _PASSABLE[kind]
+        if was == now or not self._fields:
+            return
+        if now:
+            ## fields that reach a neighbour could now walk through the cell
+            width, height = self.shape
+            neighbours = [(nx, ny) for nx, ny in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1))
+                          if 0 <= nx < width and 0 <= ny < height]
+            stale = [key for key, field in self._fields.items()
+                     if any(field[nx, ny] != UNREACHABLE for nx, ny in neighbours)]
+        else:
+            stale = [key for key, field in self._fields.items() if field[x, y] != UNREACHABLE]
+        for key in stale:
+            del self._fields[key]
+        self.invalidated += len(stale)
+
+    ## Keep up with a tick event from the server (see GameState._on_game_tick)
+    def on_event(self, event: dict):
+        event_type = event.get("type")
+        if event_type == "entity_expired":
+            x, y = event["data"]
+            self.set_cell(x, y, EMPTY)
+        elif event_type == "entity_spawned":
+            entity = event["data"]
+            self.set_cell(entity["x"], entity["y"], ENTITY_CODES[entity["type"]])
+        elif event_type == "entity_state":
+            x, y = event["coordinates"]
+            self.set_cell(x, y, ENTITY_CODES[event["updated_entity"]["type"]])
+
+    ## Catch up with a whole KIND layer, e.g. after a forward model step
+    def sync(self, kind: np.ndarray):
+        xs, ys = np.nonzero(kind != self.kind)
+        for x, y in zip(xs.tolist(), ys.tolist()):
+            self.set_cell(x, y, int(kind[x, y]))
+
+    def clear(self):
+        self._fields.clear()
+
+    def __len__(self) -> int:
+        return len(self._fields)
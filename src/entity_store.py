@@ -0,0 +1,186 @@
+## Array backed storage for the entities of a BoardState.
+##
+## Blocks, pickups, bombs and fire are kept as typed numpy columns (one row per
+## entity) instead of one dataclass plus Coordinate per entity, so a state costs a
+## few small arrays and copying it is a handful of array copies. Units stay
+## UnitState objects, there are only a few of them.
+##
+## Indexing or iterating the store hands out views: subclasses of the entity
+## dataclasses with __slots__ that read their fields from the columns, so
+## isinstance checks and entity.coord.x keep working. Views are read only and are
+## made on access, they are not kept around.
+
+from typing import Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from classes import (Ammo, Bomb, Coordinate, Destructible, Entity, Fire, Freeze, Indestructible,
+                     Radius, UnitState)
+from simulator import (METAL, WOOD, ORE, AMMO, BLAST_POWERUP, FREEZE_POWERUP, BOMB, FIRE,
+                       ENTITY_CODES, NO_EXPIRY, NO_OWNER)
+
+## column name -> dtype
+COLUMNS = {"x": np.int16, "y": np.int16, "type": np.int8, "hp": np.int16, "expires": np.int32,
+           "created": np.int32, "owner": np.int16, "blast_diameter": np.int16}
+
+
+def _column(name: str):
+    def get(self):
+        return int(getattr(self._store, name)[self._i])
+    return property(get)
+
+
+def _coord(self) -> Coordinate:
+    store, i = self._store, self._i
+    return Coordinate(int(store.x[i]), int(store.y[i]))
+
+
+def _owner(self) -> Optional[str]:
+    owner = int(self._store.owner[self._i])
+    return None if owner == NO_OWNER else self._store.owner_ids[owner]
+
+
+def _fire_expires(self) -> Optional[int]:
+    expires = int(self._store.expires[self._i])
+    return None if expires == NO_EXPIRY else expires
+
+
+def _view_class(base: type, **fields) -> type:
+    namespace = {"__slots__": ("_store", "_i"), "created": _column("created"), "coord": property(_coord)}
+    namespace.update(fields)
+    return type(f"{base.__name__}View", (base,), namespace)
+
+
+_hp = _column("hp")
+_expires = _column("expires")
+_VIEWS = {
+    METAL: _view_class(Indestructible),
+    WOOD: _view_class(Destructible, hp=_hp),
+    ORE: _view_class(Destructible, hp=_hp),
+    AMMO: _view_class(Ammo, expires=_expires, hp=_hp),
+    BLAST_POWERUP: _view_class(Radius, expires=_expires, hp=_hp),
+    FREEZE_POWERUP: _view_class(Freeze, expires=_expires, hp=_hp),
+    BOMB: _view_class(Bomb, owner=property(_owner), expires=_expires, hp=_hp,
+                      blastDiameter=_column("blast_diameter")),
+    FIRE: _view_class(Fire, expires=property(_fire_expires), owner=property(_owner)),
+}
+
+
+class EntityStore(Sequence[Entity]):
+    __slots__ = ("x", "y", "type", "hp", "expires", "created", "owner", "blast_diameter",
+                 "owner_ids", "units")
+
+    ## columns are arrays of the same length, owner indexes into owner_ids
+    def __init__(self, columns: dict, owner_ids: Tuple[str, ...], units: List[UnitState]):
+        for name, dtype in COLUMNS.items():
+            setattr(self, name, np.asarray(columns[name], dtype=dtype))
+        self.owner_ids = tuple(owner_ids)
+        self.units = units
+
+    @staticmethod
+    def empty(owner_ids: Tuple[str, ...] = (), units: Optional[List[UnitState]] = None) -> 'EntityStore':
+        return EntityStore({name: () for name in COLUMNS}, owner_ids, units or [])
+
+    ## From a list of entity dataclasses (units included), like BoardState.entities
+    @staticmethod
+    def from_entities(entities: Sequence[Union[Entity, UnitState]]) -> 'EntityStore':
+        units = [entity for entity in entities if isinstance(entity, UnitState)]
+        owner_ids = [unit.unitId for unit in units]
+        rows = []
+        for entity in entities:
+            if isinstance(entity, UnitState):
+                continue
+            kind, hp, expires, owner, diameter = _row(entity)
+            if owner is not None and owner not in owner_ids:
+                owner_ids.append(owner)
+            owner = NO_OWNER if owner is None else owner_ids.index(owner)
+            rows.append((entity.coord.x, entity.coord.y, kind, hp, expires, entity.created, owner, diameter))
+        columns = dict(zip(COLUMNS, zip(*rows))) if rows else {name: () for name in COLUMNS}
+        return EntityStore(columns, tuple(owner_ids), units)
+
+    ## From the "entities" list of a game_state payload
+    @staticmethod
+    def from_game_entities(entities: List[dict], units: List[UnitState]) -> 'EntityStore':
+        return EntityStore.from_rows(
+            [(entity["x"], entity["y"], ENTITY_CODES[entity["type"]], entity.get("hp", 0),
+              entity.get("expires", NO_EXPIRY), entity.get("created", 0),
+              entity.get("unit_id", entity.get("owner_unit_id")), entity.get("blast_diameter", 0))
+             for entity in entities], units)
+
+    ## From tuples in COLUMNS order, with the owner as a unit id (or None)
+    @staticmethod
+    def from_rows(rows: Sequence[tuple], units: List[UnitState]) -> 'EntityStore':
+        owner_ids = [unit.unitId for unit in units]
+        owners = {unit_id: i for i, unit_id in enumerate(owner_ids)}
+        indexed = []
+        for x, y, kind, hp, expires, created, owner, diameter in rows:
+            if owner is None:
+                owner = NO_OWNER
+            else:
+                if owner not in owners:
+                    owners[owner] = len(owner_ids)
+                    owner_ids.append(owner)
+                owner = owners[owner]
+            indexed.append((x, y, kind, hp, expires, created, owner, diameter))
+        columns = dict(zip(COLUMNS, zip(*indexed))) if indexed else {name: () for name in COLUMNS}
+        return EntityStore(columns, tuple(owner_ids), units)
+
+    def copy(self) -> 'EntityStore':
+        return EntityStore({name: getattr(self, name).copy() for name in COLUMNS}, self.owner_ids,
+                           [UnitState(u.unitId, u.agentId, Coordinate(u.coord.x, u.coord.y), u.hp, u.bomb,
+                                      u.ammunition, u.invulnerability, u.stunned) for u in self.units])
+
+    ## Bytes held by the columns
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in COLUMNS)
+
+    def view(self, i: int) -> Entity:
+        entity = object.__new__(_VIEWS[int(self.type[i])])
+        entity._store = self
+        entity._i = i
+        return entity
+
+    ## Units first, then the other entities in column order
+    def __iter__(self) -> Iterator[Union[Entity, UnitState]]:
+        yield from self.units
+        for i in range(len(self.x)):
+            yield self.view(i)
+
+    def __len__(self) -> int:
+        return len(self.units) + len(self.x)
+
+    def __getitem__(self, i: int) -> Union[Entity, UnitState]:
+        if i < 0:
+            i += len(self)
+        if i < len(self.units):
+            return self.units[i]
+        if i >= len(self):
+            raise IndexError("entity index out of range")
+        return self.view(i - len(self.units))
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, EntityStore):
+            return NotImplemented
+        return self.owner_ids == other.owner_ids and self.units == other.units and \
+            all(np.array_equal(getattr(self, name), getattr(other, name)) for name in COLUMNS)
+
+    def __repr__(self) -> str:
+        return f"EntityStore({len(self.units)} units, {len(self.x)} entities)"
+
+
+def _row(entity: Entity) -> Tuple[int, int, int, Optional[str], int]:
+    ## (type, hp, expires, owner unit id, blast diameter) of an entity dataclass
+    if isinstance(entity, Indestructible):
+        return METAL, 0, NO_EXPIRY, None, 0
+    if isinstance(entity, Destructible):
+        ## the dataclass does not tell wood and ore apart
+        return WOOD, entity.hp, NO_EXPIRY, None, 0
+    if isinstance(entity, (Ammo, Radius, Freeze)):
+        kind = AMMO if isinstance(entity, Ammo) else BLAST_POWERUP if isinstance(entity, Radius) else FREEZE_POWERUP
+        return kind, entity.hp, entity.expires, None, 0
+    if isinstance(entity, Bomb):
+        return BOMB, entity.hp, entity.expires, entity.owner, entity.blastDiameter
+    if isinstance(entity, Fire):
+        return FIRE, 0, NO_EXPIRY if entity.expires is None else entity.expires, entity.owner, 0
+    raise Exception(f"cannot store entity {entity}")
@@ -1,24 +1,73 @@
 import asyncio
 from html import entities
-from typing import Union
+from typing import Dict, List, Optional, Tuple, Union
 import websockets
 import json
 
-from classes import UnitState, Coordinate, Indestructible, Destructible, Radius, Ammo, Bomb, Fire, BoardState
+from classes import Action
+from distance_fields import DistanceFields
+from observation import ObservationBuilder
+from packets import loads
+from simulator import SimState
+from state_history import StateHistory
+from tick_trace import TickTrace, TickTracer
 from websockets.client import WebSocketClientProtocol
 
 _move_set = set(("up", "down", "left", "right"))
+_pickup_types = ("a", "bp", "fp")
 
 
 class GameState:
-    def __init__(self, connection_string: str):
+    ## history keeps compact observations of the last ticks, see state_history.py.
+    ## Off by default: recording writes the whole board every tick
+    def __init__(self, connection_string: str, history: Optional[StateHistory] = None):
         self._connection_string = connection_string
         self.agent_id = None
         self.agent_a_ids = None
         self.agent_b_ids = None
         self.config = None
-        self._states = []
+        self._state = None
+        ## observation maps patched from tick events, see observation.py
+        self.observation = None
+        ## compact observations of the last ticks, bounded, see state_history.py
+        self.history = history
+        self._frame = None
+        ## cached BFS distance fields kept up to date from tick events, see distance_fields.py
+        self.distances = None
         self._tick_callback = None
+        ## per-tick latency spans and percentiles, see tick_trace.py
+        self.tracer = TickTracer()
+        ## trace of the tick being decided (sends are recorded on it) and of the
+        ## frame being received and applied
+        self._trace: Optional[TickTrace] = None
+        self._receiving: Optional[TickTrace] = None
+        ## the tick callback runs as its own task, so frames keep being received
+        ## and applied while it decides, see _schedule_decision
+        self._decision: Optional[asyncio.Task] = None
+        ## trace of a decision task that hasn't started yet
+        self._queued_trace: Optional[TickTrace] = None
+        self._latest_tick: Optional[int] = None
+        ## frames already waiting on the connection when the last one was read,
+        ## and the most seen
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        ## ticks whose decision was cancelled (or never started) because a newer
+        ## tick came in, and decisions that ran to the end
+        self.skipped_ticks = 0
+        self.decisions = 0
+        ## indexes over self._state["entities"], the engine keeps at most one
+        ## entity per cell: cell -> entity, cell -> position in the list and
+        ## type / owner unit -> {cell: entity}
+        self._cells: Dict[Tuple[int, int], dict] = {}
+        self._positions: Dict[Tuple[int, int], int] = {}
+        self._by_type: Dict[str, Dict[Tuple[int, int], dict]] = {}
+        self._by_owner: Dict[str, Dict[Tuple[int, int], dict]] = {}
+
+    ## Trace of the tick being decided (received_at is when its frame came in),
+    ## None outside a decision
+    @property
+    def current_trace(self) -> Optional[TickTrace]:
+        return self._trace
 
     def set_game_tick_callback(self, generate_agent_action_callback):
         self._tick_callback = generate_agent_action_callback
@@ -29,7 +78,12 @@ class GameState:
             return self.connection
 
     async def _send(self, packet):
-        await self.connection.send(json.dumps(packet))
+        await self._send_raw(json.dumps(packet))
+
+    async def _send_raw(self, raw: str):
+        await self.connection.send(raw)
+        if self._trace is not None:
+            self._trace.sent()
 
     async def send_move(self, move: str, unit_id: str):
         if move in _move_set:
@@ -45,19 +99,134 @@ class GameState:
             x, y], "unit_id": unit_id}
         await self._send(packet)
 
+    ## Packet for a unit action: a move, "bomb", ("detonate", x, y) or "detonate"
+    ## for the unit's oldest bomb. None when there is nothing to send (no action,
+    ## an unknown move or no bomb to detonate)
+    def action_packet(self, unit_id: str, action: Optional[Action]) -> Optional[dict]:
+        if action is None:
+            return None
+        if isinstance(action, tuple):
+            _, x, y = action
+            return {"type": "detonate", "coordinates": [x, y], "unit_id": unit_id}
+        if action == "bomb":
+            return {"type": "bomb", "unit_id": unit_id}
+        if action == "detonate":
+            bomb = next(iter(self.bombs_of(unit_id)), None)
+            if bomb is None:
+                return None
+            return {"type": "detonate", "coordinates": [bomb["x"], bomb["y"]], "unit_id": unit_id}
+        if action in _move_set:
+            return {"type": "move", "move": action, "unit_id": unit_id}
+        return None
+
+    ## Send a tick's actions for all units at once ({unit_id: action}, see
+    ## action_packet). Every packet is built and serialised before anything is
+    ## written, then the frames are written back to back: a websocket send only
+    ## waits when the socket is applying back pressure, so they go out in one
+    ## burst without giving the event loop a turn in between (gathering the sends
+    ## as tasks was slower, each task needs a loop iteration before it writes).
+    ## Returns the number of packets sent
+    async def send_actions(self, actions: Dict[str, Optional[Action]]) -> int:
+        frames = []
+        for unit_id, action in actions.items():
+            packet = self.action_packet(unit_id, action)
+            if packet is not None:
+                frames.append(json.dumps(packet))
+        for raw in frames:
+            await self._send_raw(raw)
+        return len(frames)
+
+    ## Entity (as sent by the server) at a cell, None if the cell is empty
+    def entity_at(self, x: int, y: int) -> Optional[dict]:
+        return self._cells.get((x, y))
+
+    ## Bombs a unit has on the board, oldest first
+    def bombs_of(self, unit_id: str) -> List[dict]:
+        owned = self._by_owner.get(unit_id, {}).values()
+        return sorted((entity for entity in owned if entity.get("type") == "b"), key=lambda entity: entity.get("created"))
+
+    def entities_of_type(self, entity_type: str) -> List[dict]:
+        return list(self._by_type.get(entity_type, {}).values())
+
+    ## Ammo, blast radius and freeze powerups on the board
+    def pickups(self) -> List[dict]:
+        return [entity for entity_type in _pickup_types for entity in self._by_type.get(entity_type, {}).values()]
+
+    ## Receive and apply frames as they come. Decisions don't hold this loop up,
+    ## see _schedule_decision
     async def _handle_messages(self, connection: WebSocketClientProtocol):
         while True:
             try:
                 raw_data = await connection.recv()
-                data = json.loads(raw_data)
+                trace = self._receiving = self.tracer.start()
+                self.queue_depth = len(getattr(connection, "messages", ()))
+                self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+                data = loads(raw_data)
+                trace.mark("decode")
                 await self._on_data(data)
+                if self._receiving is trace and trace.tick is not None:
+                    ## a tick without a decision, a frame already queued behind it
+                    ## means the server moved on first
+                    self.tracer.finish(trace, self.queue_depth > 0)
+                self._receiving = None
             except websockets.exceptions.ConnectionClosed:
                 print('Connection with server closed')
                 break
+        await self.wait_decision()
 
-    async def _on_data(self, data):
-        print(data)
+    ## Start deciding on the newest tick. A decision still running (or not yet
+    ## started) for an older tick is cancelled: it would act on a stale state,
+    ## and letting it finish would make every later decision late as well
+    def _schedule_decision(self, tick_number: int):
+        trace, self._receiving = self._receiving, None
+        previous = self._decision
+        if previous is not None and not previous.done():
+            previous.cancel()
+            self.skipped_ticks += 1
+            if self._queued_trace is not None:
+                ## cancelled before it ran, _decide won't get to finish its trace
+                self.tracer.finish(self._queued_trace, True)
+        self._queued_trace = trace
+        self._decision = asyncio.ensure_future(self._decide(tick_number, trace))
+
+    ## The game state as of now for a decision. The receive loop keeps applying
+    ## ticks to self._state while the decision runs (on the loop or in a worker
+    ## thread), so it gets its own unit_state and entities containers. Entity
+    ## dicts are replaced rather than changed, unit dicts get a shallow copy
+    ## since moves set their coordinates in place. Taken when the decision
+    ## starts, a decision cancelled by a newer tick before then never pays for it
+    def _snapshot(self) -> dict:
+        state = self._state
+        return dict(state, unit_state={unit_id: dict(unit) for unit_id, unit in state["unit_state"].items()},
+                    entities=list(state["entities"]))
 
+    async def _decide(self, tick_number: int, trace: Optional[TickTrace]):
+        if self._queued_trace is trace:
+            self._queued_trace = None
+        self._trace = trace
+        try:
+            ## a newer tick would have cancelled this task, so self._state is
+            ## still the state of tick_number
+            await self._tick_callback(tick_number, self._snapshot())
+            self.decisions += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"decision for tick {tick_number} failed: {e!r}")
+        finally:
+            if self._trace is trace:
+                self._trace = None
+            if trace is not None:
+                trace.mark("callback")
+                ## late when a newer tick came in before the actions were out
+                self.tracer.finish(trace, self._latest_tick != tick_number or self.queue_depth > 0)
+
+    ## Wait until no decision is in flight
+    async def wait_decision(self):
+        while self._decision is not None and not self._decision.done():
+            await asyncio.wait({self._decision})
+
+    async def _on_data(self, data):
         data_type = data.get("type")
 
         if data_type == "info":
@@ -73,62 +242,56 @@ class GameState:
             payload = data.get("payload")
             winning_agent_id = payload.get("winning_agent_id")
             print(f"Game over. Winner: Agent {winning_agent_id}")
+            print(self.tracer.summary())
         else:
             print(f"unknown packet \"{data_type}\": {data}")
 
     def _on_game_state(self, game_state):
         self.agent_id = game_state["connection"]["agent_id"]
         self.config = game_state["config"]
+        self.tracer.tick_rate_hz = self.config.get("tick_rate_hz")
         self.agent_a_ids = game_state["agents"]["a"]["unit_ids"]
         self.agent_b_ids = game_state["agents"]["b"]["unit_ids"]
-
-        entities = []
-        for unit in self.agent_a_ids+self.agent_b_ids:
-            state = game_state["unit_state"][f"{unit}"]
-
-            entities.append(UnitState(
-            state["unit_id"], 
-            state["agent_id"],
-            Coordinate(state["coordinates"][0], state["coordinates"][1]),
-            state["hp"],
-            state["blast_diameter"],
-            state["inventory"]["bombs"],
-            state["invulnerability"]))
-        
-        for entity in game_state["entities"]:
-            entity_type = entity["type"]
-            if entity_type == "m":
-                entities.append(Indestructible(entity["created"], Coordinate(entity["x"],entity["y"])))
-            elif entity_type == "w" or entity["type"] == "o":
-                entities.append(Destructible(entity["created"], Coordinate(entity["x"],entity["y"]),entity["hp"]))
-            elif entity_type == "a":
-                entities.append(Ammo(entity["created"], Coordinate(entity["x"],entity["y"]),entity["expires"],entity["hp"]))
-            elif entity_type == "bp":
-                entities.append(Radius(entity["created"], Coordinate(entity["x"],entity["y"]),entity["expires"],entity["hp"]))
-            elif entity_type == "b":
-                entities.append(Bomb(entity["created"], 
-                Coordinate(entity["x"],entity["y"]),
-                entity["owner_unit_id"],
-                entity["expires"],
-                entity["hp"],
-                entity["blast_diameter"]))
-            elif entity_type == "x":
-                try:
-                    entities.append(Fire(entity["created"], Coordinate(entity["x"],entity["y"]),
-                    entity["owner_unit_id"],entity["expires"]))
-                except KeyError:
-                    entities.append(Fire(entity["created"], Coordinate(entity["x"],entity["y"])))
-
-        self._states.append(BoardState(game_state["world"]["width"],game_state["world"]["height"],
-        game_state["tick"],entities))
-
-        print(self._states)
+        self._state = game_state
+        self.observation = ObservationBuilder.from_game_state(game_state)
+        self.distances = DistanceFields.from_sim_state(SimState.from_game_state(game_state))
+        self._index_entities()
+        if self._decision is not None:
+            ## a decision left over from the last match
+            self._decision.cancel()
+            self._queued_trace = None
+        self._latest_tick = game_state.get("tick")
+        ## a game_state starts a match (or a reconnection), older ticks don't follow on
+        if self.history is not None:
+            self.history.clear()
+        self._frame = None
+        self._record(game_state.get("tick", 0))
 
         return 1
 
+    def _record(self, tick: int):
+        self.observation.tick = tick
+        if self.history is None:
+            return
+        if self.history.last_tick is not None and tick <= self.history.last_tick:
+            ## a repeated tick, keep what we have rather than fail the receive loop
+            return
+        self._frame = self.observation.write_compact(self._frame)
+        self.history.push(tick, self._frame)
+
+    ## Apply a tick, then start the decision on it without waiting for it
+    ## (wait_decision does)
     async def _on_game_tick(self, game_tick):
+        trace = self._receiving
+        self._latest_tick = game_tick.get("tick")
+        if trace is not None:
+            trace.tick = self._latest_tick
         events = game_tick.get("events")
         for event in events:
+            if self.observation is not None:
+                self.observation.on_event(event)
+            if self.distances is not None:
+                self.distances.on_event(event)
             event_type = event.get("type")
             if event_type == "entity_spawned":
                 self._on_entity_spawned(event)
@@ -146,36 +309,68 @@ class GameState:
                 self._on_unit_action(unit_action)
             else:
                 print(f"unknown event type {event_type}: {event}")
+        if self.observation is not None and game_tick.get("tick") is not None:
+            self._record(game_tick["tick"])
+        if trace is not None:
+            trace.mark("update")
         if self._tick_callback is not None:
-            tick_number = game_tick.get("tick")
-            await self._tick_callback(tick_number, self._state)
+            self._schedule_decision(game_tick.get("tick"))
 
     def _on_entity_spawned(self, spawn_event):
         spawn_payload = spawn_event.get("data")
-        self._state["entities"].append(spawn_payload)
+        self._add_entity(spawn_payload)
 
     def _on_entity_expired(self, spawn_event):
-        expire_payload = spawn_event.get("data")
-
-        def filter_entity_fn(entity):
-            [x, y] = expire_payload
-            entity_x = entity.get("x")
-            entity_y = entity.get("y")
-            should_remove = entity_x == x and entity_y == y
-            return should_remove == False
-
-        self._state["entities"] = list(filter(
-            filter_entity_fn, self._state["entities"]))
+        [x, y] = spawn_event.get("data")
+        self._remove_entity(x, y)
 
     def _on_unit_state(self, unit_state):
         unit_id = unit_state.get("unit_id")
         self._state["unit_state"][unit_id] = unit_state
 
     def _on_entity_state(self, x, y, updated_entity):
-        for entity in self._state.get("entities"):
-            if entity.get("x") == x and entity.get("y") == y:
-                self._state["entities"].remove(entity)
-        self._state["entities"].append(updated_entity)
+        self._remove_entity(x, y)
+        self._add_entity(updated_entity)
+
+    def _index_entities(self):
+        self._cells.clear()
+        self._positions.clear()
+        self._by_type.clear()
+        self._by_owner.clear()
+        entities = self._state["entities"]
+        self._state["entities"] = []
+        for entity in entities:
+            self._add_entity(entity)
+
+    def _add_entity(self, entity):
+        cell = (entity.get("x"), entity.get("y"))
+        if cell in self._cells:
+            self._remove_entity(*cell)
+        entities = self._state["entities"]
+        self._cells[cell] = entity
+        self._positions[cell] = len(entities)
+        entities.append(entity)
+        self._by_type.setdefault(entity.get("type"), {})[cell] = entity
+        owner = entity.get("unit_id")
+        if owner is not None:
+            self._by_owner.setdefault(owner, {})[cell] = entity
+
+    def _remove_entity(self, x, y):
+        cell = (x, y)
+        entity = self._cells.pop(cell, None)
+        if entity is None:
+            return
+        ## swap the last entity into the hole so removal stays O(1)
+        entities = self._state["entities"]
+        position = self._positions.pop(cell)
+        last = entities.pop()
+        if last is not entity:
+            entities[position] = last
+            self._positions[(last.get("x"), last.get("y"))] = position
+        del self._by_type[entity.get("type")][cell]
+        owner = entity.get("unit_id")
+        if owner is not None:
+            del self._by_owner[owner][cell]
 
     def _on_unit_action(self, action_packet):
         unit_id = action_packet["unit_id"]
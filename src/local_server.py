@@ -0,0 +1,468 @@
+## A stand-in for the engine's game and forward model servers.
+##
+##   python local_server.py [--replay replay.json | --state state.json] [--port 3000]
+##                          [--tick-rate 100] [--latency 0.005] [--wait-for a,b] [--seed 1]
+##
+## LocalServer speaks the engine's websocket protocol, so GameState, ForwardModel
+## and Gym connect to it as they would to the Dockerized engine:
+##   ?role=agent&agentId=agentA   plays agent "a" (agentB: "b"), its unit packets are queued
+##   ?role=spectator              only receives frames
+##   ?role=admin                  forward model use, evaluate_next_state is answered on
+##                                any connection with next_game_state
+## A connection is sent game_state on connect (endgame_state if the game is over),
+## then a tick frame every 1 / tick_rate_hz once every agent in `wait_for` is
+## connected ("info" frames until then), and endgame_state at the end.
+##
+## A game is either
+##   replayed: the ticks of an endgame_state payload (replay.json) are sent as
+##       recorded, one frame per tick including the ticks without events, and
+##       the agents' actions are ignored
+##   simulated: the queued actions are played through simulator.advance (with
+##       item drops from a seeded generator) and the tick's events are worked out
+##       by comparing the states before and after, see tick_events
+## Units take the first action queued for them in a tick, like Game.QueueAction.
+##
+## Connections can pick a game with &game=<name>: every name is a separate match
+## with its own agents, so one server can run many games side by side. When a
+## game ends its connections are closed and the next ones to connect start a new
+## one.
+##
+## `latency` delays every frame in both directions by that many seconds. Each
+## connection has its own queue, so a slow reader doesn't hold up the tick loop or
+## the other connections, and frames keep their order. Frames going to several
+## connections are serialised once.
+##
+## evaluate_next_state is answered with simulator.step and no item drops, so the
+## same request always gets the same answer.
+
+import argparse
+import asyncio
+import copy
+import json
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import websockets
+
+from classes import Action
+from replay_index import apply_events
+from simulator import MOVES, SimState, advance, step
+
+## agentId query parameter -> agent id, the engine's default AgentSecretIdMap
+AGENT_SECRETS = {"agentA": "a", "agentB": "b"}
+
+
+## Game state dict (SimState.to_game_state layout) of a state, keeping the
+## fields the simulator doesn't know about (game_id, tick_rate_hz, ...)
+def _game_state(state: SimState, like: dict) -> dict:
+    game_state = state.to_game_state()
+    game_state["config"] = dict(like.get("config") or {}, **game_state["config"])
+    if "game_id" in like:
+        game_state["game_id"] = like["game_id"]
+    return game_state
+
+
+## Simulator action of an agent packet, None for packets that aren't actions
+def packet_action(packet: dict) -> Optional[Action]:
+    packet_type = packet.get("type")
+    if packet_type == "move" and packet.get("move") in MOVES:
+        return packet["move"]
+    if packet_type == "bomb":
+        return "bomb"
+    if packet_type == "detonate":
+        x, y = packet["coordinates"]
+        return ("detonate", x, y)
+    return None
+
+
+## The events of a tick that take `before` to `after` (both game state dicts in
+## SimState.to_game_state layout), in the engine's order: unit actions, entities
+## gone, entities changed or new, then units. `actions` are the (agent_id, packet)
+## the tick took. A move is reported as a unit event when the unit did end up one
+## cell over (clients apply it to the coordinates); anything else that changed
+## about a unit comes as unit_state
+def tick_events(before: dict, after: dict, actions: Sequence[Tuple[str, dict]] = ()) -> List[dict]:
+    events = []
+    units = {unit_id: dict(unit) for unit_id, unit in before["unit_state"].items()}
+    for agent_id, packet in actions:
+        unit = units[packet["unit_id"]]
+        if packet["type"] == "move":
+            dx, dy = MOVES[packet["move"]]
+            moved = [unit["coordinates"][0] + dx, unit["coordinates"][1] + dy]
+            if after["unit_state"][packet["unit_id"]]["coordinates"] != moved:
+                continue
+            unit["coordinates"] = moved
+        events.append({"type": "unit", "agent_id": agent_id, "data": packet})
+
+    old = {(entity["x"], entity["y"]): entity for entity in before["entities"]}
+    new = {(entity["x"], entity["y"]): entity for entity in after["entities"]}
+    changed = []
+    for cell, entity in old.items():
+        updated = new.get(cell)
+        if updated == entity:
+            continue
+        if updated is None or updated["type"] != entity["type"]:
+            events.append({"type": "entity_expired", "data": list(cell)})
+        if updated is not None:
+            changed.append((cell, entity, updated))
+    for cell, entity, updated in changed:
+        if updated["type"] == entity["type"]:
+            events.append({"type": "entity_state", "coordinates": list(cell), "updated_entity": updated})
+        else:
+            events.append({"type": "entity_spawned", "data": updated})
+    for cell, entity in new.items():
+        if cell not in old:
+            events.append({"type": "entity_spawned", "data": entity})
+
+    for unit_id, unit in after["unit_state"].items():
+        if units.get(unit_id) != unit:
+            events.append({"type": "unit_state", "data": unit})
+    return events
+
+
+## Items handed to `deliver` `latency` seconds after they were put, in order
+class _DelayLine:
+    def __init__(self, latency: float, deliver):
+        self.latency = latency
+        self._deliver = deliver
+        self._queue: asyncio.Queue = asyncio.Queue()
+        ## items put and not delivered yet, including the one being delivered
+        self.depth = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._task = asyncio.ensure_future(self._run())
+
+    def put(self, item):
+        self.depth += 1
+        self._idle.clear()
+        self._queue.put_nowait((asyncio.get_running_loop().time() + self.latency, item))
+
+    ## Wait until everything put so far was delivered (or the line stopped)
+    async def drain(self):
+        await self._idle.wait()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                due, item = await self._queue.get()
+                wait = due - loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                await self._deliver(item)
+                self.depth -= 1
+                if self.depth == 0:
+                    self._idle.set()
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            self._idle.set()
+
+    def close(self):
+        self._task.cancel()
+
+
+class _Connection:
+    def __init__(self, server: 'LocalServer', websocket, connection_id: int, role: str,
+                 agent_id: Optional[str], game: str):
+        self.websocket = websocket
+        self.id = connection_id
+        self.role = role
+        self.agent_id = agent_id
+        self.game = game
+        self.outbox = _DelayLine(server.latency, websocket.send)
+        self.inbox = _DelayLine(server.latency, lambda raw: server._on_message(self, raw))
+
+    def send(self, raw: str):
+        self.outbox.put(raw)
+
+    def close(self):
+        self.outbox.close()
+        self.inbox.close()
+
+
+class _Game:
+    def __init__(self, server: 'LocalServer', name: str):
+        self.server = server
+        self.name = name
+        self.connections: List[_Connection] = []
+        ## first action of each unit this tick: unit_id -> (agent_id, packet)
+        self.queued: Dict[str, Tuple[str, dict]] = {}
+        self.history: List[dict] = []
+        self.winner: Optional[str] = None
+        self.complete = False
+        self.task: Optional[asyncio.Task] = None
+        replay = server.replay
+        if replay is not None:
+            self.initial_state = copy.deepcopy(replay["initial_state"])
+            self.state = copy.deepcopy(self.initial_state)
+            self.sim = None
+        else:
+            self.sim = SimState.from_game_state(server.initial_state)
+            self.state = self.initial_state = _game_state(self.sim, server.initial_state)
+        self.state["config"] = dict(self.state.get("config") or {}, tick_rate_hz=server.tick_rate_hz)
+
+    @property
+    def agents(self) -> set:
+        return set(connection.agent_id for connection in self.connections if connection.role == "agent")
+
+    def join(self, connection: _Connection):
+        self.connections.append(connection)
+        if self.complete:
+            connection.send(json.dumps({"type": "endgame_state", "payload": self.endgame_state()}))
+            return
+        connection.send(json.dumps({"type": "game_state", "payload": dict(self.state, connection={
+            "id": connection.id, "role": connection.role, "agent_id": connection.agent_id})}))
+        if self.task is not None:
+            return
+        missing = set(self.server.wait_for) - self.agents
+        if missing:
+            self.broadcast({"type": "info", "payload": {
+                "message": f"Waiting for agents to connect {len(self.agents)} of {len(self.server.wait_for)}"}})
+        else:
+            self.task = asyncio.ensure_future(self.run())
+
+    def leave(self, connection: _Connection):
+        if connection in self.connections:
+            self.connections.remove(connection)
+
+    def queue(self, connection: _Connection, packet: dict):
+        unit_id = packet.get("unit_id")
+        unit = self.state["unit_state"].get(unit_id)
+        if self.task is None or unit is None or unit["agent_id"] != connection.agent_id:
+            return
+        if packet_action(packet) is not None:
+            self.queued.setdefault(unit_id, (connection.agent_id, packet))
+
+    def broadcast(self, packet: dict):
+        raw = json.dumps(packet)
+        for connection in self.connections:
+            connection.send(raw)
+
+    def endgame_state(self) -> dict:
+        if self.server.replay is not None:
+            return self.server.replay
+        return {"initial_state": self.initial_state, "history": self.history, "winning_agent_id": self.winner}
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        interval = 1.0 / self.server.tick_rate_hz
+        start = loop.time()
+        ticks = 0
+        while not self.complete:
+            ticks += 1
+            await asyncio.sleep(max(0.0, start + ticks * interval - loop.time()))
+            tick = self.state["tick"] + 1
+            events = self._replay_tick(tick) if self.sim is None else self._simulate_tick()
+            self.broadcast({"type": "tick", "payload": {"tick": tick, "events": events}})
+            max_ticks = self.server.max_ticks
+            if max_ticks is not None and ticks >= max_ticks:
+                self.complete = True
+        self.server.games_played += 1
+        self.broadcast({"type": "endgame_state", "payload": self.endgame_state()})
+        await self.server._end_game(self)
+
+    def _replay_tick(self, tick: int) -> List[dict]:
+        events = self.server._replay_events.get(tick, [])
+        apply_events(self.state, copy.deepcopy(events))
+        self.state["tick"] = tick
+        if tick >= self.server._replay_last_tick:
+            self.complete = True
+            self.winner = self.server.replay.get("winning_agent_id")
+        return events
+
+    def _simulate_tick(self) -> List[dict]:
+        queued, self.queued = list(self.queued.values()), {}
+        sim = self.sim
+        advance(sim, {packet["unit_id"]: packet_action(packet) for _, packet in queued}, self.server.rng)
+        before, self.state = self.state, _game_state(sim, self.state)
+        events = tick_events(before, self.state, queued)
+        if events:
+            self.history.append({"tick": sim.tick, "events": events})
+        if sim.is_complete():
+            self.complete = True
+            alive = [unit["agent_id"] for unit in self.state["unit_state"].values() if unit["hp"] > 0]
+            self.winner = alive[0] if alive else None
+        return events
+
+
+class LocalServer:
+    ## initial_state: a game_state payload to simulate from; replay: an
+    ## endgame_state payload to play back (one of them, or neither for a server
+    ## that only answers evaluate_next_state). max_ticks ends a game early
+    def __init__(self, initial_state: Optional[dict] = None, replay: Optional[dict] = None,
+                 tick_rate_hz: float = 10.0, latency: float = 0.0, wait_for: Sequence[str] = ("a", "b"),
+                 seed: Optional[int] = None, max_ticks: Optional[int] = None):
+        if initial_state is not None and replay is not None:
+            raise Exception("LocalServer takes an initial_state to simulate or a replay, not both")
+        if tick_rate_hz <= 0:
+            raise Exception(f"tick_rate_hz has to be positive, got {tick_rate_hz}")
+        self.initial_state = initial_state
+        self.replay = replay
+        self.tick_rate_hz = tick_rate_hz
+        self.latency = latency
+        self.wait_for = tuple(wait_for)
+        self.max_ticks = max_ticks
+        self.rng = np.random.default_rng(seed)
+        self._replay_events = {} if replay is None else {tick["tick"]: tick["events"] for tick in replay["history"]}
+        if replay is not None:
+            self._replay_last_tick = max(self._replay_events, default=replay["initial_state"]["tick"] + 1)
+        self._games: Dict[str, _Game] = {}
+        self._connections: Dict[int, _Connection] = {}
+        self._next_id = 0
+        self._server = None
+        self.games_played = 0
+        self.evaluations = 0
+
+    ## Load a game_state or endgame_state file (a replay.json), simulated or replayed
+    @staticmethod
+    def from_file(path: str, replay: bool = False, **options) -> 'LocalServer':
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("type") in ("game_state", "endgame_state"):
+            data = data["payload"]
+        if replay:
+            if "history" not in data:
+                raise Exception(f"{path} is not a replay (endgame_state)")
+            return LocalServer(replay=data, **options)
+        return LocalServer(initial_state=data.get("initial_state", data), **options)
+
+    @property
+    def uri(self) -> str:
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f"ws://{host}:{port}"
+
+    @property
+    def connections(self) -> int:
+        return len(self._connections)
+
+    ## Start listening (port 0 picks a free one), returns the base uri
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        ## replays and endgame states can be larger than the default 1 MiB frame limit
+        self._server = await websockets.serve(self._handle, host, port, max_size=None)
+        return self.uri
+
+    async def close(self):
+        for game in list(self._games.values()):
+            if game.task is not None:
+                game.task.cancel()
+        for connection in list(self._connections.values()):
+            connection.close()
+            await connection.websocket.close()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def __aenter__(self) -> 'LocalServer':
+        if self._server is None:
+            await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _handle(self, websocket, path: str = "/"):
+        query = parse_qs(urlparse(path).query)
+        role = query.get("role", ["spectator"])[0]
+        secret = query.get("agentId", [None])[0]
+        agent_id = AGENT_SECRETS.get(secret, secret) if role == "agent" else None
+        if role == "agent" and agent_id is None:
+            await websocket.close(code=1008, reason="role=agent needs an agentId")
+            return
+        self._next_id += 1
+        connection = _Connection(self, websocket, self._next_id, role, agent_id, query.get("game", [""])[0])
+        self._connections[connection.id] = connection
+        game = None
+        if role != "admin" and (self.initial_state is not None or self.replay is not None):
+            game = self._games.get(connection.game)
+            if game is None:
+                game = self._games[connection.game] = _Game(self, connection.game)
+            game.join(connection)
+        try:
+            async for raw in websocket:
+                connection.inbox.put(raw)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            connection.close()
+            del self._connections[connection.id]
+            if game is not None:
+                game.leave(connection)
+
+    async def _on_message(self, connection: _Connection, raw):
+        try:
+            packet = json.loads(raw)
+            packet_type = packet.get("type")
+        except (ValueError, AttributeError):
+            print(f"bad packet from connection {connection.id}: {raw!r:.200}")
+            return
+        if packet_type == "evaluate_next_state":
+            connection.send(self.evaluate_next_state(packet))
+        elif packet_type in ("move", "bomb", "detonate"):
+            game = self._games.get(connection.game)
+            if game is not None and connection.role == "agent":
+                game.queue(connection, packet)
+        else:
+            print(f"unknown packet \"{packet_type}\" from connection {connection.id}")
+
+    ## next_game_state frame answering an evaluate_next_state packet
+    def evaluate_next_state(self, packet: dict) -> str:
+        self.evaluations += 1
+        state = packet["state"]
+        sim = SimState.from_game_state(state)
+        actions, taken = {}, []
+        for queued in packet["actions"]:
+            action = packet_action(queued["action"])
+            unit_id = queued["action"].get("unit_id")
+            if action is not None and unit_id not in actions:
+                actions[unit_id] = action
+                taken.append((queued["agent_id"], queued["action"]))
+        next_sim = step(sim, actions)
+        before, after = _game_state(sim, state), _game_state(next_sim, state)
+        return json.dumps({"type": "next_game_state", "payload": {
+            "sequence_id": packet.get("sequence_id"), "is_complete": next_sim.is_complete(), "next_state": after,
+            "tick_result": {"tick": next_sim.tick, "events": tick_events(before, after, taken)}}})
+
+    async def _end_game(self, game: _Game):
+        if self._games.get(game.name) is game:
+            del self._games[game.name]
+        for connection in list(game.connections):
+            ## let the endgame frame out first
+            await connection.outbox.drain()
+            await connection.websocket.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the game engine and forward model servers")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--replay", help="endgame_state file to play back")
+    source.add_argument("--state", help="game_state (or replay) file whose initial state is simulated")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3000)
+    parser.add_argument("--tick-rate", type=float, default=10.0, help="ticks per second")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every frame, each way")
+    parser.add_argument("--wait-for", default="a,b", help="agents that have to connect before a game starts")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the item drops")
+    parser.add_argument("--max-ticks", type=int, default=None)
+    args = parser.parse_args()
+
+    options = dict(tick_rate_hz=args.tick_rate, latency=args.latency, seed=args.seed, max_ticks=args.max_ticks,
+                   wait_for=[agent_id for agent_id in args.wait_for.split(",") if agent_id])
+    if args.replay:
+        server = LocalServer.from_file(args.replay, replay=True, **options)
+    else:
+        default_state = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "starter", "agents", "replay.json")
+        server = LocalServer.from_file(args.state or default_state, **options)
+
+    async def serve():
+        uri = await server.start(args.host, args.port)
+        print(f"listening on {uri}")
+        await asyncio.Future()
+
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
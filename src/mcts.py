@@ -0,0 +1,221 @@
+## Monte Carlo tree search for simultaneous moves (decoupled UCT).
+##
+## Every node is a SimState. Each unit that can act there keeps its own visit
+## count and value sum per legal action and picks its action by UCB1 on those
+## alone, as if the other units were part of the environment; the joint action
+## of all units leads to the child. Values are from the first agent's side
+## (agent_ids[0]) in [-1, 1], the second agent's units maximise the negation.
+##
+## The forward model is the local simulator (tick_options / finish_tick, so no
+## item drops). A new node is valued by a rollout: `rollout_depth` ticks of
+## `rollout_policy`, then `evaluate` on where it ended up.
+##
+## Tree reuse: advance(state) looks for the observed state among the children of
+## the root (by Zobrist hash) and makes it the new root, keeping everything below
+## it. The search of the last tick then counts towards this one. If the server's
+## state isn't one the tree predicted (an item dropped, say), the tree starts over.
+
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from classes import Action
+from simulator import SimState, UHP, UAGENT, tick_options, finish_tick
+
+## rollout_policy(base, acting, options, rng) -> one action per acting unit
+RolloutPolicy = Callable[[SimState, List[int], List[List[Optional[Action]]], np.random.Generator], Sequence[Optional[Action]]]
+
+
+def random_rollout(base: SimState, acting, options, rng: np.random.Generator):
+    return [unit_options[rng.integers(len(unit_options))] for unit_options in options]
+
+
+def noop_rollout(base: SimState, acting, options, rng: np.random.Generator):
+    return [None] * len(acting)
+
+
+## Random, but a unit only drops a bomb or detonates one time in `patience`,
+## so rollouts aren't dominated by units blowing themselves up
+def cautious_rollout(base: SimState, acting, options, rng: np.random.Generator, patience: int = 8):
+    joint = []
+    for unit_options in options:
+        moves = [action for action in unit_options if action not in ("bomb", "detonate")]
+        pool = unit_options if rng.integers(patience) == 0 else moves
+        joint.append(pool[rng.integers(len(pool))])
+    return joint
+
+
+ROLLOUT_POLICIES = {"random": random_rollout, "noop": noop_rollout, "cautious": cautious_rollout}
+
+
+## Value for agent_ids[0]: the result if the game is over, otherwise the hp
+## difference scaled to [-1, 1]
+def hp_evaluation(state: SimState) -> float:
+    hp = [0, 0]
+    for unit in state.units:
+        hp[unit[UAGENT]] += max(unit[UHP], 0)
+    if state.is_complete():
+        return float((hp[0] > 0) - (hp[1] > 0))
+    return (hp[0] - hp[1]) / max(hp[0] + hp[1], 1)
+
+
+class Node:
+    __slots__ = ("state", "base", "acting", "options", "visits", "counts", "values", "children", "terminal", "hash")
+
+    def __init__(self, state: SimState):
+        self.state = state
+        self.terminal = state.is_complete()
+        self.base = self.acting = self.options = None
+        self.visits = 0
+        self.counts: List[List[int]] = []
+        self.values: List[List[float]] = []
+        ## joint action (one index per acting unit) -> Node
+        self.children: Dict[tuple, 'Node'] = {}
+        self.hash: Optional[int] = None
+
+    def expand(self):
+        self.base, self.acting, self.options = tick_options(self.state)
+        self.counts = [[0] * len(options) for options in self.options]
+        self.values = [[0.0] * len(options) for options in self.options]
+
+    def zobrist_hash(self) -> int:
+        if self.hash is None:
+            self.hash = self.state.zobrist_hash()
+        return self.hash
+
+    def size(self) -> int:
+        return 1 + sum(child.size() for child in self.children.values())
+
+
+class MCTS:
+    def __init__(self, exploration: float = 1.4, rollout_policy: RolloutPolicy = cautious_rollout,
+                 rollout_depth: int = 20, evaluate: Callable[[SimState], float] = hp_evaluation,
+                 rng: Optional[np.random.Generator] = None):
+        self.exploration = exploration
+        self.rollout_policy = rollout_policy
+        self.rollout_depth = rollout_depth
+        self.evaluate = evaluate
+        self.rng = np.random.default_rng() if rng is None else rng
+        self.root: Optional[Node] = None
+
+    ## Start a new tree at state
+    def set_root(self, state: SimState):
+        self.root = Node(state)
+
+    ## Move the root to the observed state, keeping the subtree if the tree saw it
+    ## coming. Returns whether anything was reused
+    def advance(self, state: SimState) -> bool:
+        root = self.root
+        if root is not None:
+            key = state.zobrist_hash()
+            if root.zobrist_hash() == key:
+                return True
+            for child in root.children.values():
+                if child.zobrist_hash() == key:
+                    self.root = child
+                    return True
+        self.set_root(state)
+        return False
+
+    ## Run iterations until `iterations` are done or should_stop() says so
+    ## (checked every iteration). Returns how many were run
+    def search(self, iterations: Optional[int] = None, should_stop: Optional[Callable[[], bool]] = None) -> int:
+        if self.root is None:
+            raise Exception("MCTS has no root, call set_root or advance first")
+        done = 0
+        while (iterations is None or done < iterations) and not (should_stop is not None and should_stop()):
+            self._iterate()
+            done += 1
+        return done
+
+    ## Most visited root action of each unit in unit_ids (default: all that can act)
+    def best_actions(self, unit_ids: Optional[Iterable[str]] = None) -> Dict[str, Optional[Action]]:
+        root = self.root
+        if root is None or root.acting is None:
+            return {}
+        wanted = set(root.state.unit_ids if unit_ids is None else unit_ids)
+        best = {}
+        for u, i in enumerate(root.acting):
+            unit_id = root.state.unit_ids[i]
+            if unit_id in wanted:
+                counts = root.counts[u]
+                best[unit_id] = root.options[u][max(range(len(counts)), key=counts.__getitem__)]
+        return best
+
+    def _iterate(self):
+        node, path = self.root, []
+        while True:
+            if node.terminal:
+                value = self.evaluate(node.state)
+                break
+            if node.acting is None:
+                node.expand()
+            joint = self._select(node)
+            path.append((node, joint))
+            child = node.children.get(joint)
+            if child is None:
+                state = node.base.copy()
+                finish_tick(state, [(i, node.options[u][a]) for u, (i, a) in enumerate(zip(node.acting, joint))
+                                    if node.options[u][a] is not None])
+                child = node.children[joint] = Node(state)
+                value = self._rollout(state)
+                child.visits += 1
+                break
+            node = child
+
+        for node, joint in path:
+            node.visits += 1
+            units = node.state.units
+            for u, (i, a) in enumerate(zip(node.acting, joint)):
+                node.counts[u][a] += 1
+                node.values[u][a] += value if units[i][UAGENT] == 0 else -value
+
+    def _select(self, node: Node) -> tuple:
+        log_visits = math.log(node.visits + 1)
+        joint = []
+        for counts, values in zip(node.counts, node.values):
+            unvisited = [a for a, count in enumerate(counts) if count == 0]
+            if unvisited:
+                joint.append(unvisited[self.rng.integers(len(unvisited))])
+                continue
+            c = self.exploration
+            joint.append(max(range(len(counts)),
+                             key=lambda a: values[a] / counts[a] + c * math.sqrt(log_visits / counts[a])))
+        return tuple(joint)
+
+    def _rollout(self, state: SimState) -> float:
+        ## tick_options copies, the child's state is left alone
+        for _ in range(self.rollout_depth):
+            if state.is_complete():
+                break
+            base, acting, options = tick_options(state)
+            joint = self.rollout_policy(base, acting, options, self.rng)
+            finish_tick(base, [(i, action) for i, action in zip(acting, joint) if action is not None])
+            state = base
+        return self.evaluate(state)
+
+
+## Decision function for anytime.AnytimeDecider (Agent(decide=MCTSPlanner())):
+## re-roots the tree on the state the server sent, then searches and publishes
+## the best actions for our units every `publish_every` iterations until the
+## deadline
+class MCTSPlanner:
+    def __init__(self, publish_every: int = 32, **mcts_options):
+        self.mcts = MCTS(**mcts_options)
+        self.publish_every = publish_every
+        self.reused = 0
+        self.iterations = 0
+        ## a search cut short by the deadline may still be finishing its iteration
+        self._lock = threading.Lock()
+
+    def __call__(self, decision, tick: int, game_state: dict):
+        with self._lock:
+            if self.mcts.advance(SimState.from_game_state(game_state)):
+                self.reused += 1
+            agent_id = game_state["connection"]["agent_id"]
+            unit_ids = game_state["agents"][agent_id]["unit_ids"]
+            while not decision.expired:
+                self.iterations += self.mcts.search(self.publish_every, lambda: decision.expired)
+                decision.publish(self.mcts.best_actions(unit_ids))
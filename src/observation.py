@@ -0,0 +1,237 @@
+## Observation maps kept up to date from tick events.
+##
+## BoardState.to_learnable rebuilds every map from the whole entity list on each
+## call. ObservationBuilder keeps one set of maps for the game and only rewrites
+## the cells named in each event, so a tick costs as much as its events rather
+## than the board. The maps are numpy arrays and `maps` hands out torch views of
+## them (torch.from_numpy shares memory), so patches show up in the tensors
+## without copying. Clone a map if it has to outlive the next tick.
+##
+## Maps are keyed by entity class like to_learnable:
+##   UnitState       1 where a unit stands (dead units stay on the board)
+##   Indestructible  1 for metal blocks
+##   Destructible    hp of wooden and ore blocks
+##   Ammo, Radius, Freeze  1 for each pickup
+##   Bomb            [3, W, H]: expires, hp, blast diameter
+##   Fire            expires tick, NO_EXPIRY for end game fire
+##
+## to_array stacks them into one int32 [len(CHANNELS), W, H] array. For learning
+## and replay buffers there is also a compact layout: one uint8
+## [len(COMPACT_CHANNELS), W, H] buffer, a quarter of the int32 size, that the
+## caller allocates once (observation_buffer) and has rewritten every tick
+## (ObservationBuilder.write_compact, BoardState.to_observation). Channels:
+##   0 unit                 1 where a unit stands
+##   1 metal                1 for metal blocks
+##   2 destructible_hp      hp of wooden and ore blocks
+##   3 ammo                 1 for ammo pickups
+##   4 blast_powerup        1 for blast radius pickups
+##   5 freeze_powerup       1 for freeze pickups
+##   6 bomb_ticks_left      ticks until the bomb goes off
+##   7 bomb_hp              hp of the bomb
+##   8 bomb_blast_diameter  blast diameter of the bomb
+##   9 fire_ticks_left      ticks until the fire burns out, NEVER for end game fire
+## Absolute expiry ticks don't fit a byte, so the compact layout counts ticks from
+## the current tick. Ticks left are at least 1 for anything on the board (0 is an
+## empty cell) and at most NEVER - 1, every other value is clipped to 0..255.
+## Cast the buffer to float16/float32 on the way into a model.
+
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import torch
+
+from classes import Ammo, Bomb, Destructible, Fire, Freeze, Indestructible, Radius, UnitState
+from entity_store import EntityStore
+from simulator import AMMO, BLAST_POWERUP, BOMB, FIRE, FREEZE_POWERUP, METAL, NO_EXPIRY, ORE, WOOD
+
+## engine entity type -> map it is drawn on
+_ENTITY_MAPS = {"m": Indestructible, "w": Destructible, "o": Destructible, "a": Ammo,
+                "bp": Radius, "fp": Freeze, "b": Bomb, "x": Fire}
+
+_MOVES = {"up": (0, 1), "down": (0, -1), "left": (-1, 0), "right": (1, 0)}
+
+## channel order of ObservationBuilder.to_array, the bomb map takes three channels
+CHANNELS = ("unit", "metal", "destructible_hp", "ammo", "blast_powerup", "freeze_powerup",
+            "bomb_expires", "bomb_hp", "bomb_blast_diameter", "fire_expires")
+_CHANNEL_MAPS = (UnitState, Indestructible, Destructible, Ammo, Radius, Freeze, Bomb, Fire)
+
+## channel order of the compact layout, see the header
+COMPACT_CHANNELS = ("unit", "metal", "destructible_hp", "ammo", "blast_powerup", "freeze_powerup",
+                    "bomb_ticks_left", "bomb_hp", "bomb_blast_diameter", "fire_ticks_left")
+COMPACT_DTYPE = np.uint8
+## fire_ticks_left of end game fire
+NEVER = np.iinfo(COMPACT_DTYPE).max
+_UNIT, _METAL, _DESTRUCTIBLE, _AMMO, _BLAST, _FREEZE, _BOMB_TICKS, _BOMB_HP, _BOMB_DIAMETER, _FIRE_TICKS = \
+    range(len(COMPACT_CHANNELS))
+## the two expiry channels as one strided slice of the staging array
+_EXPIRY_CHANNELS = slice(_BOMB_TICKS, _FIRE_TICKS + 1, _FIRE_TICKS - _BOMB_TICKS)
+## store type code -> channel of the entities drawn as a 1
+_MARKERS = ((METAL, _METAL), (AMMO, _AMMO), (BLAST_POWERUP, _BLAST), (FREEZE_POWERUP, _FREEZE))
+
+
+## A zeroed compact observation buffer, [len(COMPACT_CHANNELS), W, H] or with a
+## leading batch dimension
+def observation_buffer(width: int, height: int, batch: Optional[int] = None) -> np.ndarray:
+    shape = (len(COMPACT_CHANNELS), width, height)
+    return np.zeros(shape if batch is None else (batch,) + shape, dtype=COMPACT_DTYPE)
+
+
+## Ticks left of an array of expiry ticks, see the header
+## (ufuncs with out= rather than np.clip, which costs several times more on arrays
+## this small)
+def _ticks_left(expires: np.ndarray, tick: int) -> np.ndarray:
+    ticks = expires - tick
+    np.maximum(ticks, 1, out=ticks)
+    np.minimum(ticks, NEVER - 1, out=ticks)
+    ticks[expires == NO_EXPIRY] = NEVER
+    return ticks
+
+
+## Compact observation of a BoardState written into `out` (allocated if None).
+## Entity lists are put in an EntityStore first, whose columns take a few array
+## writes per entity type
+def write_board_observation(board, out: Optional[np.ndarray] = None) -> np.ndarray:
+    if out is None:
+        out = observation_buffer(board.width, board.height)
+    out.fill(0)
+    store = board.entities
+    if not isinstance(store, EntityStore):
+        store = EntityStore.from_entities(store)
+    x, y, kind = store.x, store.y, store.type
+    for code, channel in _MARKERS:
+        rows = kind == code
+        out[channel, x[rows], y[rows]] = 1
+    rows = (kind == WOOD) | (kind == ORE)
+    out[_DESTRUCTIBLE, x[rows], y[rows]] = np.minimum(store.hp[rows], NEVER)
+    rows = kind == BOMB
+    out[_BOMB_TICKS, x[rows], y[rows]] = _ticks_left(store.expires[rows], board.tick)
+    out[_BOMB_HP, x[rows], y[rows]] = np.minimum(store.hp[rows], NEVER)
+    out[_BOMB_DIAMETER, x[rows], y[rows]] = np.minimum(store.blast_diameter[rows], NEVER)
+    rows = kind == FIRE
+    out[_FIRE_TICKS, x[rows], y[rows]] = _ticks_left(store.expires[rows], board.tick)
+    for unit in store.units:
+        out[_UNIT, unit.coord.x, unit.coord.y] = 1
+    return out
+
+
+class ObservationBuilder:
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self._arrays = {key: np.zeros((width, height), dtype=np.int32)
+                        for key in (UnitState, Indestructible, Destructible, Ammo, Radius, Freeze, Fire)}
+        self._arrays[Bomb] = np.zeros((3, width, height), dtype=np.int32)
+        self.maps: Dict[type, torch.Tensor] = {key: torch.from_numpy(array) for key, array in self._arrays.items()}
+        ## which map each occupied cell is drawn on, so a cell can be cleared without
+        ## touching every map
+        self._cells: Dict[Tuple[int, int], type] = {}
+        self._units: Dict[str, Tuple[int, int]] = {}
+        ## tick of the last payload, the compact layout counts expiries from it
+        self.tick = 0
+        ## int32 staging for write_compact, allocated on first use
+        self._staging: Optional[np.ndarray] = None
+
+    @staticmethod
+    def from_game_state(game_state: dict) -> 'ObservationBuilder':
+        world = game_state["world"]
+        builder = ObservationBuilder(world["width"], world["height"])
+        builder.reset(game_state)
+        return builder
+
+    ## Redraw everything from a full game_state payload
+    def reset(self, game_state: dict):
+        for array in self._arrays.values():
+            array.fill(0)
+        self._cells.clear()
+        self._units.clear()
+        self.tick = game_state.get("tick", 0)
+        for entity in game_state["entities"]:
+            self._draw(entity)
+        for unit in game_state["unit_state"].values():
+            self._on_unit_state(unit)
+
+    ## Apply one event of a tick payload
+    def on_event(self, event: dict):
+        event_type = event.get("type")
+        if event_type == "entity_spawned":
+            self._draw(event["data"])
+        elif event_type == "entity_expired":
+            self._clear(*event["data"])
+        elif event_type == "entity_state":
+            self._draw(event["updated_entity"])
+        elif event_type == "unit_state":
+            self._on_unit_state(event["data"])
+        elif event_type == "unit":
+            ## moves only arrive as the action, there is no unit_state for them
+            data = event["data"]
+            if data.get("type") == "move" and data.get("move") in _MOVES and data["unit_id"] in self._units:
+                x, y = self._units[data["unit_id"]]
+                dx, dy = _MOVES[data["move"]]
+                self._move_unit(data["unit_id"], (x + dx, y + dy))
+
+    ## All maps stacked into one [len(CHANNELS), W, H] int32 array
+    def to_array(self, out: Optional[np.ndarray] = None) -> np.ndarray:
+        if out is None:
+            out = np.empty((len(CHANNELS), self.width, self.height), dtype=np.int32)
+        channel = 0
+        for key in _CHANNEL_MAPS:
+            array = self._arrays[key]
+            depth = array.shape[0] if array.ndim == 3 else 1
+            out[channel:channel + depth] = array
+            channel += depth
+        return out
+
+    ## The compact layout (see the header) written into `out`, a buffer from
+    ## observation_buffer that the caller keeps and passes in every tick
+    def write_compact(self, out: Optional[np.ndarray] = None) -> np.ndarray:
+        if out is None:
+            out = observation_buffer(self.width, self.height)
+        if self._staging is None:
+            self._staging = np.empty((len(CHANNELS), self.width, self.height), dtype=np.int32)
+        staging = self.to_array(self._staging)
+        expires = staging[_EXPIRY_CHANNELS]
+        ticks = _ticks_left(expires, self.tick)
+        ticks[expires == 0] = 0
+        expires[...] = ticks
+        np.minimum(staging, NEVER, out=staging)
+        np.copyto(out, staging, casting="unsafe")
+        return out
+
+    def on_tick(self, game_tick: dict):
+        self.tick = game_tick.get("tick", self.tick)
+        for event in game_tick.get("events", ()):
+            self.on_event(event)
+
+    def _draw(self, entity: dict):
+        x, y = entity["x"], entity["y"]
+        self._clear(x, y)
+        key = _ENTITY_MAPS.get(entity["type"])
+        if key is None:
+            return
+        self._cells[(x, y)] = key
+        array = self._arrays[key]
+        if key is Bomb:
+            array[:, x, y] = (entity["expires"], entity["hp"], entity["blast_diameter"])
+        elif key is Destructible:
+            array[x, y] = entity["hp"]
+        elif key is Fire:
+            array[x, y] = entity.get("expires", NO_EXPIRY)
+        else:
+            array[x, y] = 1
+
+    def _clear(self, x: int, y: int):
+        key = self._cells.pop((x, y), None)
+        if key is not None:
+            self._arrays[key][..., x, y] = 0
+
+    def _on_unit_state(self, unit: dict):
+        x, y = unit["coordinates"]
+        self._move_unit(unit["unit_id"], (x, y))
+
+    def _move_unit(self, unit_id: str, coordinates: Tuple[int, int]):
+        units = self._arrays[UnitState]
+        old: Optional[Tuple[int, int]] = self._units.get(unit_id)
+        if old is not None:
+            units[old] = 0
+        self._units[unit_id] = coordinates
+        units[coordinates] = 1
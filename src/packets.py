@@ -0,0 +1,31 @@
+## JSON parsing of server packets with the fastest backend installed.
+##
+## Backends, fastest first (pip install bomberland[fast-json] for the first two):
+##   orjson   orjson.loads
+##   msgspec  msgspec.json.decode, about as fast
+##   json     the standard library, about 3x slower on a 15x15 game_state
+## All three give the same dict tree, so GameState parses with the first one
+## found. BACKEND says which one that is.
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+## every installed backend by name, fastest first
+BACKENDS = {}
+if orjson is not None:
+    BACKENDS["orjson"] = orjson.loads
+if msgspec is not None:
+    BACKENDS["msgspec"] = msgspec.json.decode
+BACKENDS["json"] = json.loads
+
+BACKEND = next(iter(BACKENDS))
+loads = BACKENDS[BACKEND]
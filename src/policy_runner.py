@@ -0,0 +1,206 @@
+## Batched CPU inference for learned policies.
+##
+## A policy is a torch module taking [B, len(CHANNELS) + 1, W, H] float32 inputs
+## and returning [B, len(ACTIONS) + 1] logits over the action codes of
+## vec_board_state (0 does nothing, then classes.ACTIONS in order). Each row is one
+## unit: its game's observation (ObservationBuilder.to_array channels) plus an ego
+## channel that is 1 where the unit stands.
+##
+## Calling the model once per unit per tick pays the python and dispatch overhead of
+## a forward pass for every unit. PolicyRunner puts every unit that needs an action
+## into one batch instead:
+##   act(observations, games, xs, ys)  the units of several games in one forward pass
+##   decide(observation, units)        async, for tick callbacks: the requests of every
+##       game hosted in the process that arrive within `max_wait` of the first one
+##       (or until `max_batch` units) share a forward pass, each gets its own
+##       actions back
+##   policy_callback(client, runner)   a GameState tick callback built on decide
+## The forward pass runs under torch.inference_mode on a worker thread, so the
+## event loop keeps receiving frames (and forming the next batch) meanwhile.
+##
+## The model can be prepared for CPU serving when the runner is made:
+##   quantize  torch.ao.quantization.quantize_dynamic to int8 weights. Only Linear
+##             (and recurrent) layers are quantized, convolutions stay float32
+##   script    torch.jit.script then torch.jit.freeze, which folds the weights into
+##             the graph and drops the python overhead of the module
+
+import asyncio
+import concurrent.futures
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+from torch import nn
+
+from classes import ACTIONS, Action
+from observation import CHANNELS
+
+INPUT_CHANNELS = len(CHANNELS) + 1
+N_ACTION_CODES = len(ACTIONS) + 1
+_EGO = len(CHANNELS)
+
+
+## Action of an action code, None for code 0
+def decode_action(code: int) -> Optional[Action]:
+    return ACTIONS[code - 1] if code > 0 else None
+
+
+## A small convolutional policy: a few 3x3 convolutions over the board, then
+## fully connected layers to the action logits. A starting point and the model
+## the tests and benchmarks use
+class ConvPolicy(nn.Module):
+    def __init__(self, width: int, height: int, channels: int = 32, hidden: int = 128):
+        super().__init__()
+        self.body = nn.Sequential(
+            nn.Conv2d(INPUT_CHANNELS, channels, 3, padding=1), nn.ReLU(),
+            nn.Conv2d(channels, channels, 3, padding=1), nn.ReLU(),
+        )
+        self.head = nn.Sequential(
+            nn.Flatten(),
+            nn.Linear(channels * width * height, hidden), nn.ReLU(),
+            nn.Linear(hidden, N_ACTION_CODES),
+        )
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.head(self.body(x))
+
+
+## The model ready for CPU inference, see the module header. The model passed in
+## is put in eval mode, quantizing and scripting work on copies
+def prepare_model(model: nn.Module, quantize: bool = False, script: bool = False) -> nn.Module:
+    model = model.eval()
+    if quantize:
+        model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear, nn.LSTM, nn.GRU}, dtype=torch.qint8)
+    if script:
+        model = torch.jit.freeze(torch.jit.script(model))
+    return model
+
+
+class PolicyRunner:
+    ## greedy picks the most likely action, otherwise actions are sampled from the
+    ## softmax with `generator`. threads sets torch's intra-op thread count
+    def __init__(self, model: nn.Module, quantize: bool = False, script: bool = False, max_batch: int = 256,
+                 max_wait: float = 0.001, greedy: bool = True, generator: Optional[torch.Generator] = None,
+                 threads: Optional[int] = None):
+        if threads is not None:
+            torch.set_num_threads(threads)
+        self.model = prepare_model(model, quantize, script)
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.greedy = greedy
+        self.generator = generator
+        ## float32 inputs, grown when a larger batch comes along and reused
+        self._inputs = np.zeros((0, INPUT_CHANNELS, 0, 0), dtype=np.float32)
+        ## one thread: forward passes don't overlap, torch parallelises inside them
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="policy")
+        ## decide() requests waiting for the next forward pass
+        self._waiting: List[Tuple[np.ndarray, List[Tuple[str, int, int]], asyncio.Future]] = []
+        self._waiting_units = 0
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        ## forward passes run and units they covered
+        self.batches = 0
+        self.units = 0
+
+    def _input_buffer(self, batch: int, width: int, height: int) -> np.ndarray:
+        buffer = self._inputs
+        if buffer.shape[0] < batch or buffer.shape[2:] != (width, height):
+            buffer = self._inputs = np.zeros((max(batch, buffer.shape[0]), INPUT_CHANNELS, width, height),
+                                             dtype=np.float32)
+        return buffer[:batch]
+
+    ## Action codes [B] for B units: unit i is at (xs[i], ys[i]) in game games[i],
+    ## whose observation is observations[games[i]] ([G, len(CHANNELS), W, H]).
+    ## The input buffer is shared, so calls must not overlap (decide runs them on
+    ## its one worker thread)
+    def act(self, observations: np.ndarray, games: np.ndarray, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        batch = len(games)
+        if batch == 0:
+            return np.zeros(0, dtype=np.int64)
+        _, _, width, height = observations.shape
+        inputs = self._input_buffer(batch, width, height)
+        inputs[:, :_EGO] = observations[games]
+        inputs[:, _EGO] = 0
+        inputs[np.arange(batch), _EGO, xs, ys] = 1
+        with torch.inference_mode():
+            logits = self.model(torch.from_numpy(inputs))
+            if self.greedy:
+                codes = logits.argmax(dim=1)
+            else:
+                codes = torch.multinomial(torch.softmax(logits, dim=1), 1, generator=self.generator)[:, 0]
+        self.batches += 1
+        self.units += batch
+        return codes.numpy()
+
+    ## Actions for one game's units, [(unit_id, x, y)], batched with the other
+    ## decide() calls that come in at about the same time
+    async def decide(self, observation: np.ndarray, units: Sequence[Tuple[str, int, int]]) -> Dict[str, Optional[Action]]:
+        if not units:
+            return {}
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._waiting.append((observation, list(units), future))
+        self._waiting_units += len(units)
+        if self._waiting_units >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        waiting, self._waiting, self._waiting_units = self._waiting, [], 0
+        if not waiting:
+            return
+        observations = np.stack([observation for observation, _, _ in waiting])
+        games, xs, ys = [], [], []
+        for game, (_, units, _) in enumerate(waiting):
+            for _, x, y in units:
+                games.append(game)
+                xs.append(x)
+                ys.append(y)
+        task = asyncio.get_running_loop().run_in_executor(
+            self._executor, self.act, observations, np.array(games), np.array(xs), np.array(ys))
+        task.add_done_callback(lambda done: self._scatter(waiting, done))
+
+    @staticmethod
+    def _scatter(waiting, done: asyncio.Future):
+        if done.exception() is not None:
+            for _, _, future in waiting:
+                if not future.done():
+                    future.set_exception(done.exception())
+            return
+        codes = done.result().tolist()
+        start = 0
+        for _, units, future in waiting:
+            end = start + len(units)
+            actions = {unit_id: decode_action(code) for (unit_id, _, _), code in zip(units, codes[start:end])}
+            start = end
+            if not future.done():
+                future.set_result(actions)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+## Living units of agent_id in a game_state as (unit_id, x, y)
+def own_units(game_state: dict, agent_id: str) -> List[Tuple[str, int, int]]:
+    units = []
+    for unit_id in game_state["agents"][agent_id]["unit_ids"]:
+        unit = game_state["unit_state"][unit_id]
+        if unit["hp"] > 0:
+            x, y = unit["coordinates"]
+            units.append((unit_id, x, y))
+    return units
+
+
+## Tick callback for a GameState that plays the runner's policy:
+## client.set_game_tick_callback(policy_callback(client, runner)). Every client
+## sharing the runner is batched with the others
+def policy_callback(client, runner: PolicyRunner):
+    async def on_tick(tick_number: int, game_state: dict):
+        actions = await runner.decide(client.observation.to_array(), own_units(game_state, client.agent_id))
+        await client.send_actions(actions)
+
+    return on_tick
@@ -0,0 +1,188 @@
+## Replays (endgame_state packets like starter/agents/replay.json) turned into a
+## training set on disk.
+##
+## ingest() plays each replay's events through an ObservationBuilder one file at a
+## time and writes one sample per tick:
+##   observation  [C, W, H] uint8, the board at the start of the tick in the compact
+##                layout of observation.py (COMPACT_CHANNELS, ticks counted from the
+##                tick before), a quarter of the int32 maps
+##   actions      [U] int8, what each unit did on the tick (vec_board_state.ACTION_CODES, 0 = nothing)
+##   winner       int8, index of the winning agent in AGENTS, -1 for a draw
+##   tick         int32
+## Samples are written to shards of `shard_size` ticks (the last one may be short)
+## saved as plain .npy files, plus an index.json describing them. ReplayDataset
+## memory maps the shards, so reading a sample only touches the pages it needs,
+## and widens observations to a model dtype (float32 by default) as they are read.
+
+import json
+import os
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+from observation import COMPACT_CHANNELS, COMPACT_DTYPE, ObservationBuilder, observation_buffer
+from vec_board_state import ACTION_CODES, NOOP
+
+AGENTS = ("a", "b")
+INDEX_FILE = "index.json"
+_ARRAYS = ("observation", "actions", "winner", "tick")
+
+
+## Per tick (observation, actions, tick) of one replay payload, plus its unit order.
+## The observation buffer is reused, copy it to keep it past the next sample
+def replay_samples(payload: dict) -> Tuple[List[str], Iterator[Tuple[np.ndarray, np.ndarray, int]]]:
+    initial = payload["initial_state"]
+    unit_ids = [unit_id for agent in AGENTS for unit_id in initial["agents"][agent]["unit_ids"]]
+    history = {tick["tick"]: tick["events"] for tick in payload["history"]}
+
+    def samples():
+        builder = ObservationBuilder.from_game_state(initial)
+        out = observation_buffer(builder.width, builder.height)
+        for tick in range(initial["tick"] + 1, max(history, default=initial["tick"]) + 1):
+            events = history.get(tick, ())
+            actions = np.zeros(len(unit_ids), dtype=np.int8)
+            for event in events:
+                if event.get("type") != "unit":
+                    continue
+                data = event["data"]
+                action = data.get("move") if data.get("type") == "move" else data.get("type")
+                if data.get("unit_id") in unit_ids:
+                    actions[unit_ids.index(data["unit_id"])] = ACTION_CODES.get(action, NOOP)
+            builder.tick = tick - 1
+            yield builder.write_compact(out), actions, tick
+            for event in events:
+                builder.on_event(event)
+
+    return unit_ids, samples()
+
+
+class _ShardWriter:
+    def __init__(self, directory: str, shard_size: int):
+        self.directory = directory
+        self.shard_size = shard_size
+        self.shards: List[Dict] = []
+        self._buffers = None
+        self._count = 0
+
+    def add(self, observation: np.ndarray, actions: np.ndarray, winner: int, tick: int):
+        if self._buffers is None:
+            self._buffers = {
+                "observation": np.empty((self.shard_size,) + observation.shape, dtype=COMPACT_DTYPE),
+                "actions": np.empty((self.shard_size,) + actions.shape, dtype=np.int8),
+                "winner": np.empty(self.shard_size, dtype=np.int8),
+                "tick": np.empty(self.shard_size, dtype=np.int32),
+            }
+        i = self._count
+        self._buffers["observation"][i] = observation
+        self._buffers["actions"][i] = actions
+        self._buffers["winner"][i] = winner
+        self._buffers["tick"][i] = tick
+        self._count += 1
+        if self._count == self.shard_size:
+            self.flush()
+
+    def flush(self):
+        if self._count == 0:
+            return
+        name = f"shard_{len(self.shards):05d}"
+        for array in _ARRAYS:
+            np.save(os.path.join(self.directory, f"{name}.{array}.npy"), self._buffers[array][:self._count])
+        self.shards.append({"name": name, "count": self._count})
+        self._count = 0
+
+
+## Write every replay in replay_paths to shards in directory. Returns the index
+def ingest(replay_paths: Iterable[str], directory: str, shard_size: int = 4096) -> dict:
+    os.makedirs(directory, exist_ok=True)
+    writer = _ShardWriter(directory, shard_size)
+    replays = []
+    shape = None
+    first = 0
+    for path in replay_paths:
+        with open(path) as f:
+            packet = json.load(f)
+        payload = packet.get("payload", packet)
+        world = payload["initial_state"]["world"]
+        if shape is None:
+            shape = (world["width"], world["height"])
+        elif shape != (world["width"], world["height"]):
+            raise Exception(f"{path} is {world['width']}x{world['height']}, earlier replays are {shape[0]}x{shape[1]}")
+
+        winner = payload.get("winning_agent_id")
+        winner = AGENTS.index(winner) if winner in AGENTS else -1
+        unit_ids, samples = replay_samples(payload)
+        count = 0
+        for observation, actions, tick in samples:
+            writer.add(observation, actions, winner, tick)
+            count += 1
+        replays.append({"path": os.path.abspath(path), "first": first, "count": count,
+                        "winner": winner, "unit_ids": unit_ids})
+        first += count
+        ## drop the parsed replay before loading the next one
+        del packet, payload
+    writer.flush()
+
+    index = {"shard_size": shard_size, "channels": list(COMPACT_CHANNELS), "agents": list(AGENTS),
+             "width": shape[0] if shape else 0, "height": shape[1] if shape else 0,
+             "total": first, "shards": writer.shards, "replays": replays}
+    with open(os.path.join(directory, INDEX_FILE), "w") as f:
+        json.dump(index, f)
+    return index
+
+
+## Map-style dataset over ingested shards, usable with torch.utils.data.DataLoader.
+## Items are (observation, actions, winner) tensors, observations as `dtype`
+class ReplayDataset(Dataset):
+    def __init__(self, directory: str, dtype: torch.dtype = torch.float32):
+        self.directory = directory
+        self.dtype = dtype
+        with open(os.path.join(directory, INDEX_FILE)) as f:
+            self.index = json.load(f)
+        self.shard_size = self.index["shard_size"]
+        self._shards: Dict[int, Dict[str, np.ndarray]] = {}
+
+    def __len__(self) -> int:
+        return self.index["total"]
+
+    def shard(self, number: int) -> Dict[str, np.ndarray]:
+        shard = self._shards.get(number)
+        if shard is None:
+            name = self.index["shards"][number]["name"]
+            shard = {array: np.load(os.path.join(self.directory, f"{name}.{array}.npy"), mmap_mode="r")
+                     for array in _ARRAYS}
+            self._shards[number] = shard
+        return shard
+
+    def sample(self, i: int) -> Dict[str, np.ndarray]:
+        if not 0 <= i < len(self):
+            raise IndexError(f"sample {i} out of range for {len(self)} samples")
+        shard = self.shard(i // self.shard_size)
+        offset = i % self.shard_size
+        return {array: shard[array][offset] for array in _ARRAYS}
+
+    def __getitem__(self, i: int):
+        sample = self.sample(i)
+        return (torch.from_numpy(np.array(sample["observation"])).to(self.dtype),
+                torch.from_numpy(np.array(sample["actions"])),
+                int(sample["winner"]))
+
+    ## Batches of (observations, actions, winners) tensors. Shuffling keeps the
+    ## samples of a batch within one shard so each batch is one slice of one map
+    def batches(self, batch_size: int, shuffle: bool = False,
+                seed: Optional[int] = None) -> Iterator[Tuple[torch.Tensor, torch.Tensor, torch.Tensor]]:
+        rng = np.random.default_rng(seed)
+        order = []
+        for number, shard in enumerate(self.index["shards"]):
+            offsets = rng.permutation(shard["count"]) if shuffle else np.arange(shard["count"])
+            order.extend((number, offsets[start:start + batch_size]) for start in range(0, len(offsets), batch_size))
+        if shuffle:
+            order = [order[i] for i in rng.permutation(len(order))]
+        for number, offsets in order:
+            shard = self.shard(number)
+            ## sorted offsets read the map front to back
+            offsets = np.sort(offsets)
+            yield (torch.from_numpy(shard["observation"][offsets]).to(self.dtype),
+                   torch.from_numpy(shard["actions"][offsets]),
+                   torch.from_numpy(shard["winner"][offsets].astype(np.int64)))
@@ -0,0 +1,142 @@
+## Seekable replays.
+##
+## A replay (endgame_state packet) only has the initial state and the events of
+## each tick, so getting to tick t means applying every event before it.
+## ReplayIndex.build writes, next to the event log, a full state snapshot (a
+## keyframe) every `keyframe_interval` ticks. state_at(t) then starts from the
+## closest keyframe at or before t and applies at most keyframe_interval ticks of
+## events.
+##
+## On disk (a directory):
+##   events.jsonl     one line per tick from first_tick + 1 to last_tick, the tick's events
+##   keyframes.jsonl  one line per keyframe, the full game state at that tick
+##   index.json       interval, tick range, winner and the byte offset of every line
+## Only index.json is read up front, lines are read with a seek when needed.
+
+import copy
+import json
+import os
+from typing import Iterator, List, Optional, Tuple
+
+MOVES = {"up": (0, 1), "down": (0, -1), "left": (-1, 0), "right": (1, 0)}
+INDEX_FILE = "index.json"
+
+
+## Apply one tick's events to a game_state dict, the same bookkeeping as the
+## GameState tick handlers
+def apply_events(state: dict, events: List[dict]):
+    for event in events:
+        event_type = event["type"]
+        if event_type == "entity_spawned":
+            state["entities"].append(event["data"])
+        elif event_type == "entity_expired":
+            x, y = event["data"]
+            state["entities"] = [e for e in state["entities"] if (e["x"], e["y"]) != (x, y)]
+        elif event_type == "entity_state":
+            x, y = event["coordinates"]
+            state["entities"] = [e for e in state["entities"] if (e["x"], e["y"]) != (x, y)]
+            state["entities"].append(event["updated_entity"])
+        elif event_type == "unit_state":
+            state["unit_state"][event["data"]["unit_id"]] = event["data"]
+        elif event_type == "unit" and event["data"]["type"] == "move":
+            unit = state["unit_state"][event["data"]["unit_id"]]
+            dx, dy = MOVES[event["data"]["move"]]
+            unit["coordinates"] = [unit["coordinates"][0] + dx, unit["coordinates"][1] + dy]
+
+
+class ReplayIndex:
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, INDEX_FILE)) as f:
+            index = json.load(f)
+        self.keyframe_interval: int = index["keyframe_interval"]
+        self.first_tick: int = index["first_tick"]
+        self.last_tick: int = index["last_tick"]
+        self.winning_agent_id: Optional[str] = index["winning_agent_id"]
+        self._event_offsets: List[int] = index["event_offsets"]
+        self._keyframe_offsets: List[int] = index["keyframe_offsets"]
+
+    ## Index the replay at replay_path into directory (default: <replay_path>.index)
+    @staticmethod
+    def build(replay_path: str, directory: Optional[str] = None, keyframe_interval: int = 50) -> 'ReplayIndex':
+        if keyframe_interval <= 0:
+            raise Exception("keyframe_interval must be positive")
+        if directory is None:
+            directory = replay_path + ".index"
+        os.makedirs(directory, exist_ok=True)
+        with open(replay_path) as f:
+            packet = json.load(f)
+        payload = packet.get("payload", packet)
+        state = copy.deepcopy(payload["initial_state"])
+        history = {tick["tick"]: tick["events"] for tick in payload["history"]}
+        first_tick = state["tick"]
+        last_tick = max(history, default=first_tick)
+
+        event_offsets, keyframe_offsets = [], []
+        with open(os.path.join(directory, "events.jsonl"), "w") as events_file, \
+                open(os.path.join(directory, "keyframes.jsonl"), "w") as keyframes_file:
+            for tick in range(first_tick, last_tick + 1):
+                if tick > first_tick:
+                    events = history.get(tick, [])
+                    event_offsets.append(events_file.tell())
+                    events_file.write(json.dumps(events) + "\n")
+                    apply_events(state, events)
+                    state["tick"] = tick
+                if (tick - first_tick) % keyframe_interval == 0:
+                    keyframe_offsets.append(keyframes_file.tell())
+                    keyframes_file.write(json.dumps(state) + "\n")
+
+        with open(os.path.join(directory, INDEX_FILE), "w") as f:
+            json.dump({"keyframe_interval": keyframe_interval, "first_tick": first_tick, "last_tick": last_tick,
+                       "winning_agent_id": payload.get("winning_agent_id"),
+                       "event_offsets": event_offsets, "keyframe_offsets": keyframe_offsets}, f)
+        return ReplayIndex(directory)
+
+    def __len__(self) -> int:
+        return self.last_tick - self.first_tick + 1
+
+    ## Events of one tick (empty for the first tick, it is the initial state)
+    def events_at(self, tick: int) -> List[dict]:
+        self._check_tick(tick)
+        if tick == self.first_tick:
+            return []
+        return self._read_line("events.jsonl", self._event_offsets[tick - self.first_tick - 1])
+
+    ## Game state after the events of `tick`
+    def state_at(self, tick: int) -> dict:
+        states = self.states(tick, tick + 1)
+        try:
+            return next(states)[1]
+        finally:
+            states.close()
+
+    ## (tick, state) for every tick in [start, stop), read lazily. The same dict is
+    ## updated in place and yielded each time, copy it to keep one
+    def states(self, start: Optional[int] = None, stop: Optional[int] = None) -> Iterator[Tuple[int, dict]]:
+        start = self.first_tick if start is None else start
+        stop = self.last_tick + 1 if stop is None else min(stop, self.last_tick + 1)
+        self._check_tick(start)
+        keyframe = (start - self.first_tick) // self.keyframe_interval
+        tick = self.first_tick + keyframe * self.keyframe_interval
+        state = self._read_line("keyframes.jsonl", self._keyframe_offsets[keyframe])
+
+        with open(os.path.join(self.directory, "events.jsonl")) as events_file:
+            if tick < self.last_tick:
+                events_file.seek(self._event_offsets[tick - self.first_tick])
+            while tick < stop:
+                if tick >= start:
+                    yield tick, state
+                tick += 1
+                if tick < stop:
+                    ## lines are consecutive, no need to seek again
+                    apply_events(state, json.loads(events_file.readline()))
+                    state["tick"] = tick
+
+    def _read_line(self, name: str, offset: int):
+        with open(os.path.join(self.directory, name)) as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    def _check_tick(self, tick: int):
+        if not self.first_tick <= tick <= self.last_tick:
+            raise IndexError(f"tick {tick} is outside the replay ({self.first_tick} to {self.last_tick})")
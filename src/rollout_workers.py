@@ -0,0 +1,185 @@
+## Rollouts on several cores.
+##
+## RolloutWorkers starts `n_workers` processes, each stepping its own
+## VecBoardState of `envs_per_worker` games. The learner and the workers share
+## four arrays (multiprocessing.shared_memory), covering all N games:
+##   actions       [N, U] int8    action codes, written by the learner
+##   observations  [N, C, W, H] int32  observation.CHANNELS maps after the step
+##   rewards       [N, agents] float32  +1 for the winner, -1 for the others, on the finishing tick
+##   dones         [N] bool        the game finished on this step (and was reset)
+## Each worker only reads and writes its own rows. The pipe to a worker carries a
+## command name and an acknowledgement, never the data, so a step costs no
+## pickling however big the batch is.
+##
+## The arrays handed out by the runner are views on shared memory that the next
+## step overwrites, copy them to keep them.
+
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from simulator import SimState
+from vec_board_state import VecBoardState, N_OBSERVATION_CHANNELS
+
+
+## name -> (shape, dtype) of every shared array, for n games of initial_state
+def _buffer_specs(n: int, initial_state: SimState) -> Dict[str, Tuple[tuple, type]]:
+    return {
+        "actions": ((n, len(initial_state.unit_ids)), np.int8),
+        "observations": ((n, N_OBSERVATION_CHANNELS, initial_state.width, initial_state.height), np.int32),
+        "rewards": ((n, len(initial_state.agent_ids)), np.float32),
+        "dones": ((n,), np.bool_),
+    }
+
+
+def _attach(memory: Dict[str, SharedMemory], specs: Dict[str, Tuple[tuple, type]]) -> Dict[str, np.ndarray]:
+    return {name: np.ndarray(shape, dtype=dtype, buffer=memory[name].buf) for name, (shape, dtype) in specs.items()}
+
+
+def _worker(connection, names: Dict[str, str], specs, start: int, initial_states: List[SimState],
+            max_ticks: Optional[int], seed: Optional[int]):
+    memory = {name: SharedMemory(name=shm_name) for name, shm_name in names.items()}
+    try:
+        buffers = _attach(memory, specs)
+        rows = slice(start, start + len(initial_states))
+        actions, observations = buffers["actions"][rows], buffers["observations"][rows]
+        rewards, dones = buffers["rewards"][rows], buffers["dones"][rows]
+        rng = None if seed is None else np.random.default_rng(seed)
+        vec = VecBoardState(initial_states, max_ticks=max_ticks, rng=rng)
+        agents = np.arange(len(vec.agent_ids))
+
+        while True:
+            command = connection.recv()
+            if command == "step":
+                done, winner = vec.step(actions)
+                dones[:] = done
+                rewards[:] = np.where(done[:, None], np.where(winner[:, None] == agents, 1.0, -1.0), 0.0)
+                rewards[done & (winner < 0)] = 0.0
+                vec.observations(observations)
+            elif command == "reset":
+                vec.reset()
+                dones[:] = False
+                rewards[:] = 0.0
+                vec.observations(observations)
+            elif command == "close":
+                break
+            else:
+                raise Exception(f"unknown rollout worker command {command!r}")
+            connection.send(command)
+    finally:
+        ## views must go before the memory they look at can be closed
+        buffers = actions = observations = rewards = dones = None
+        for block in memory.values():
+            block.close()
+        connection.close()
+
+
+class RolloutWorkers:
+    ## initial_states is either one state (every game starts from it) or one per
+    ## game, n_workers * envs_per_worker of them. Workers started with a seed drop
+    ## items from destroyed blocks (worker i uses seed + i), without one they don't
+    def __init__(self, initial_states, n_workers: int, envs_per_worker: int, max_ticks: Optional[int] = None,
+                 seed: Optional[int] = None, start_method: Optional[str] = None):
+        self.n = n_workers * envs_per_worker
+        if isinstance(initial_states, SimState):
+            initial_states = [initial_states] * self.n
+        if len(initial_states) != self.n:
+            raise Exception(f"need {self.n} initial states, got {len(initial_states)}")
+        first = initial_states[0]
+        self.unit_ids: Tuple[str, ...] = first.unit_ids
+        self.agent_ids: Tuple[str, ...] = first.agent_ids
+
+        specs = _buffer_specs(self.n, first)
+        self._memory = {name: SharedMemory(create=True, size=max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize))
+                        for name, (shape, dtype) in specs.items()}
+        buffers = _attach(self._memory, specs)
+        self.actions: np.ndarray = buffers["actions"]
+        self.observations: np.ndarray = buffers["observations"]
+        self.rewards: np.ndarray = buffers["rewards"]
+        self.dones: np.ndarray = buffers["dones"]
+        self.actions.fill(0)
+
+        context = get_context(start_method)
+        names = {name: block.name for name, block in self._memory.items()}
+        self._connections = []
+        self._processes = []
+        for i in range(n_workers):
+            parent, child = context.Pipe()
+            start = i * envs_per_worker
+            process = context.Process(
+                target=_worker, daemon=True,
+                args=(child, names, specs, start, list(initial_states[start:start + envs_per_worker]),
+                      max_ticks, None if seed is None else seed + i))
+            process.start()
+            child.close()
+            self._connections.append(parent)
+            self._processes.append(process)
+        self._waiting = False
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def reset(self) -> np.ndarray:
+        self._send("reset")
+        self._wait()
+        return self.observations
+
+    ## Step every game with `actions` ([N, U] action codes, None to step with
+    ## whatever is already in self.actions). Returns (observations, rewards, dones)
+    def step(self, actions: Optional[np.ndarray] = None):
+        self.step_async(actions)
+        return self.step_wait()
+
+    ## Start a step and return straight away, so the learner can work while the
+    ## workers step. Don't touch the shared arrays until step_wait returns
+    def step_async(self, actions: Optional[np.ndarray] = None):
+        if actions is not None:
+            self.actions[:] = actions
+        self._send("step")
+
+    def step_wait(self):
+        self._wait()
+        return self.observations, self.rewards, self.dones
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._waiting:
+            self._wait()
+        for connection, process in zip(self._connections, self._processes):
+            if process.is_alive():
+                connection.send("close")
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+            connection.close()
+        self.actions = self.observations = self.rewards = self.dones = None
+        for block in self._memory.values():
+            block.close()
+            block.unlink()
+
+    def _send(self, command: str):
+        if self._closed:
+            raise Exception("RolloutWorkers is closed")
+        if self._waiting:
+            raise Exception("the previous step has not been waited on")
+        for connection in self._connections:
+            connection.send(command)
+        self._waiting = True
+
+    def _wait(self):
+        try:
+            for connection, process in zip(self._connections, self._processes):
+                try:
+                    connection.recv()
+                except EOFError:
+                    raise Exception(f"rollout worker {process.pid} exited (code {process.exitcode})")
+        finally:
+            self._waiting = False
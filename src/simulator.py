@@ -0,0 +1,743 @@
+## In-process forward model.
+##
+## A port of the tick rules in the TypeScript engine (starter/engine/bomberland-engine,
+## Game.GetTickResult and World) so a state can be advanced without sending
+## evaluate_next_state over the forward model socket.
+##
+## The engine keeps at most one entity per cell, so the board is stored as a
+## single [channel, width, height] int32 array and the units as small python lists,
+## which are faster than numpy for the scalar work a tick does. A copy shares the
+## board until one of the two writes to it (SimState.own_board), most ticks only
+## move units, so most states of a search never copy it.
+##
+## Speed on one core (benchmarks.py, 15x15 replay start): a quiet tick advanced
+## in place takes about 2us, and step() takes 4-12us including the copy.
+## successors() takes about 10us a node, most of it resolving the actions and
+## telling equal states apart. So search gets on the order of 100k nodes a
+## second, not the several hundred thousand a quiet tick in place reaches.
+## vec_board_state.py steps many games at once for rollouts.
+##
+## Randomness in the engine (item drops from destroyed blocks and the target of a
+## freeze powerup) is taken from an optional numpy Generator. Without one, blocks
+## never drop items and a freeze hits the first living enemy unit, so the model
+## is deterministic.
+
+import itertools
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from classes import (Action, Ammo, Bomb, BoardState, Coordinate, Destructible, Fire,
+                     Freeze, Indestructible, Radius, UnitState)
+from zobrist import board_key, cell_key, units_key
+
+## cell contents
+EMPTY, METAL, WOOD, ORE, AMMO, BLAST_POWERUP, FREEZE_POWERUP, BOMB, FIRE = range(9)
+
+ENTITY_CODES = {"m": METAL, "w": WOOD, "o": ORE, "a": AMMO, "bp": BLAST_POWERUP,
+                "fp": FREEZE_POWERUP, "b": BOMB, "x": FIRE}
+ENTITY_TYPES = {code: name for name, code in ENTITY_CODES.items()}
+
+## units can walk over these, everything else blocks a move
+PASSABLE = frozenset((EMPTY, AMMO, BLAST_POWERUP, FREEZE_POWERUP, FIRE))
+
+## board channels
+KIND, HP, EXPIRES, CREATED, OWNER, DIAMETER = range(6)
+N_CHANNELS = 6
+
+## unit columns
+UX, UY, UHP, UBOMBS, UDIAMETER, UINVULNERABLE, USTUNNED, UAGENT = range(8)
+
+## expiry of entities that never expire (blocks, end game fire)
+NO_EXPIRY = int(np.iinfo(np.int32).max)
+NO_OWNER = -1
+
+MOVES = {"up": (0, 1), "down": (0, -1), "left": (-1, 0), "right": (1, 0)}
+
+
+@dataclass(frozen=True)
+class SimConfig:
+    ## defaults are the engine's, see Config/getConfig.ts
+    game_duration_ticks: int = 200
+    fire_spawn_interval_ticks: int = 2
+    bomb_duration_ticks: int = 30
+    bomb_armed_ticks: int = 5
+    blast_duration_ticks: int = 5
+    invulnerability_ticks: int = 5
+    freeze_debuff_duration_ticks: int = 15
+    pickup_duration_ticks: int = 40
+    maximum_concurrent_bombs: int = 3
+    item_drop_probability: float = 0.5
+    ammo_spawn_weighting: float = 0.0
+    blast_powerup_spawn_weighting: float = 0.5
+    freeze_powerup_spawn_weighting: float = 0.5
+
+    @staticmethod
+    def from_game_config(config: Optional[Dict]) -> 'SimConfig':
+        if not config:
+            return _DEFAULT_CONFIG
+        return SimConfig(
+            game_duration_ticks=config.get("game_duration_ticks", 200),
+            fire_spawn_interval_ticks=config.get("fire_spawn_interval_ticks", 2))
+
+    def to_game_config(self) -> Dict:
+        return {"game_duration_ticks": self.game_duration_ticks,
+                "fire_spawn_interval_ticks": self.fire_spawn_interval_ticks}
+
+
+_DEFAULT_CONFIG = SimConfig()
+
+
+## Order in which the end game fire fills the board, as cell numbers (x + y * width).
+## Port of generateGrowingFireProgression: two clockwise spirals, one from the top
+## left and one from the bottom right, taking turns
+@lru_cache(maxsize=None)
+def fire_progression(width: int, height: int) -> tuple:
+    total = width * height
+    used = {}
+    # direction order for turning clockwise: right -> down -> left -> up
+    turns = {(1, 0): (0, -1), (0, -1): (-1, 0), (-1, 0): (0, 1), (0, 1): (1, 0)}
+    spirals = [[0, height - 1, (1, 0)], [width - 1, 0, (-1, 0)]]
+    for x, y, _ in spirals:
+        used[x + y * width] = None
+
+    for _ in range(total):
+        for spiral in spirals:
+            if len(used) >= total:
+                continue
+            x, y, direction = spiral
+            nx, ny = x + direction[0], y + direction[1]
+            if not (0 <= nx < width and 0 <= ny < height) or (nx + ny * width) in used:
+                direction = turns[direction]
+                nx, ny = x + direction[0], y + direction[1]
+            spiral[:] = [nx, ny, direction]
+            used[nx + ny * width] = None
+    return tuple(used)
+
+
+class SimState:
+    __slots__ = ("width", "height", "tick", "board", "units", "unit_ids", "agent_ids",
+                 "config", "next_expiry", "board_hash", "shared", "bombs")
+
+    def __init__(self, width: int, height: int, tick: int, board: np.ndarray,
+                 units: List[List[int]], unit_ids: tuple, agent_ids: tuple,
+                 config: SimConfig = _DEFAULT_CONFIG, next_expiry: Optional[int] = None,
+                 board_hash: Optional[int] = None, shared: bool = False, bombs: Optional[int] = None):
+        self.width = width
+        self.height = height
+        self.tick = tick
+        self.board = board
+        self.units = units
+        self.unit_ids = unit_ids
+        self.agent_ids = agent_ids
+        self.config = config
+        if next_expiry is None:
+            next_expiry = int(board[EXPIRES].min())
+        self.next_expiry = next_expiry
+        ## Zobrist key of the board, kept up to date by _place/_remove once computed
+        self.board_hash = board_hash
+        ## whether board is shared with a copy, see own_board
+        self.shared = shared
+        ## bombs on the board, kept up to date by _place/_remove
+        if bombs is None:
+            bombs = int(np.count_nonzero(board[KIND] == BOMB))
+        self.bombs = bombs
+
+    ## The board is shared with the original until either one writes to it
+    def copy(self) -> 'SimState':
+        self.shared = True
+        return SimState(self.width, self.height, self.tick, self.board, list(map(list.copy, self.units)),
+                        self.unit_ids, self.agent_ids, self.config, self.next_expiry, self.board_hash,
+                        True, self.bombs)
+
+    ## The board, copied first if it is shared with a copy. Anything that writes to
+    ## board takes it from here (the tick functions do before their first write)
+    def own_board(self) -> np.ndarray:
+        if self.shared:
+            self.board = self.board.copy()
+            self.shared = False
+        return self.board
+
+    @staticmethod
+    def empty_board(width: int, height: int) -> np.ndarray:
+        board = np.zeros([N_CHANNELS, width, height], dtype=np.int32)
+        board[EXPIRES] = NO_EXPIRY
+        board[OWNER] = NO_OWNER
+        return board
+
+    def unit_index(self, unit_id: str) -> int:
+        return self.unit_ids.index(unit_id)
+
+    ## Zobrist hash of the cells, units and tick (see zobrist.py)
+    def zobrist_hash(self) -> int:
+        if self.board_hash is None:
+            self.board_hash = board_key(self.board)
+        return self.board_hash ^ units_key(self.units, self.tick)
+
+    def is_complete(self) -> bool:
+        alive = set(unit[UAGENT] for unit in self.units if unit[UHP] > 0)
+        return len(alive) <= 1
+
+    ## Build from a game_state payload as sent by the server (or as kept by the
+    ## starter GameState)
+    @staticmethod
+    def from_game_state(game_state: Dict) -> 'SimState':
+        width = game_state["world"]["width"]
+        height = game_state["world"]["height"]
+        unit_ids = tuple(game_state["unit_state"].keys())
+        agent_ids = tuple(sorted(set(unit["agent_id"] for unit in game_state["unit_state"].values())))
+
+        units = []
+        for unit_id in unit_ids:
+            unit = game_state["unit_state"][unit_id]
+            x, y = unit["coordinates"]
+            units.append([x, y, unit["hp"], unit["inventory"]["bombs"], unit["blast_diameter"],
+                          unit.get("invulnerable", unit.get("invulnerability", 0)),
+                          unit.get("stunned", 0), agent_ids.index(unit["agent_id"])])
+
+        board = SimState.empty_board(width, height)
+        for entity in game_state["entities"]:
+            x, y = entity["x"], entity["y"]
+            board[KIND, x, y] = ENTITY_CODES[entity["type"]]
+            board[HP, x, y] = entity.get("hp", 0)
+            board[EXPIRES, x, y] = entity.get("expires", NO_EXPIRY)
+            board[CREATED, x, y] = entity.get("created", 0)
+            owner = entity.get("unit_id", entity.get("owner_unit_id"))
+            board[OWNER, x, y] = unit_ids.index(owner) if owner in unit_ids else NO_OWNER
+            board[DIAMETER, x, y] = entity.get("blast_diameter", 0)
+
+        return SimState(width, height, game_state["tick"], board, units, unit_ids, agent_ids,
+                        SimConfig.from_game_config(game_state.get("config")))
+
+    ## Serialise to the engine's game_state layout, entities in cell order
+    def to_game_state(self) -> Dict:
+        agents = {agent_id: {"agent_id": agent_id, "unit_ids": []} for agent_id in self.agent_ids}
+        unit_state = {}
+        for unit_id, unit in zip(self.unit_ids, self.units):
+            agent_id = self.agent_ids[unit[UAGENT]]
+            agents[agent_id]["unit_ids"].append(unit_id)
+            unit_state[unit_id] = {
+                "coordinates": [unit[UX], unit[UY]],
+                "hp": unit[UHP],
+                "inventory": {"bombs": unit[UBOMBS]},
+                "blast_diameter": unit[UDIAMETER],
+                "unit_id": unit_id,
+                "agent_id": agent_id,
+                "invulnerable": unit[UINVULNERABLE],
+                "stunned": unit[USTUNNED],
+            }
+
+        entities = []
+        kinds = self.board[KIND]
+        for x, y in zip(*np.nonzero(kinds)):
+            x, y = int(x), int(y)
+            kind = int(kinds[x, y])
+            entity = {"created": int(self.board[CREATED, x, y]), "x": x, "y": y,
+                      "type": ENTITY_TYPES[kind]}
+            owner = int(self.board[OWNER, x, y])
+            if owner != NO_OWNER:
+                entity["unit_id"] = self.unit_ids[owner]
+                entity["agent_id"] = self.agent_ids[self.units[owner][UAGENT]]
+            expires = int(self.board[EXPIRES, x, y])
+            if expires != NO_EXPIRY:
+                entity["expires"] = expires
+            if kind not in (METAL, FIRE):
+                entity["hp"] = int(self.board[HP, x, y])
+            if kind == BOMB:
+                entity["blast_diameter"] = int(self.board[DIAMETER, x, y])
+            entities.append(entity)
+
+        return {
+            "agents": agents,
+            "unit_state": unit_state,
+            "entities": entities,
+            "world": {"width": self.width, "height": self.height},
+            "tick": self.tick,
+            "config": self.config.to_game_config(),
+        }
+
+    @staticmethod
+    def from_board_state(state: BoardState) -> 'SimState':
+        from entity_store import EntityStore
+        if isinstance(state.entities, EntityStore):
+            return SimState._from_entity_store(state)
+
+        units = [entity for entity in state.entities if isinstance(entity, UnitState)]
+        unit_ids = tuple(unit.unitId for unit in units)
+        agent_ids = tuple(sorted(set(unit.agentId for unit in units)))
+        board = SimState.empty_board(state.width, state.height)
+
+        for entity in state.entities:
+            if isinstance(entity, UnitState):
+                continue
+            x, y = entity.coord.x, entity.coord.y
+            if isinstance(entity, Indestructible):
+                board[KIND, x, y] = METAL
+            elif isinstance(entity, Destructible):
+                ## BoardState does not tell wood and ore apart, they behave the same
+                board[KIND, x, y] = WOOD
+                board[HP, x, y] = entity.hp
+            elif isinstance(entity, (Ammo, Radius, Freeze)):
+                board[KIND, x, y] = AMMO if isinstance(entity, Ammo) else (
+                    BLAST_POWERUP if isinstance(entity, Radius) else FREEZE_POWERUP)
+                board[HP, x, y] = entity.hp
+                board[EXPIRES, x, y] = entity.expires
+            elif isinstance(entity, Bomb):
+                board[KIND, x, y] = BOMB
+                board[HP, x, y] = entity.hp
+                board[EXPIRES, x, y] = entity.expires
+                board[OWNER, x, y] = unit_ids.index(entity.owner) if entity.owner in unit_ids else NO_OWNER
+                board[DIAMETER, x, y] = entity.blastDiameter
+            elif isinstance(entity, Fire):
+                board[KIND, x, y] = FIRE
+                board[EXPIRES, x, y] = NO_EXPIRY if entity.expires is None else entity.expires
+                board[OWNER, x, y] = unit_ids.index(entity.owner) if entity.owner in unit_ids else NO_OWNER
+            board[CREATED, x, y] = entity.created
+
+        sim_units = [[unit.coord.x, unit.coord.y, unit.hp, unit.ammunition, unit.bomb,
+                      unit.invulnerability, unit.stunned, agent_ids.index(unit.agentId)]
+                     for unit in units]
+        return SimState(state.width, state.height, state.tick, board, sim_units, unit_ids,
+                        agent_ids, SimConfig.from_game_config(state.config))
+
+    @staticmethod
+    def _from_entity_store(state: BoardState) -> 'SimState':
+        store = state.entities
+        units = store.units
+        unit_ids = tuple(unit.unitId for unit in units)
+        agent_ids = tuple(sorted(set(unit.agentId for unit in units)))
+        board = SimState.empty_board(state.width, state.height)
+        xs, ys = store.x, store.y
+        board[KIND, xs, ys] = store.type
+        board[HP, xs, ys] = store.hp
+        board[EXPIRES, xs, ys] = store.expires
+        board[CREATED, xs, ys] = store.created
+        ## the store lists the units' ids first, any other owner is not on the board
+        board[OWNER, xs, ys] = np.where(store.owner < len(units), store.owner, NO_OWNER)
+        board[DIAMETER, xs, ys] = store.blast_diameter
+
+        sim_units = [[unit.coord.x, unit.coord.y, unit.hp, unit.ammunition, unit.bomb,
+                      unit.invulnerability, unit.stunned, agent_ids.index(unit.agentId)]
+                     for unit in units]
+        return SimState(state.width, state.height, state.tick, board, sim_units, unit_ids,
+                        agent_ids, SimConfig.from_game_config(state.config))
+
+    ## The entities come back as an entity_store.EntityStore
+    def to_board_state(self) -> BoardState:
+        from entity_store import EntityStore
+        units = [UnitState(unit_id, self.agent_ids[unit[UAGENT]], Coordinate(unit[UX], unit[UY]),
+                           unit[UHP], unit[UDIAMETER], unit[UBOMBS], unit[UINVULNERABLE], unit[USTUNNED])
+                 for unit_id, unit in zip(self.unit_ids, self.units)]
+
+        board = self.board
+        xs, ys = np.nonzero(board[KIND])
+        cells = board[:, xs, ys]
+        store = EntityStore({"x": xs, "y": ys, "type": cells[KIND], "hp": cells[HP], "expires": cells[EXPIRES],
+                             "created": cells[CREATED], "owner": cells[OWNER], "blast_diameter": cells[DIAMETER]},
+                            self.unit_ids, units)
+
+        config = self.config.to_game_config() if self.config is not _DEFAULT_CONFIG else None
+        return BoardState(self.width, self.height, self.tick, store, config)
+
+
+## Advance a copy of the state by one tick. actions are keyed by unit id
+def step(state: SimState, actions: Dict[str, Action], rng: Optional[np.random.Generator] = None) -> SimState:
+    next_state = state.copy()
+    advance(next_state, actions, rng)
+    return next_state
+
+
+## Advance the state by one tick in place, in the same order as Game.GetTickResult:
+## end game fire, expiries, unit/entity collisions, then bombs, detonations and moves
+def advance(s: SimState, actions: Dict[str, Action], rng: Optional[np.random.Generator] = None):
+    ## actions are validated against the state before the tick, like Game.QueueAction
+    queued = []
+    if actions:
+        for unit_id, action in actions.items():
+            if action is not None:
+                i = s.unit_ids.index(unit_id)
+                if _can_act(s, i):
+                    queued.append((i, action))
+
+    _begin_tick(s, rng)
+    if queued:
+        _process_actions(s, queued, rng)
+
+
+## Every distinct state one tick on from `state`, each with a joint action that
+## reaches it. Units not in unit_ids (default: all of them) do nothing.
+## Actions that cannot change anything are pruned per unit (see legal_actions) and
+## joint actions landing on a state that was already yielded are skipped, so the
+## first (fewest actions) joint action for each state is the one reported.
+## Deterministic: no item drops, a freeze hits the first living enemy.
+def successors(state: SimState, unit_ids: Optional[Iterable[str]] = None) -> Iterator[Tuple[Dict[str, Action], SimState]]:
+    base, acting, options = tick_options(state, unit_ids)
+    base_board = base.board.tobytes()
+    seen = set()
+    for joint in itertools.product(*options):
+        queued = [(i, action) for i, action in zip(acting, joint) if action is not None]
+        next_state = base.copy()
+        finish_tick(next_state, queued)
+        ## a board still shared with the base is the base's
+        board = b"" if next_state.shared else next_state.board.tobytes()
+        key = (b"" if board == base_board else board, tuple(map(tuple, next_state.units)))
+        if key in seen:
+            continue
+        seen.add(key)
+        yield {state.unit_ids[i]: action for i, action in queued}, next_state
+
+
+## What every joint action from `state` has in common: a copy of the state taken
+## through the start of the next tick (fire, expiries, collisions), the indexes of
+## the units in unit_ids (default: all) that may act and each one's legal_actions.
+## Finish the tick with finish_tick on a copy of the base. Deterministic, like
+## successors
+def tick_options(state: SimState, unit_ids: Optional[Iterable[str]] = None) -> Tuple[SimState, List[int], List[List[Optional[Action]]]]:
+    wanted = set(state.unit_ids if unit_ids is None else unit_ids)
+    ## actions are validated before the tick, like in advance
+    acting = [i for i, unit_id in enumerate(state.unit_ids) if unit_id in wanted and _can_act(state, i)]
+    base = state.copy()
+    _begin_tick(base, None)
+    return base, acting, [legal_actions(base, i, acting) for i in acting]
+
+
+## Apply (unit index, action) pairs to a base from tick_options, in place
+def finish_tick(s: SimState, queued: List[Tuple[int, Action]], rng: Optional[np.random.Generator] = None):
+    if queued:
+        _process_actions(s, queued, rng)
+
+
+## The actions worth trying for unit i, given a state that has already been through
+## the start of the tick (fire, expiries, collisions). None (do nothing) comes first.
+## Left out: moves off the board, into metal or into a unit that cannot move away,
+## bombs without ammunition, room under the unit or room in the agent's limit, and
+## detonations without an armed bomb. Moves into a block or bomb are only kept when
+## some unit in `acting` could clear it with a blast earlier in the tick.
+def legal_actions(s: SimState, i: int, acting: Sequence[int]) -> List[Optional[Action]]:
+    board, config = s.board, s.config
+    bombs = board[KIND] == BOMB
+    owners = board[OWNER][bombs].tolist()
+    armed = (s.tick - board[CREATED][bombs] > config.bomb_armed_ticks).tolist()
+
+    def can_bomb(j):
+        unit = s.units[j]
+        kind = board.item(KIND, unit[UX], unit[UY])
+        placed = sum(1 for owner in owners if s.units[owner][UAGENT] == unit[UAGENT])
+        return unit[UBOMBS] > 0 and kind in (EMPTY, FIRE) and placed < config.maximum_concurrent_bombs
+
+    def can_detonate(j):
+        return any(owner == j and ready for owner, ready in zip(owners, armed))
+
+    may_clear = any(can_detonate(j) or (can_bomb(j) and board.item(KIND, s.units[j][UX], s.units[j][UY]) == FIRE)
+                    for j in acting)
+    movable = {(s.units[j][UX], s.units[j][UY]) for j in acting}
+
+    unit = s.units[i]
+    actions = [None]
+    for action, (dx, dy) in MOVES.items():
+        x, y = unit[UX] + dx, unit[UY] + dy
+        if not (0 <= x < s.width and 0 <= y < s.height):
+            continue
+        kind = board.item(KIND, x, y)
+        if kind == METAL or (kind not in PASSABLE and not may_clear):
+            continue
+        occupant = _unit_at(s, x, y)
+        if occupant is not None and (occupant[UX], occupant[UY]) not in movable:
+            continue
+        actions.append(action)
+    if can_bomb(i):
+        actions.append("bomb")
+    if can_detonate(i):
+        actions.append("detonate")
+    return actions
+
+
+## actions are only taken from living units that are not frozen
+def _can_act(s: SimState, i: int) -> bool:
+    unit = s.units[i]
+    return unit[UHP] > 0 and unit[USTUNNED] < s.tick
+
+
+def _begin_tick(s: SimState, rng):
+    s.tick += 1
+    _spread_end_game_fire(s)
+    if s.next_expiry <= s.tick:
+        _expire_entities(s, rng)
+    _check_collisions(s, rng)
+
+
+def _spread_end_game_fire(s: SimState):
+    config = s.config
+    delta = s.tick - config.game_duration_ticks
+    if delta < 0 or delta % config.fire_spawn_interval_ticks != 0:
+        return
+    progression = fire_progression(s.width, s.height)
+    index = delta // config.fire_spawn_interval_ticks
+    if index >= len(progression):
+        return
+    x, y = progression[index] % s.width, progression[index] // s.width
+    board = s.own_board()
+    kind = board.item(KIND, x, y)
+    diameter, owner = board.item(DIAMETER, x, y), board.item(OWNER, x, y)
+    _remove(s, x, y)
+    if kind == BOMB:
+        _blast_from_origin(s, x, y, diameter, owner, None)
+    _place(s, x, y, FIRE, 0, NO_EXPIRY, NO_OWNER, 0)
+
+
+## The expiries of the tick and the blasts of the bombs among them, in place, in
+## the engine's order. For vec_board_state, which hands over the games where
+## that order matters
+def expire_entities(s: SimState, rng: Optional[np.random.Generator] = None):
+    _expire_entities(s, rng)
+
+
+## Set off the bomb at (x, y) in place: the bomb goes, then its blast and every
+## chain it starts, one blast at a time like the engine. For vec_board_state
+def set_off_bomb(s: SimState, x: int, y: int, rng: Optional[np.random.Generator] = None):
+    board = s.own_board()
+    diameter, owner = board.item(DIAMETER, x, y), board.item(OWNER, x, y)
+    _remove(s, x, y)
+    _blast_from_origin(s, x, y, diameter, owner, rng)
+
+
+def _expire_entities(s: SimState, rng):
+    board = s.own_board()
+    ## snapshot first, like World.expireEntities iterating over a copy of the entities
+    xs, ys = np.nonzero(board[EXPIRES] <= s.tick)
+    expiring = [(x, y, board.item(KIND, x, y), board.item(DIAMETER, x, y), board.item(OWNER, x, y))
+                for x, y in zip(xs.tolist(), ys.tolist())]
+    for x, y, kind, diameter, owner in expiring:
+        _remove(s, x, y)
+        if kind == BOMB:
+            _blast_from_origin(s, x, y, diameter, owner, rng)
+    s.next_expiry = int(board[EXPIRES].min())
+
+
+def _check_collisions(s: SimState, rng):
+    board = s.board
+    for unit in s.units:
+        x, y = unit[UX], unit[UY]
+        kind = board.item(KIND, x, y)
+        if kind == EMPTY:
+            continue
+        if kind == FIRE:
+            _damage_unit(s, unit)
+            continue
+        ## a pickup, taken off the board
+        board = s.own_board() if kind in (AMMO, BLAST_POWERUP, FREEZE_POWERUP) else board
+        if kind == AMMO:
+            unit[UBOMBS] += 1
+            _remove(s, x, y)
+        elif kind == BLAST_POWERUP:
+            unit[UDIAMETER] += 2
+            _remove(s, x, y)
+        elif kind == FREEZE_POWERUP:
+            _freeze_enemy(s, unit, rng)
+            _remove(s, x, y)
+
+
+def _process_actions(s: SimState, queued, rng):
+    ## bombs, then detonations, then moves (sortAgentActionQueue is a stable sort)
+    bombs, detonations, moves = [], [], []
+    for i, action in queued:
+        if action in MOVES:
+            moves.append((i, action))
+        elif action == "bomb":
+            bombs.append(i)
+        elif action == "detonate" or action[0] == "detonate":
+            detonations.append((i, action))
+
+    for i in bombs:
+        _place_bomb(s, i, rng)
+    for i, action in detonations:
+        _detonate(s, i, action, rng)
+    if not moves:
+        return
+
+    units = s.units
+    ## units trying to step into the same cell all stay put (getFilteredSameCellActions)
+    targets = {}
+    for i, action in moves:
+        dx, dy = MOVES[action]
+        target = (units[i][UX] + dx, units[i][UY] + dy)
+        targets[target] = targets.get(target, 0) + 1
+    board = s.board
+    for i, action in moves:
+        unit = units[i]
+        dx, dy = MOVES[action]
+        x, y = unit[UX] + dx, unit[UY] + dy
+        if targets[(x, y)] > 1:
+            continue
+        if 0 <= x < s.width and 0 <= y < s.height and board.item(KIND, x, y) in PASSABLE \
+                and _unit_at(s, x, y) is None:
+            unit[UX] = x
+            unit[UY] = y
+
+
+def _place_bomb(s: SimState, i: int, rng):
+    unit = s.units[i]
+    if unit[UBOMBS] <= 0:
+        return
+    board = s.board
+    if s.bombs >= s.config.maximum_concurrent_bombs:
+        ## the limit is per agent, only count this agent's bombs when it could matter
+        agent = unit[UAGENT]
+        owners = board[OWNER][board[KIND] == BOMB].tolist()
+        active = sum(1 for owner in owners if owner != NO_OWNER and s.units[owner][UAGENT] == agent)
+        if active >= s.config.maximum_concurrent_bombs:
+            return
+
+    x, y = unit[UX], unit[UY]
+    kind = board.item(KIND, x, y)
+    tick = s.tick
+    if kind in (EMPTY, FIRE):
+        board = s.own_board()
+    if kind == EMPTY:
+        _place(s, x, y, BOMB, 1, tick + s.config.bomb_duration_ticks, i, unit[UDIAMETER])
+        unit[UBOMBS] -= 1
+    elif kind == FIRE:
+        ## a bomb dropped into fire goes off straight away and the fire is restored
+        old_expires, old_owner = board.item(EXPIRES, x, y), board.item(OWNER, x, y)
+        end_game_fire = old_expires == NO_EXPIRY
+        _remove(s, x, y)
+        unit[UBOMBS] -= 1
+        _blast_from_origin(s, x, y, unit[UDIAMETER], i, rng)
+        _remove(s, x, y)
+        _place(s, x, y, FIRE, 0,
+               NO_EXPIRY if end_game_fire else tick + s.config.blast_duration_ticks,
+               NO_OWNER if end_game_fire else old_owner, 0)
+
+
+def _detonate(s: SimState, i: int, action: Action, rng):
+    board = s.board
+    if isinstance(action, str):
+        ## no coordinates given, pick the unit's oldest bomb
+        xs, ys = np.nonzero((board[OWNER] == i) & (board[KIND] == BOMB))
+        if len(xs) == 0:
+            return
+        x, y = min(zip(xs.tolist(), ys.tolist()), key=lambda cell: board.item(CREATED, *cell))
+    else:
+        _, x, y = action
+        if not (0 <= x < s.width and 0 <= y < s.height):
+            return
+    if board.item(KIND, x, y) != BOMB or board.item(OWNER, x, y) != i:
+        return
+    if s.tick - board.item(CREATED, x, y) > s.config.bomb_armed_ticks:
+        diameter = board.item(DIAMETER, x, y)
+        s.own_board()
+        _remove(s, x, y)
+        _blast_from_origin(s, x, y, diameter, i, rng)
+
+
+## World.CreateBlastFromOrigin: fire on the origin then out along each axis until
+## something that is not fire or empty stops it
+def _blast_from_origin(s: SimState, x: int, y: int, diameter: int, owner: int, rng):
+    radius = (diameter - 1) // 2
+    _blast_cell(s, x, y, owner, rng)
+    width, height = s.width, s.height
+    for dx, dy in ((0, 1), (0, -1), (-1, 0), (1, 0)):
+        for distance in range(1, radius + 1):
+            cx, cy = x + dx * distance, y + dy * distance
+            if not (0 <= cx < width and 0 <= cy < height):
+                continue
+            if not _blast_cell(s, cx, cy, owner, rng):
+                break
+
+
+## World.generateBlastInCell, returns whether the blast keeps travelling
+def _blast_cell(s: SimState, x: int, y: int, owner: int, rng) -> bool:
+    board = s.board
+    for unit in s.units:
+        if unit[UX] == x and unit[UY] == y:
+            _damage_unit(s, unit)
+
+    kind = board.item(KIND, x, y)
+    if kind == EMPTY:
+        _place(s, x, y, FIRE, 0, s.tick + s.config.blast_duration_ticks, owner, 0)
+        return True
+    if kind == FIRE:
+        expires = NO_EXPIRY if board.item(EXPIRES, x, y) == NO_EXPIRY \
+            else s.tick + s.config.blast_duration_ticks
+        _remove(s, x, y)
+        _place(s, x, y, FIRE, 0, expires, owner, 0)
+        return True
+    if kind == METAL:
+        return False
+
+    hp = board.item(HP, x, y) - 1
+    if s.board_hash is not None:
+        s.board_hash ^= _cell_key(s, x, y)
+        board[HP, x, y] = hp
+        s.board_hash ^= _cell_key(s, x, y)
+    else:
+        board[HP, x, y] = hp
+    if hp <= 0:
+        diameter, bomb_owner = board.item(DIAMETER, x, y), board.item(OWNER, x, y)
+        _remove(s, x, y)
+        if kind == BOMB:
+            _blast_from_origin(s, x, y, diameter, bomb_owner, rng)
+        elif kind in (WOOD, ORE):
+            _drop_item(s, x, y, rng)
+    return False
+
+
+def _drop_item(s: SimState, x: int, y: int, rng):
+    if rng is None:
+        return
+    config = s.config
+    if rng.random() >= config.item_drop_probability:
+        return
+    weights = np.array([config.ammo_spawn_weighting, config.blast_powerup_spawn_weighting,
+                        config.freeze_powerup_spawn_weighting])
+    kind = (AMMO, BLAST_POWERUP, FREEZE_POWERUP)[rng.choice(3, p=weights / weights.sum())]
+    _place(s, x, y, kind, 1, s.tick + config.pickup_duration_ticks, NO_OWNER, 0)
+
+
+def _damage_unit(s: SimState, unit: List[int]):
+    if unit[UINVULNERABLE] < s.tick:
+        unit[UHP] -= 1
+        unit[UINVULNERABLE] = s.tick + s.config.invulnerability_ticks
+
+
+def _freeze_enemy(s: SimState, unit: List[int], rng):
+    enemies = [other for other in s.units if other[UAGENT] != unit[UAGENT] and other[UHP] > 0]
+    if not enemies:
+        return
+    target = enemies[0] if rng is None else enemies[rng.integers(len(enemies))]
+    target[USTUNNED] = s.tick + s.config.freeze_debuff_duration_ticks
+
+
+def _unit_at(s: SimState, x: int, y: int) -> Optional[List[int]]:
+    ## dead units stay on the board and still block the cell
+    for unit in s.units:
+        if unit[UX] == x and unit[UY] == y:
+            return unit
+    return None
+
+
+def _place(s: SimState, x: int, y: int, kind: int, hp: int, expires: int, owner: int, diameter: int):
+    board = s.board
+    if s.board_hash is not None:
+        s.board_hash ^= _cell_key(s, x, y) ^ cell_key(s.width * s.height, x * s.height + y,
+                                                      kind, hp, expires, s.tick, owner, diameter)
+    board[:, x, y] = (kind, hp, expires, s.tick, owner, diameter)
+    if expires < s.next_expiry:
+        s.next_expiry = expires
+    if kind == BOMB:
+        s.bombs += 1
+
+
+def _remove(s: SimState, x: int, y: int):
+    board = s.board
+    if s.board_hash is not None:
+        s.board_hash ^= _cell_key(s, x, y)
+    if board.item(KIND, x, y) == BOMB:
+        s.bombs -= 1
+    board[:, x, y] = (EMPTY, 0, NO_EXPIRY, 0, NO_OWNER, 0)
+
+
+def _cell_key(s: SimState, x: int, y: int) -> int:
+    return cell_key(s.width * s.height, x * s.height + y, *s.board[:, x, y].tolist())
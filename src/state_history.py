@@ -0,0 +1,149 @@
+## Bounded history of compact observations, one per tick.
+##
+## GameState used to keep a BoardState for every game_state packet and nothing
+## ever dropped them. StateHistory keeps the compact uint8 observations of
+## observation.py instead, in two parts:
+##   a ring of the last `stack` frames, so last(n) (feature stacking) copies n
+##       frames no matter how long the history is
+##   segments, each a full keyframe plus the cells that changed on each later
+##       tick (flat indices and values), a new one every `keyframe_interval`
+##       ticks. at(tick) starts from the segment's keyframe and applies at most
+##       keyframe_interval deltas
+## The ring and the segments together stay within `max_bytes`: when the next
+## delta would go over, a keyframe is taken instead and whole segments are dropped
+## oldest first. The newest segment is always kept, so max_bytes should leave room
+## for the ring and a couple of keyframes. Most cells don't change from one tick
+## to the next, a delta is the bombs and fire counting down plus what moved, so a
+## segment is a small multiple of one frame.
+
+import bisect
+import collections
+from typing import Deque, List, Optional, Tuple
+
+import numpy as np
+
+from observation import COMPACT_DTYPE
+
+## rough python object cost of a delta on top of its arrays
+_DELTA_OVERHEAD = 64
+
+
+class _Segment:
+    __slots__ = ("keyframe", "ticks", "deltas", "nbytes")
+
+    def __init__(self, tick: int, keyframe: np.ndarray):
+        self.keyframe = keyframe
+        ## ticks[0] is the keyframe's, deltas[i] takes ticks[i] to ticks[i + 1]
+        self.ticks: List[int] = [tick]
+        self.deltas: List[Tuple[np.ndarray, np.ndarray]] = []
+        self.nbytes = keyframe.nbytes
+
+
+class StateHistory:
+    def __init__(self, stack: int = 8, keyframe_interval: int = 64, max_bytes: int = 1 << 22):
+        if stack < 1 or keyframe_interval < 1:
+            raise Exception("stack and keyframe_interval must be at least 1")
+        self.stack = stack
+        self.keyframe_interval = keyframe_interval
+        self.max_bytes = max_bytes
+        self._frames: Optional[np.ndarray] = None
+        self._segments: Deque[_Segment] = collections.deque()
+        self._segment_bytes = 0
+        ## ticks in the ring, newest at _ring_ticks[-1]
+        self._ring_ticks: Deque[int] = collections.deque(maxlen=stack)
+        self._next = 0
+
+    def clear(self):
+        self._segments.clear()
+        self._segment_bytes = 0
+        self._ring_ticks.clear()
+        self._next = 0
+
+    def __len__(self) -> int:
+        return sum(len(segment.ticks) for segment in self._segments)
+
+    @property
+    def first_tick(self) -> Optional[int]:
+        return self._segments[0].ticks[0] if self._segments else None
+
+    @property
+    def last_tick(self) -> Optional[int]:
+        return self._ring_ticks[-1] if self._ring_ticks else None
+
+    ## Bytes held by the ring and the segments
+    @property
+    def nbytes(self) -> int:
+        return (0 if self._frames is None else self._frames.nbytes) + self._segment_bytes
+
+    ## Record the observation of `tick` (copied), ticks must go up. A frame of a
+    ## different shape (a new board) clears the history first
+    def push(self, tick: int, observation: np.ndarray):
+        frames = self._frames
+        if frames is None or frames.shape[1:] != observation.shape:
+            frames = self._frames = np.zeros((self.stack,) + observation.shape, dtype=COMPACT_DTYPE)
+            self.clear()
+        if self._ring_ticks and tick <= self._ring_ticks[-1]:
+            raise Exception(f"tick {tick} is not after the last tick {self._ring_ticks[-1]}")
+        segment = self._segments[-1] if self._segments else None
+        delta = None
+        if segment is not None and len(segment.ticks) < self.keyframe_interval:
+            flat = observation.reshape(-1)
+            changed = np.flatnonzero(frames[(self._next - 1) % self.stack].reshape(-1) != flat)
+            delta = (changed.astype(np.uint16 if flat.size <= 1 << 16 else np.uint32), flat[changed])
+            size = delta[0].nbytes + delta[1].nbytes + _DELTA_OVERHEAD
+            if self.nbytes + size > self.max_bytes:
+                ## a keyframe now lets the older segments go
+                delta = None
+        if delta is None:
+            segment = _Segment(tick, observation.astype(COMPACT_DTYPE, copy=True))
+            self._segments.append(segment)
+            self._segment_bytes += segment.nbytes
+        else:
+            segment.ticks.append(tick)
+            segment.deltas.append(delta)
+            segment.nbytes += size
+            self._segment_bytes += size
+        frames[self._next] = observation
+        self._next = (self._next + 1) % self.stack
+        self._ring_ticks.append(tick)
+        while self.nbytes > self.max_bytes and len(self._segments) > 1:
+            self._segment_bytes -= self._segments.popleft().nbytes
+
+    ## The last n observations (default: stack) as [n, C, W, H], oldest first.
+    ## Ticks from before the start of the history are zeros
+    def last(self, n: Optional[int] = None, out: Optional[np.ndarray] = None) -> np.ndarray:
+        n = self.stack if n is None else n
+        if n > self.stack:
+            raise Exception(f"only the last {self.stack} ticks are kept in the ring")
+        if self._frames is None:
+            raise Exception("empty history")
+        if out is None:
+            out = np.empty((n,) + self._frames.shape[1:], dtype=COMPACT_DTYPE)
+        have = min(n, len(self._ring_ticks))
+        out[:n - have] = 0
+        start = (self._next - have) % self.stack
+        if start + have <= self.stack:
+            out[n - have:] = self._frames[start:start + have]
+        else:
+            split = self.stack - start
+            out[n - have:n - have + split] = self._frames[start:]
+            out[n - have + split:] = self._frames[:have - split]
+        return out
+
+    ## The observation of a tick still in the history (a copy)
+    def at(self, tick: int) -> np.ndarray:
+        if not self._segments or not self._segments[0].ticks[0] <= tick <= self._ring_ticks[-1]:
+            raise Exception(f"tick {tick} is not in the history")
+        back = self._ring_ticks[-1] - tick
+        if back < len(self._ring_ticks) and self._ring_ticks[-1 - back] == tick:
+            return self._frames[(self._next - 1 - back) % self.stack].copy()
+        starts = [segment.ticks[0] for segment in self._segments]
+        segment = self._segments[bisect.bisect_right(starts, tick) - 1]
+        position = bisect.bisect_left(segment.ticks, tick)
+        if position == len(segment.ticks) or segment.ticks[position] != tick:
+            raise Exception(f"tick {tick} is not in the history")
+        frame = segment.keyframe.copy()
+        flat = frame.reshape(-1)
+        for indices, values in segment.deltas[:position]:
+            flat[indices] = values
+        return frame
@@ -0,0 +1,127 @@
+import unittest
+from unittest import IsolatedAsyncioTestCase
+import asyncio
+import time
+
+from anytime import AnytimeDecider
+from game_state import GameState
+from tick_trace import TickTracer
+
+
+class FakeClient:
+    def __init__(self, tick_rate_hz):
+        self.config = {"tick_rate_hz": tick_rate_hz}
+        self.current_trace = None
+        self.sent = []
+
+    async def send_move(self, move, unit_id):
+        self.sent.append((time.perf_counter(), unit_id, move))
+
+    async def send_bomb(self, unit_id):
+        self.sent.append((time.perf_counter(), unit_id, "bomb"))
+
+    async def send_detonate(self, x, y, unit_id):
+        self.sent.append((time.perf_counter(), unit_id, ("detonate", x, y)))
+
+    def bombs_of(self, unit_id):
+        return [{"x": 4, "y": 5}] if unit_id == "c" else []
+
+    action_packet = GameState.action_packet
+
+    async def send_actions(self, actions):
+        for unit_id, action in actions.items():
+            packet = self.action_packet(unit_id, action)
+            if packet is None:
+                continue
+            if packet["type"] == "move":
+                await self.send_move(packet["move"], unit_id)
+            elif packet["type"] == "bomb":
+                await self.send_bomb(unit_id)
+            else:
+                await self.send_detonate(*packet["coordinates"], unit_id)
+
+
+class TestAnytimeDecider(IsolatedAsyncioTestCase):
+    async def test_async_search_is_cut_at_the_deadline(self):
+        client = FakeClient(tick_rate_hz=20)
+        depths = []
+
+        async def decide(decision, tick, state):
+            depth = 0
+            while True:
+                depth += 1
+                depths.append(depth)
+                decision.publish({"c": "up" if depth % 2 else "down", "e": "bomb"})
+                await asyncio.sleep(0.002)
+
+        decider = AnytimeDecider(client, decide, safety_margin=0.01)
+        started = time.perf_counter()
+        await decider(5, {})
+        finished = time.perf_counter()
+
+        self.assertEqual(decider.cut_short, 1)
+        self.assertLess(finished - started, 0.05)
+        self.assertGreater(finished - started, 0.03)
+        move = "up" if depths[-1] % 2 else "down"
+        self.assertEqual(sorted(action[1:] for action in client.sent), [("c", move), ("e", "bomb")])
+        ## nothing published after the deadline counts
+        self.assertEqual(decider.last_decision.improvements, len(depths))
+
+    async def test_thread_search_stops_when_expired(self):
+        client = FakeClient(tick_rate_hz=20)
+        stopped = []
+
+        def decide(decision, tick, state):
+            while not decision.expired:
+                decision.publish({"c": "detonate", "e": ("detonate", 1, 2), "g": None})
+                time.sleep(0.001)
+            stopped.append(tick)
+
+        decider = AnytimeDecider(client, decide)
+        await decider(7, {})
+        self.assertEqual(sorted(action[1:] for action in client.sent), [("c", ("detonate", 4, 5)), ("e", ("detonate", 1, 2))])
+        await asyncio.sleep(0.01)
+        self.assertEqual(stopped, [7])
+
+    async def test_early_answer_is_sent_at_once(self):
+        client = FakeClient(tick_rate_hz=1)
+
+        async def decide(decision, tick, state):
+            decision.publish({"c": "left"})
+
+        decider = AnytimeDecider(client, decide)
+        started = time.perf_counter()
+        await decider(1, {})
+        self.assertLess(time.perf_counter() - started, 0.1)
+        self.assertEqual(decider.cut_short, 0)
+        self.assertEqual([action[1:] for action in client.sent], [("c", "left")])
+
+    async def test_deadline_counts_from_receive_and_overhead(self):
+        client = FakeClient(tick_rate_hz=10)
+        client.current_trace = TickTracer().start(received_at=time.perf_counter() - 0.04)
+        seen = []
+
+        async def decide(decision, tick, state):
+            seen.append(decision.time_left())
+
+        decider = AnytimeDecider(client, decide, safety_margin=0.0)
+        decider._overheads.append(0.02)
+        await decider(1, {})
+        ## 100 ms budget, 40 ms already gone since the frame came in, 20 ms overhead
+        self.assertAlmostEqual(seen[0], 0.04, delta=0.01)
+
+    async def test_only_the_send_is_counted_as_overhead(self):
+        client = FakeClient(tick_rate_hz=10)
+        ## the frame took 30 ms to decode and apply, the deadline already counts from its receive
+        client.current_trace = TickTracer().start(received_at=time.perf_counter() - 0.03)
+
+        async def decide(decision, tick, state):
+            decision.publish({"e": "up"})
+
+        decider = AnytimeDecider(client, decide)
+        await decider(1, {})
+        self.assertLess(decider.overhead, 0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
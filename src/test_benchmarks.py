@@ -0,0 +1,45 @@
+import json
+import unittest
+
+import benchmarks
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_fixtures_are_current_game_states(self):
+        fixtures = benchmarks.load_fixtures()
+        self.assertEqual(set(fixtures), {"mock_state", "mock_6x6_state", "replay"})
+        for state in fixtures.values():
+            self.assertIn("connection", state)
+            for unit in state["unit_state"].values():
+                self.assertIn("invulnerable", unit)
+                self.assertIn("stunned", unit)
+        self.assertEqual(fixtures["mock_6x6_state"]["world"], {"width": 6, "height": 6})
+
+    def test_run_reports_rates_and_percentiles(self):
+        results = benchmarks.run(benchmarks.GROUPS, min_time=0.001)
+        self.assertIsNotNone(results["meta"]["python"])
+        for group in benchmarks.GROUPS:
+            self.assertTrue(any(case.startswith(group + "/") for case in results["results"]), group)
+        for case, result in results["results"].items():
+            self.assertGreater(result["ops_per_sec"], 0, case)
+            self.assertLessEqual(result["p50_us"], result["p99_us"], case)
+        self.assertGreater(results["results"]["successors/mock_6x6_state"]["successors"], 1)
+        self.assertIn("steps_per_sec", results["results"]["forward/step/mock_6x6_state/x16"])
+        ## the file format
+        json.loads(json.dumps(results))
+
+    def test_compare(self):
+        old = {"meta": {}, "results": {"a": {"ops_per_sec": 100.0, "p99_us": 20.0},
+                                       "b": {"ops_per_sec": 1.0, "p99_us": 1.0}}}
+        new = {"meta": {}, "results": {"a": {"ops_per_sec": 200.0, "p99_us": 10.0}}}
+        lines = benchmarks.compare(old, new)
+        self.assertIn("2.00x", lines[1])
+        self.assertIn("only in old", lines[2])
+
+    def test_unknown_group(self):
+        with self.assertRaises(Exception):
+            benchmarks.run(["nope"])
+
+
+if __name__ == "__main__":
+    unittest.main()
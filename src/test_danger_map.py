@@ -0,0 +1,138 @@
+import unittest
+import json
+import os
+
+import numpy as np
+
+from classes import ACTIONS
+from danger_map import DangerMap, NEVER, danger_map
+from simulator import SimState, step, KIND, EMPTY, FIRE, BOMB, WOOD, NO_OWNER
+
+replay_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "..", "starter", "agents", "replay.json")
+
+
+def place(state, x, y, kind, expires, diameter=3, created=0, hp=1):
+    state.board[:, x, y] = (kind, hp, expires, created, NO_OWNER if kind != BOMB else 0, diameter)
+    state.board_hash = None
+
+
+class TestDangerMap(unittest.TestCase):
+    def setUp(self):
+        with open(replay_path) as f:
+            self.initial = SimState.from_game_state(json.load(f)["payload"]["initial_state"])
+        ## an open 9x9 board with two units out of the way
+        self.empty = SimState.from_game_state({
+            "tick": 0, "world": {"width": 9, "height": 9}, "entities": [],
+            "unit_state": {u: {"coordinates": [8, i], "hp": 3, "inventory": {"bombs": 3}, "blast_diameter": 3,
+                               "unit_id": u, "agent_id": a, "invulnerable": 0, "stunned": 0}
+                           for i, (u, a) in enumerate((("c", "a"), ("d", "b")))}})
+
+    def test_matches_the_simulator(self):
+        ## random games without detonations, then no actions while the bombs go off
+        checked = mismatched = 0
+        for seed in range(10):
+            rng = np.random.default_rng(seed)
+            state = self.initial
+            for _ in range(int(rng.integers(10, 60))):
+                state = step(state, {u: ACTIONS[rng.integers(5)] for u in state.unit_ids if rng.random() < 0.7})
+            horizon = 40
+            burning = DangerMap.from_sim_state(state).burning(horizon)
+            ## blocks can't burn, only compare cells that are open now
+            open_cells = (state.board[KIND] == EMPTY) | (state.board[KIND] == FIRE)
+            for t in range(horizon):
+                if t > 0:
+                    state = step(state, {})
+                checked += 1
+                mismatched += not np.array_equal((state.board[KIND] == FIRE) & open_cells, burning[t] & open_cells)
+        ## the map keeps blocks that a blast destroys on the way, the simulator doesn't
+        self.assertLess(mismatched, checked * 0.02)
+
+    def test_chain_reaction(self):
+        state = self.empty
+        place(state, 2, 2, BOMB, expires=5)
+        place(state, 3, 2, BOMB, expires=20)
+        place(state, 5, 2, BOMB, expires=25)
+        danger = DangerMap.from_sim_state(state)
+        ## the second bomb is in the first one's blast, the third is out of reach
+        self.assertEqual(danger.times.tolist(), [5, 5, 25])
+        earliest = danger.earliest
+        self.assertEqual(earliest[4, 2], 5)
+        self.assertEqual(earliest[6, 2], 25)
+        self.assertEqual(earliest[2, 4], NEVER)
+        burning = danger.burning(30)
+        self.assertTrue(burning[5:10, 4, 2].all())
+        self.assertFalse(burning[10, 4, 2] or burning[4, 4, 2])
+        times = danger.fire_times(30)
+        self.assertEqual(times.shape, (30, 9, 9))
+        ## (4, 2) burns again when the third bomb goes off
+        self.assertEqual(times[:, 4, 2].tolist(), [5] * 6 + list(range(6, 10)) + [25] * 16 + list(range(26, 30)))
+        self.assertEqual(times[:, 6, 2].tolist(), [25] * 26 + list(range(26, 30)))
+        self.assertTrue(np.array_equal(times[0], np.where(earliest < 30, earliest, NEVER)))
+        self.assertTrue(np.array_equal(times == np.arange(30)[:, None, None], burning))
+
+    def test_blocks_stop_blasts(self):
+        state = self.empty
+        place(state, 4, 4, BOMB, expires=3, diameter=7)
+        place(state, 4, 6, WOOD, expires=np.iinfo(np.int32).max, hp=2)
+        earliest = DangerMap.from_sim_state(state).earliest
+        self.assertEqual((earliest[4, 5], earliest[4, 6], earliest[4, 7]), (3, 3, NEVER))
+        self.assertEqual(earliest[7, 4], 3)
+
+    def test_incremental_updates_match_a_rebuild(self):
+        state = self.empty
+        place(state, 2, 2, BOMB, expires=10, diameter=7)
+        place(state, 4, 2, WOOD, expires=np.iinfo(np.int32).max, hp=2)
+        danger = DangerMap.from_sim_state(state)
+
+        place(state, 5, 2, BOMB, expires=30, diameter=5)
+        danger.add_bomb(5, 2, 5, 30)
+        self.assertTrue(np.array_equal(danger.burning(40), DangerMap.from_sim_state(state).burning(40)))
+
+        state.board[:, 4, 2] = (EMPTY, 0, np.iinfo(np.int32).max, 0, NO_OWNER, 0)
+        danger.clear_block(4, 2)
+        rebuilt = DangerMap.from_sim_state(state)
+        self.assertTrue(np.array_equal(danger.burning(40), rebuilt.burning(40)))
+        ## with the block gone the first bomb sets off the second
+        self.assertEqual(danger.times.tolist(), [10, 10])
+
+        state.board[:, 2, 2] = (EMPTY, 0, np.iinfo(np.int32).max, 0, NO_OWNER, 0)
+        danger.remove_bomb(2, 2)
+        self.assertTrue(np.array_equal(danger.earliest, DangerMap.from_sim_state(state).earliest))
+        self.assertEqual(danger.times.tolist(), [30])
+
+        danger.advance(10)
+        state.tick = 10
+        self.assertTrue(np.array_equal(danger.burning(25), DangerMap.from_sim_state(state).burning(25)))
+
+    def test_new_bomb_cuts_a_blast_short(self):
+        state = self.empty
+        place(state, 1, 4, BOMB, expires=10, diameter=9)
+        danger = DangerMap.from_sim_state(state)
+        self.assertEqual(danger.earliest[5, 4], 10)
+
+        place(state, 3, 4, BOMB, expires=30, diameter=3)
+        danger.add_bomb(3, 4, 3, 30)
+        rebuilt = DangerMap.from_sim_state(state)
+        self.assertTrue(np.array_equal(danger.earliest, rebuilt.earliest))
+        self.assertTrue(np.array_equal(danger.burning(40), rebuilt.burning(40)))
+        ## the first blast now stops at the new bomb and sets it off
+        self.assertEqual(danger.earliest[5, 4], NEVER)
+        self.assertEqual(danger.times.tolist(), [10, 10])
+
+    def test_assume_detonation(self):
+        state = self.empty
+        state.tick = 3
+        place(state, 2, 2, BOMB, expires=30, created=1)
+        ## armed once more than bomb_armed_ticks (5) have passed since it was placed
+        self.assertEqual(DangerMap.from_sim_state(state, assume_detonation=True).times.tolist(), [4])
+        self.assertEqual(DangerMap.from_sim_state(state).times.tolist(), [27])
+
+    def test_board_state(self):
+        times = danger_map(self.initial.to_board_state(), 10)
+        self.assertEqual(times.shape, (10, 15, 15))
+        self.assertTrue((times == NEVER).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import unittest
+import copy
+import json
+import os
+from collections import deque
+
+import numpy as np
+
+from distance_fields import DistanceFields, UNREACHABLE, bfs
+from replay_index import apply_events
+from simulator import SimState, KIND, BOMB, EMPTY, PASSABLE, UX, UY
+
+replay_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "..", "starter", "agents", "replay.json")
+
+
+def slow_bfs(kind, x, y):
+    width, height = kind.shape
+    distances = np.full(kind.shape, UNREACHABLE)
+    distances[x, y] = 0
+    queue = deque([(x, y)])
+    while queue:
+        cx, cy = queue.popleft()
+        for nx, ny in ((cx + 1, cy), (cx - 1, cy), (cx, cy + 1), (cx, cy - 1)):
+            if 0 <= nx < width and 0 <= ny < height and kind[nx, ny] in PASSABLE and distances[nx, ny] == UNREACHABLE:
+                distances[nx, ny] = distances[cx, cy] + 1
+                queue.append((nx, ny))
+    return distances
+
+
+class TestDistanceFields(unittest.TestCase):
+    def setUp(self):
+        with open(replay_path) as f:
+            self.replay = json.load(f)["payload"]
+        self.initial = SimState.from_game_state(self.replay["initial_state"])
+
+    def test_matches_a_plain_bfs(self):
+        kind = self.initial.board[KIND]
+        fields = DistanceFields(kind).unit_fields(self.initial)
+        self.assertEqual(len(fields), 6)
+        for unit_id, unit in zip(self.initial.unit_ids, self.initial.units):
+            self.assertTrue(np.array_equal(fields[unit_id], slow_bfs(kind, unit[UX], unit[UY])), unit_id)
+
+    def test_cache(self):
+        fields = DistanceFields.from_sim_state(self.initial)
+        first = fields.unit_fields(self.initial)
+        again = fields.unit_fields(self.initial)
+        self.assertEqual((fields.misses, fields.hits), (6, 6))
+        self.assertTrue(all(np.array_equal(first[u], again[u]) for u in first))
+        first["c"][:] = 0
+        self.assertFalse(np.array_equal(fields.unit_fields(self.initial)["c"], first["c"]))
+
+        ## a pickup far from everything only starts its own field
+        pickups = fields.pickup_field()
+        self.assertTrue((pickups == UNREACHABLE).all())
+
+    def test_least_recently_used_fields_are_dropped(self):
+        fields = DistanceFields.from_sim_state(self.initial, max_fields=2)
+        fields.from_cell(0, 0)
+        fields.from_cell(0, 1)
+        fields.from_cell(0, 0)
+        fields.from_cell(0, 2)
+        self.assertEqual((len(fields), fields.evicted), (2, 1))
+        ## (0, 1) was the least recently used
+        fields.from_cell(0, 0)
+        fields.from_cell(0, 2)
+        self.assertEqual(fields.misses, 3)
+        fields.from_cell(0, 1)
+        self.assertEqual(fields.misses, 4)
+        ## more masks than fit in one call still come back
+        self.assertEqual(len(fields.fields([self.initial.board[KIND] == EMPTY, np.eye(15, dtype=bool),
+                                            np.zeros((15, 15), dtype=bool)])), 3)
+        self.assertEqual(len(fields), 2)
+
+    def test_invalidation_follows_the_replay(self):
+        state = copy.deepcopy(self.replay["initial_state"])
+        fields = DistanceFields.from_sim_state(self.initial)
+        kept = 0
+        for tick in self.replay["history"]:
+            sim = SimState.from_game_state(state)
+            cached = fields.unit_fields(sim)
+            pickup = fields.pickup_field()
+            before = len(fields)
+            for event in tick["events"]:
+                fields.on_event(event)
+            kept += len(fields) == before
+            apply_events(state, tick["events"])
+
+            ## whatever survived the events is still right
+            fresh = DistanceFields.from_sim_state(SimState.from_game_state(state))
+            self.assertTrue(np.array_equal(fields.kind, fresh.kind), tick["tick"])
+            for unit_id, field in cached.items():
+                self.assertTrue(np.array_equal(fields.field(field == 0), fresh.field(field == 0)), tick["tick"])
+            self.assertTrue(np.array_equal(fields.pickup_field(), fresh.pickup_field()))
+        self.assertGreater(fields.invalidated, 0)
+        self.assertGreater(kept, len(self.replay["history"]) // 2)
+
+    def test_bomb_closes_the_cell(self):
+        state = self.initial
+        fields = DistanceFields.from_sim_state(state)
+        unit = state.units[0]
+        x, y = unit[UX], unit[UY]
+        field = fields.from_cell(x, y + 2)
+        fields.set_cell(x, y + 1, BOMB)
+        self.assertEqual(fields.invalidated, 1)
+        self.assertEqual(fields.from_cell(x, y + 2)[x, y + 1], UNREACHABLE)
+        fields.set_cell(x, y + 1, EMPTY)
+        self.assertTrue(np.array_equal(fields.from_cell(x, y + 2), field))
+
+    def test_batched_bfs(self):
+        sources = np.zeros((2, 5, 5), dtype=bool)
+        sources[0, 0, 0] = sources[1, 4, 4] = True
+        passable = np.ones((5, 5), dtype=bool)
+        passable[2, :4] = False
+        distances = bfs(sources, passable)
+        self.assertEqual(distances[0, 4, 0], 12)
+        self.assertEqual(distances[1, 0, 0], 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
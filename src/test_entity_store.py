@@ -0,0 +1,66 @@
+import unittest
+import json
+import os
+
+import numpy as np
+
+from classes import Ammo, BoardState, Bomb, Coordinate, Destructible, Fire, Indestructible, UnitState
+from entity_store import EntityStore
+from simulator import SimState
+
+replay_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "..", "starter", "agents", "replay.json")
+
+
+class TestEntityStore(unittest.TestCase):
+    def setUp(self):
+        self.units = [UnitState("c", "a", Coordinate(1, 1), 3, 3, 3, 0),
+                      UnitState("d", "b", Coordinate(3, 3), 3, 3, 3, 0)]
+        self.entities = self.units + [Indestructible(0, Coordinate(0, 0)),
+                                      Destructible(0, Coordinate(1, 3), 2),
+                                      Ammo(4, Coordinate(2, 2), 44, 1),
+                                      Bomb(5, Coordinate(1, 2), "c", 35, 1, 3),
+                                      Fire(6, Coordinate(4, 4), 11, "d"),
+                                      Fire(7, Coordinate(4, 0), None)]
+
+    def test_views_read_like_dataclasses(self):
+        store = EntityStore.from_entities(self.entities)
+        self.assertEqual(len(store), len(self.entities))
+        for view, entity in zip(store, self.entities):
+            self.assertIsInstance(view, type(entity))
+            self.assertEqual(view.coord, entity.coord)
+            if not isinstance(entity, UnitState):
+                self.assertEqual(view.created, entity.created)
+        bomb, fire, end_game_fire = store[5], store[6], store[7]
+        self.assertEqual((bomb.owner, bomb.expires, bomb.hp, bomb.blastDiameter), ("c", 35, 1, 3))
+        self.assertEqual((fire.expires, fire.owner), (11, "d"))
+        self.assertEqual((end_game_fire.expires, end_game_fire.owner), (None, None))
+        self.assertEqual(store[3].hp, 2)
+        with self.assertRaises(AttributeError):
+            store[2].created = 3
+
+    def test_round_trip_through_simulator(self):
+        listed = BoardState(5, 5, 10, self.entities)
+        stored = BoardState(5, 5, 10, EntityStore.from_entities(self.entities))
+        self.assertTrue(np.array_equal(SimState.from_board_state(listed).board,
+                                       SimState.from_board_state(stored).board))
+        self.assertEqual(hash(listed), hash(stored))
+
+        next_state = stored.next_state({"c": "right"})
+        self.assertIsInstance(next_state.entities, EntityStore)
+        self.assertEqual(next_state, BoardState(5, 5, 10, stored.entities.copy()).next_state({"c": "right"}))
+
+    def test_game_entities_are_compact(self):
+        with open(replay_path) as f:
+            initial = json.load(f)["payload"]["initial_state"]
+        store = EntityStore.from_game_entities(initial["entities"], [])
+        self.assertEqual(len(store), len(initial["entities"]))
+        ## 19 bytes a row
+        self.assertEqual(store.nbytes, 19 * len(initial["entities"]))
+        copied = store.copy()
+        copied.hp[0] = 9
+        self.assertNotEqual(copied, store)
+
+
+if __name__ == '__main__':
+    unittest.main()
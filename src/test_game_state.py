@@ -0,0 +1,229 @@
+import unittest
+from unittest import IsolatedAsyncioTestCase
+import asyncio
+import contextlib
+import copy
+import io
+import json
+import os
+
+import websockets
+
+from game_state import GameState
+from replay_index import apply_events
+
+replay_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "..", "starter", "agents", "replay.json")
+
+
+def sort_entities(entities):
+    return sorted(entities, key=lambda entity: (entity["x"], entity["y"]))
+
+
+class TestGameStateIndexes(IsolatedAsyncioTestCase):
+    def setUp(self):
+        with open(replay_path) as f:
+            self.replay = json.load(f)["payload"]
+        self.client = GameState("")
+        self.client._state = copy.deepcopy(self.replay["initial_state"])
+        self.client._index_entities()
+
+    async def test_indexes_follow_replay(self):
+        expected = copy.deepcopy(self.replay["initial_state"])
+        for tick in self.replay["history"]:
+            await self.client._on_game_tick(copy.deepcopy(tick))
+            apply_events(expected, tick["events"])
+
+            entities = self.client._state["entities"]
+            self.assertEqual(sort_entities(entities), sort_entities(expected["entities"]), f"tick {tick['tick']}")
+            for entity in expected["entities"]:
+                self.assertEqual(self.client.entity_at(entity["x"], entity["y"]), entity)
+            for unit_id in expected["unit_state"]:
+                bombs = [e for e in expected["entities"] if e["type"] == "b" and e.get("unit_id") == unit_id]
+                self.assertEqual(self.client.bombs_of(unit_id), sorted(bombs, key=lambda bomb: bomb["created"]))
+            self.assertEqual(sort_entities(self.client.pickups()),
+                             sort_entities([e for e in expected["entities"] if e["type"] in ("a", "bp", "fp")]))
+
+    async def test_queries(self):
+        await self.client._on_game_tick({"tick": 1, "events": [
+            {"type": "entity_spawned", "data": {"created": 1, "x": 7, "y": 7, "type": "b", "unit_id": "c",
+                                                "agent_id": "a", "expires": 31, "hp": 1, "blast_diameter": 3}},
+            {"type": "entity_spawned", "data": {"created": 1, "x": 7, "y": 3, "type": "a", "expires": 41, "hp": 1}}]})
+        self.assertEqual(self.client.entity_at(7, 7)["type"], "b")
+        self.assertEqual([(b["x"], b["y"]) for b in self.client.bombs_of("c")], [(7, 7)])
+        self.assertEqual(self.client.bombs_of("d"), [])
+        self.assertEqual([p["type"] for p in self.client.pickups()], ["a"])
+
+        await self.client._on_game_tick({"tick": 31, "events": [{"type": "entity_expired", "data": [7, 7]}]})
+        self.assertIsNone(self.client.entity_at(7, 7))
+        self.assertEqual(self.client.bombs_of("c"), [])
+
+
+class FakeConnection:
+    ## send doesn't wait, like a websocket without back pressure. Notes how many
+    ## event loop iterations `loop_turns` had seen at each send
+    def __init__(self, loop_turns=None):
+        self.loop_turns = loop_turns if loop_turns is not None else [0]
+        self.sent = []
+        self.turns = []
+
+    async def send(self, message):
+        self.sent.append(json.loads(message))
+        self.turns.append(self.loop_turns[0])
+
+
+class TestSendActions(IsolatedAsyncioTestCase):
+    async def test_packets(self):
+        client = GameState("")
+        client.connection = FakeConnection()
+        client._state = {"entities": [{"created": 3, "x": 4, "y": 5, "type": "b", "unit_id": "c", "agent_id": "a"},
+                                      {"created": 1, "x": 2, "y": 2, "type": "b", "unit_id": "c", "agent_id": "a"}]}
+        client._index_entities()
+        sent = await client.send_actions({"c": "detonate", "d": "detonate", "e": ("detonate", 1, 2), "f": "bomb",
+                                          "g": "left", "h": None, "i": "jump"})
+        self.assertEqual(sent, 4)
+        self.assertEqual(client.connection.sent, [
+            {"type": "detonate", "coordinates": [2, 2], "unit_id": "c"},
+            {"type": "detonate", "coordinates": [1, 2], "unit_id": "e"},
+            {"type": "bomb", "unit_id": "f"},
+            {"type": "move", "move": "left", "unit_id": "g"}])
+
+    async def test_frames_go_out_in_one_burst(self):
+        turns = [0]
+
+        async def count_turns():
+            while True:
+                turns[0] += 1
+                await asyncio.sleep(0)
+
+        counter = asyncio.ensure_future(count_turns())
+        await asyncio.sleep(0)
+        client = GameState("")
+        client.connection = FakeConnection(turns)
+        client._trace = trace = client.tracer.start()
+        await client.send_actions({"c": "up", "e": "down", "g": "bomb"})
+        counter.cancel()
+        self.assertEqual(len(client.connection.sent), 3)
+        ## no other task ran between the first and the last frame
+        self.assertEqual(len(set(client.connection.turns)), 1)
+        self.assertEqual(trace.sends, 3)
+
+
+class PacedConnection:
+    ## frames come in `interval` seconds apart, like a server ticking on time
+    def __init__(self, packets, interval):
+        self.packets = [json.dumps(packet) for packet in packets]
+        self.interval = interval
+        self.sent = []
+
+    async def recv(self):
+        if not self.packets:
+            raise websockets.exceptions.ConnectionClosed(None, None)
+        await asyncio.sleep(self.interval)
+        return self.packets.pop(0)
+
+    async def send(self, message):
+        self.sent.append(json.loads(message))
+
+
+class TestDecisionScheduling(IsolatedAsyncioTestCase):
+    async def test_slow_decisions_are_superseded(self):
+        with open(replay_path) as f:
+            replay = json.load(f)["payload"]
+        state = dict(copy.deepcopy(replay["initial_state"]), connection={"id": 1, "role": "agent", "agent_id": "a"})
+        ticks = replay["history"][:20]
+        connection = PacedConnection([{"type": "game_state", "payload": state}] +
+                                     [{"type": "tick", "payload": tick} for tick in ticks], 0.01)
+        client = GameState("")
+        client.connection = connection
+        started, applied = [], []
+
+        async def slow(tick_number, game_state):
+            ## the newest tick, every frame before it applied
+            started.append(tick_number)
+            applied.append(client._latest_tick)
+            await asyncio.sleep(0.025)
+            await client.send_move("up", "c")
+
+        client.set_game_tick_callback(slow)
+        with contextlib.redirect_stdout(io.StringIO()):
+            await client._handle_messages(connection)
+
+        self.assertEqual(started, applied)
+        self.assertEqual(started[-1], ticks[-1]["tick"])
+        ## a decision takes longer than a tick, so most are overtaken
+        self.assertGreater(client.skipped_ticks, len(ticks) // 2)
+        self.assertEqual(client.decisions + client.skipped_ticks, len(ticks))
+        self.assertEqual(len(connection.sent), client.decisions)
+        self.assertEqual(client.tracer.ticks, len(ticks))
+
+        expected = copy.deepcopy(replay["initial_state"])
+        for tick in ticks:
+            apply_events(expected, tick["events"])
+        self.assertEqual(client._state["unit_state"], expected["unit_state"])
+
+    async def test_decisions_get_a_snapshot(self):
+        with open(replay_path) as f:
+            replay = json.load(f)["payload"]
+        client = GameState("")
+        with contextlib.redirect_stdout(io.StringIO()):
+            client._on_game_state(dict(copy.deepcopy(replay["initial_state"]),
+                                       connection={"id": 1, "role": "agent", "agent_id": "a"}))
+        seen = []
+
+        async def decide(tick_number, game_state):
+            seen.append((game_state, copy.deepcopy(game_state)))
+            await asyncio.sleep(1)
+
+        client.set_game_tick_callback(decide)
+        ticks = [tick for tick in replay["history"]
+                 if any(event["type"] == "unit" and event["data"]["type"] == "move" for event in tick["events"])]
+        await client._on_game_tick(copy.deepcopy(ticks[0]))
+        await asyncio.sleep(0)
+        ## the next tick is applied while the first decision is still running
+        await client._on_game_tick(copy.deepcopy(ticks[1]))
+        game_state, at_start = seen[0]
+        self.assertEqual(game_state, at_start)
+        self.assertNotEqual(game_state["unit_state"], client._state["unit_state"])
+        client._decision.cancel()
+        await client.wait_decision()
+
+    async def test_superseded_ticks_take_no_snapshot(self):
+        with open(replay_path) as f:
+            replay = json.load(f)["payload"]
+        client = GameState("")
+        with contextlib.redirect_stdout(io.StringIO()):
+            client._on_game_state(dict(copy.deepcopy(replay["initial_state"]),
+                                       connection={"id": 1, "role": "agent", "agent_id": "a"}))
+        snapshot, snapshots = client._snapshot, []
+        client._snapshot = lambda: snapshots.append(client._latest_tick) or snapshot()
+        seen = []
+
+        async def decide(tick_number, game_state):
+            seen.append(tick_number)
+
+        client.set_game_tick_callback(decide)
+        ## three ticks arrive before the loop gets to the first decision
+        for tick in replay["history"][:3]:
+            await client._on_game_tick(copy.deepcopy(tick))
+        await client.wait_decision()
+        last = replay["history"][2]["tick"]
+        self.assertEqual((seen, snapshots, client.skipped_ticks), ([last], [last], 2))
+
+    async def test_a_failing_decision_does_not_stop_the_loop(self):
+        client = GameState("")
+
+        async def fail(tick_number, game_state):
+            raise ValueError("no")
+
+        client.set_game_tick_callback(fail)
+        client._state = {"entities": [], "unit_state": {}}
+        with contextlib.redirect_stdout(io.StringIO()) as printed:
+            await client._on_game_tick({"tick": 1, "events": []})
+            await client.wait_decision()
+        self.assertIn("decision for tick 1 failed", printed.getvalue())
+        self.assertEqual(client.decisions, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
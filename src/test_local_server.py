@@ -0,0 +1,190 @@
+import asyncio
+import contextlib
+import copy
+import io
+import json
+import os
+import time
+import unittest
+from unittest import IsolatedAsyncioTestCase
+
+import numpy as np
+import websockets
+
+from game_state import GameState
+from local_server import LocalServer, tick_events
+from replay_index import apply_events
+from simulator import MOVES, SimState, step
+
+replay_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "..", "starter", "agents", "replay.json")
+
+
+def load_replay():
+    with open(replay_path) as f:
+        return json.load(f)["payload"]
+
+
+def sort_entities(entities):
+    return sorted(entities, key=lambda entity: (entity["x"], entity["y"]))
+
+
+class TestTickEvents(unittest.TestCase):
+    def test_events_take_the_state_to_the_next(self):
+        rng = np.random.default_rng(3)
+        state = SimState.from_game_state(load_replay()["initial_state"])
+        state.tick = 1
+        for _ in range(150):
+            actions = {}
+            for unit_id in state.unit_ids:
+                choice = rng.integers(7)
+                if choice < 4:
+                    actions[unit_id] = ("up", "down", "left", "right")[choice]
+                elif choice == 4:
+                    actions[unit_id] = "bomb"
+            next_state = step(state, actions, rng)
+            before, after = state.to_game_state(), next_state.to_game_state()
+            packets = [(after["unit_state"][unit_id]["agent_id"],
+                        {"type": "move", "move": action, "unit_id": unit_id} if action != "bomb"
+                        else {"type": "bomb", "unit_id": unit_id}) for unit_id, action in actions.items()]
+            events = tick_events(before, after, packets)
+            applied = copy.deepcopy(before)
+            apply_events(applied, events)
+            self.assertEqual(applied["unit_state"], after["unit_state"], f"tick {next_state.tick}")
+            self.assertEqual(sort_entities(applied["entities"]), sort_entities(after["entities"]))
+            state = next_state
+
+    def test_blocked_moves_are_not_reported(self):
+        state = load_replay()["initial_state"]
+        sim = SimState.from_game_state(state)
+        sim.tick = 1
+        x, y = state["unit_state"]["c"]["coordinates"]
+        blocks = {(entity["x"], entity["y"]) for entity in state["entities"] if entity["type"] in ("m", "w", "o")}
+        move = next(move for move, (dx, dy) in MOVES.items()
+                    if not (0 <= x + dx < sim.width and 0 <= y + dy < sim.height) or (x + dx, y + dy) in blocks)
+        before, after = sim.to_game_state(), step(sim, {"c": move}).to_game_state()
+        self.assertEqual(tick_events(before, after, [("a", {"type": "move", "move": move, "unit_id": "c"})]), [])
+
+
+class TestLocalServer(IsolatedAsyncioTestCase):
+    async def play(self, uri, on_tick=None):
+        client = GameState(uri)
+        ticks = []
+
+        async def callback(tick, game_state):
+            ticks.append(tick)
+            if on_tick is not None:
+                await on_tick(client, tick)
+
+        client.set_game_tick_callback(callback)
+        connection = await client.connect()
+        client.endgame = None
+        on_data = client._on_data
+
+        async def keep_endgame(data):
+            if data.get("type") == "endgame_state":
+                client.endgame = data["payload"]
+            await on_data(data)
+
+        client._on_data = keep_endgame
+        with contextlib.redirect_stdout(io.StringIO()):
+            await asyncio.wait_for(client._handle_messages(connection), 20)
+        return client, ticks
+
+    async def test_replay(self):
+        replay = load_replay()
+        async with LocalServer(replay=replay, tick_rate_hz=1000, wait_for=("a",)) as server:
+            client, ticks = await self.play(server.uri + "/?role=agent&agentId=agentA")
+        last = replay["history"][-1]["tick"]
+        ## decisions start from the newest tick, the ones a newer tick overtook are skipped
+        self.assertEqual(ticks, sorted(set(ticks)))
+        self.assertEqual(ticks[-1], last)
+        self.assertEqual(len(ticks) + client.skipped_ticks, last)
+        self.assertEqual(client.endgame["winning_agent_id"], replay["winning_agent_id"])
+
+        expected = copy.deepcopy(replay["initial_state"])
+        for tick in replay["history"]:
+            apply_events(expected, tick["events"])
+        self.assertEqual(client._state["unit_state"], expected["unit_state"])
+        self.assertEqual(sort_entities(client._state["entities"]), sort_entities(expected["entities"]))
+        self.assertEqual(client.config["tick_rate_hz"], 1000)
+
+    async def test_simulated_game_between_two_agents(self):
+        replay = load_replay()
+        rng = np.random.default_rng(0)
+
+        async def random_actions(client, tick):
+            for unit_id in client._state["agents"][client.agent_id]["unit_ids"]:
+                choice = rng.integers(6)
+                if choice < 4:
+                    await client.send_move(("up", "down", "left", "right")[choice], unit_id)
+                elif choice == 4:
+                    await client.send_bomb(unit_id)
+
+        async with LocalServer(initial_state=replay["initial_state"], tick_rate_hz=500, seed=1,
+                               max_ticks=120) as server:
+            (a, a_ticks), (b, b_ticks) = await asyncio.gather(
+                self.play(server.uri + "/?role=agent&agentId=agentA", random_actions),
+                self.play(server.uri + "/?role=agent&agentId=agentB", random_actions))
+            self.assertEqual(server.games_played, 1)
+        self.assertEqual((a.agent_id, b.agent_id), ("a", "b"))
+        self.assertEqual(a_ticks, b_ticks)
+        self.assertGreater(len(a_ticks), 0)
+        self.assertEqual(a.endgame, b.endgame)
+        self.assertTrue(any(event["type"] == "unit" for tick in a.endgame["history"] for event in tick["events"]))
+
+        ## the endgame history takes the initial state to where both clients ended up
+        final = copy.deepcopy(a.endgame["initial_state"])
+        for tick in a.endgame["history"]:
+            apply_events(final, tick["events"])
+        for client in (a, b):
+            self.assertEqual(client._state["unit_state"], final["unit_state"])
+            self.assertEqual(sort_entities(client._state["entities"]), sort_entities(final["entities"]))
+
+    async def test_games_by_name_run_side_by_side(self):
+        replay = load_replay()
+        async with LocalServer(initial_state=replay["initial_state"], tick_rate_hz=500, wait_for=("a",),
+                               max_ticks=20) as server:
+            results = await asyncio.gather(*(self.play(server.uri + f"/?role=agent&agentId=agentA&game={i}")
+                                             for i in range(8)))
+            self.assertEqual(server.games_played, 8)
+        for client, ticks in results:
+            self.assertEqual(ticks[-1], 20)
+            self.assertEqual(len(ticks) + client.skipped_ticks, 20)
+
+    async def test_evaluate_next_state(self):
+        state = load_replay()["initial_state"]
+        state = dict(state, tick=1)
+        async with LocalServer() as server:
+            async with websockets.connect(server.uri + "/?role=admin") as connection:
+                await connection.send(json.dumps({
+                    "type": "evaluate_next_state", "sequence_id": 7, "state": state,
+                    "actions": [{"agent_id": "a", "action": {"type": "bomb", "unit_id": "c"}}]}))
+                reply = json.loads(await connection.recv())
+        self.assertEqual(reply["type"], "next_game_state")
+        payload = reply["payload"]
+        self.assertEqual(payload["sequence_id"], 7)
+        expected = step(SimState.from_game_state(state), {"c": "bomb"}).to_game_state()
+        self.assertEqual(payload["next_state"]["unit_state"], expected["unit_state"])
+        self.assertEqual(payload["next_state"]["tick"], 2)
+        self.assertIn({"type": "unit", "agent_id": "a", "data": {"type": "bomb", "unit_id": "c"}},
+                      payload["tick_result"]["events"])
+
+    async def test_latency_is_added_each_way(self):
+        state = dict(load_replay()["initial_state"], tick=1)
+        async with LocalServer(latency=0.05) as server:
+            async with websockets.connect(server.uri + "/?role=admin") as connection:
+                started = time.perf_counter()
+                await connection.send(json.dumps({"type": "evaluate_next_state", "sequence_id": 1,
+                                                  "state": state, "actions": []}))
+                await connection.recv()
+                self.assertGreaterEqual(time.perf_counter() - started, 0.1)
+
+    def test_needs_one_source(self):
+        replay = load_replay()
+        with self.assertRaises(Exception):
+            LocalServer(initial_state=replay["initial_state"], replay=replay)
+
+
+if __name__ == "__main__":
+    unittest.main()
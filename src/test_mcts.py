@@ -0,0 +1,103 @@
+import unittest
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from anytime import Decision
+from mcts import MCTS, MCTSPlanner, ROLLOUT_POLICIES, hp_evaluation
+from simulator import SimState, step
+
+replay_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "..", "starter", "agents", "replay.json")
+
+
+def unit(unit_id, agent_id, x, y, hp=3):
+    return {"coordinates": [x, y], "hp": hp, "inventory": {"bombs": 3}, "blast_diameter": 3,
+            "unit_id": unit_id, "agent_id": agent_id, "invulnerable": 0, "stunned": 0}
+
+
+class TestMCTS(unittest.TestCase):
+    def setUp(self):
+        with open(replay_path) as f:
+            self.game_state = json.load(f)["payload"]["initial_state"]
+        self.initial = SimState.from_game_state(self.game_state)
+        ## units can't act on tick 0
+        self.initial.tick = 1
+
+    def test_search_and_reuse(self):
+        mcts = MCTS(rng=np.random.default_rng(0), rollout_depth=10)
+        self.assertFalse(mcts.advance(self.initial))
+        self.assertEqual(mcts.search(200), 200)
+        self.assertEqual(mcts.root.visits, 200)
+        best = mcts.best_actions(["c", "e", "g"])
+        self.assertEqual(set(best), {"c", "e", "g"})
+
+        ## the server reports one of the successors the tree already holds
+        joint, child = max(mcts.root.children.items(), key=lambda item: item[1].visits)
+        root = mcts.root
+        actions = {root.state.unit_ids[i]: root.options[u][a]
+                   for u, (i, a) in enumerate(zip(root.acting, joint)) if root.options[u][a] is not None}
+        observed = step(self.initial, actions)
+        kept = child.size()
+        self.assertTrue(mcts.advance(observed))
+        self.assertIs(mcts.root, child)
+        self.assertEqual(mcts.root.size(), kept)
+        mcts.search(50)
+        self.assertEqual(mcts.root.size(), kept + 50)
+
+        ## a state the tree did not predict starts over
+        observed.units[0][0] += 1
+        observed.board_hash = None
+        self.assertFalse(mcts.advance(observed))
+        self.assertEqual(mcts.root.size(), 1)
+
+    def test_finds_the_winning_detonation(self):
+        ## d stands next to c's armed bomb and gets away next tick unless c detonates
+        ## now (detonations happen before moves)
+        state = SimState.from_game_state({
+            "tick": 10, "world": {"width": 5, "height": 5},
+            "unit_state": {"c": unit("c", "a", 4, 4), "d": unit("d", "b", 0, 1, hp=1)},
+            "entities": [{"created": 0, "x": 1, "y": 1, "type": "m"},
+                         {"created": 0, "x": 0, "y": 2, "type": "b", "unit_id": "c", "agent_id": "a",
+                          "expires": 30, "hp": 1, "blast_diameter": 3}]})
+        for name, policy in ROLLOUT_POLICIES.items():
+            mcts = MCTS(rollout_policy=policy, rng=np.random.default_rng(1))
+            mcts.set_root(state)
+            mcts.search(300)
+            self.assertEqual(mcts.best_actions(["c"]), {"c": "detonate"}, name)
+
+    def test_hp_evaluation(self):
+        self.assertEqual(hp_evaluation(self.initial), 0.0)
+        self.initial.units[1][2] = 0
+        self.assertGreater(hp_evaluation(self.initial), 0.0)
+
+    def test_planner_publishes_until_the_deadline(self):
+        planner = MCTSPlanner(publish_every=8, rng=np.random.default_rng(2), rollout_depth=5)
+        game_state = dict(self.game_state, tick=1, connection={"id": 1, "role": "agent", "agent_id": "b"})
+        decision = Decision(1, time.perf_counter() + 0.2)
+
+        def stop_soon():
+            time.sleep(0.2)
+            decision.expired = True
+
+        threading.Thread(target=stop_soon).start()
+        planner(decision, 1, game_state)
+        self.assertGreater(decision.improvements, 0)
+        self.assertEqual(set(decision.best), {"d", "f", "h"})
+        self.assertGreater(planner.iterations, 0)
+
+        ## the next tick's state is in the tree
+        child = max(planner.mcts.root.children.values(), key=lambda node: node.visits)
+        next_state = child.state.to_game_state()
+        next_state.update(connection=game_state["connection"])
+        decision = Decision(2, 0.0)
+        decision.expired = True
+        planner(decision, 2, next_state)
+        self.assertEqual(planner.reused, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+import copy
+import json
+import os
+
+import numpy as np
+import torch
+
+from classes import Bomb, BoardState, Coordinate, Fire, UnitState
+from observation import COMPACT_CHANNELS, NEVER, ObservationBuilder, observation_buffer
+from replay_index import apply_events
+from simulator import SimState
+
+replay_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "..", "starter", "agents", "replay.json")
+
+
+class TestObservationBuilder(unittest.TestCase):
+    def test_patched_maps_match_rebuild(self):
+        with open(replay_path) as f:
+            replay = json.load(f)["payload"]
+        state = copy.deepcopy(replay["initial_state"])
+        builder = ObservationBuilder.from_game_state(state)
+        maps = builder.maps
+
+        for tick in replay["history"]:
+            builder.on_tick(tick)
+            apply_events(state, tick["events"])
+
+            rebuilt = ObservationBuilder.from_game_state(state).maps
+            for key, tensor in rebuilt.items():
+                self.assertTrue(torch.equal(maps[key], tensor), f"{key.__name__} at tick {tick['tick']}")
+        ## the same tensors were patched in place all along
+        self.assertIs(builder.maps, maps)
+
+    def test_expired_cell_is_cleared(self):
+        state = {"world": {"width": 3, "height": 3}, "unit_state": {},
+                 "entities": [{"created": 0, "x": 1, "y": 2, "type": "b", "unit_id": "c",
+                               "expires": 30, "hp": 1, "blast_diameter": 3}]}
+        builder = ObservationBuilder.from_game_state(state)
+        self.assertEqual(builder.maps[Bomb][:, 1, 2].tolist(), [30, 1, 3])
+        builder.on_event({"type": "entity_expired", "data": [1, 2]})
+        self.assertTrue(all(int(tensor.abs().sum()) == 0 for tensor in builder.maps.values()))
+
+
+class TestCompactObservation(unittest.TestCase):
+    def test_builder_and_board_state_agree(self):
+        with open(replay_path) as f:
+            replay = json.load(f)["payload"]
+        state = copy.deepcopy(replay["initial_state"])
+        builder = ObservationBuilder.from_game_state(state)
+        out = observation_buffer(builder.width, builder.height)
+        from_board = observation_buffer(builder.width, builder.height)
+
+        for tick in replay["history"][:150]:
+            builder.on_tick(tick)
+            apply_events(state, tick["events"])
+            state["tick"] = tick["tick"]
+            self.assertIs(builder.write_compact(out), out)
+            board = SimState.from_game_state(state).to_board_state()
+            self.assertIs(board.to_observation(from_board), from_board)
+            self.assertTrue(np.array_equal(out, from_board), f"tick {tick['tick']}")
+
+        self.assertEqual(out.shape, (len(COMPACT_CHANNELS), builder.width, builder.height))
+        self.assertEqual(out.dtype, np.uint8)
+        self.assertEqual(out.nbytes * 4, builder.to_array().nbytes)
+        self.assertEqual(observation_buffer(3, 4, batch=5).shape, (5, len(COMPACT_CHANNELS), 3, 4))
+
+    def test_expiries_count_from_the_tick(self):
+        state = {"tick": 100, "world": {"width": 3, "height": 3}, "unit_state": {},
+                 "entities": [{"created": 0, "x": 1, "y": 2, "type": "b", "unit_id": "c",
+                               "expires": 130, "hp": 1, "blast_diameter": 3},
+                              {"created": 0, "x": 0, "y": 0, "type": "x", "expires": 1000},
+                              {"created": 0, "x": 0, "y": 1, "type": "x"}]}
+        builder = ObservationBuilder.from_game_state(state)
+        out = builder.write_compact()
+        bomb = COMPACT_CHANNELS.index("bomb_ticks_left")
+        fire = COMPACT_CHANNELS.index("fire_ticks_left")
+        self.assertEqual(out[bomb:bomb + 3, 1, 2].tolist(), [30, 1, 3])
+        self.assertEqual(out[fire, 0, 0], NEVER - 1)
+        self.assertEqual(out[fire, 0, 1], NEVER)
+        self.assertEqual(int(out[fire].astype(bool).sum()), 2)
+        builder.on_tick({"tick": 140, "events": []})
+        self.assertEqual(builder.write_compact(out)[bomb, 1, 2], 1)
+
+
+class TestToLearnable(unittest.TestCase):
+    def test_units_bombs_and_end_game_fire(self):
+        board = BoardState(3, 3, 0, [UnitState("c", "a", Coordinate(0, 0), 3, 3, 3, 0),
+                                     Bomb(0, Coordinate(1, 1), "c", 30, 1, 3),
+                                     Fire(0, Coordinate(2, 2), None)])
+        maps = board.to_learnable()
+        self.assertEqual(maps[UnitState][0, 0], 1)
+        self.assertEqual(maps[Bomb][:, 1, 1].tolist(), [30, 1, 3])
+        self.assertEqual(maps[Fire][2, 2], torch.iinfo(torch.int32).max)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+import json
+import os
+
+import packets
+
+replay_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "starter", "agents", "replay.json")
+
+
+def dumps(packet_type, payload):
+    return json.dumps({"type": packet_type, "payload": payload})
+
+
+class TestPackets(unittest.TestCase):
+    def setUp(self):
+        with open(replay_path) as f:
+            self.replay = json.load(f)["payload"]
+
+    def test_backends_agree(self):
+        raws = [dumps("game_state", self.replay["initial_state"])] + [
+            dumps("tick", tick) for tick in self.replay["history"]]
+        for name, loads in packets.BACKENDS.items():
+            for raw in raws:
+                self.assertEqual(loads(raw), json.loads(raw), name)
+            self.assertEqual(loads(raws[0].encode()), json.loads(raws[0]), name)
+
+    def test_fastest_backend_is_used(self):
+        self.assertEqual(packets.BACKEND, next(iter(packets.BACKENDS)))
+        self.assertIs(packets.loads, packets.BACKENDS[packets.BACKEND])
+
+    @unittest.skipIf(packets.msgspec is None, "msgspec is not installed (pip install bomberland[fast-json])")
+    def test_msgspec(self):
+        raw = dumps("tick", self.replay["history"][-1])
+        self.assertEqual(packets.msgspec.json.decode(raw), json.loads(raw))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+import unittest
+from unittest import IsolatedAsyncioTestCase
+
+import numpy as np
+import torch
+
+from game_state import GameState
+from policy_runner import ConvPolicy, PolicyRunner, decode_action, own_units, policy_callback
+
+replay_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "..", "starter", "agents", "replay.json")
+
+
+def random_batch(rng, games=4, units=3, width=7, height=7):
+    observations = rng.integers(0, 4, (games, 10, width, height)).astype(np.int32)
+    game_index = np.repeat(np.arange(games), units)
+    xs = rng.integers(0, width, games * units)
+    ys = rng.integers(0, height, games * units)
+    return observations, game_index, xs, ys
+
+
+class TestPolicyRunner(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.model = ConvPolicy(7, 7, channels=8, hidden=16)
+        self.rng = np.random.default_rng(0)
+
+    def test_batch_matches_one_unit_at_a_time(self):
+        runner = PolicyRunner(self.model)
+        observations, games, xs, ys = random_batch(self.rng)
+        codes = runner.act(observations, games, xs, ys)
+        one_by_one = [runner.act(observations, games[i:i + 1], xs[i:i + 1], ys[i:i + 1])[0] for i in range(len(games))]
+        self.assertEqual(codes.tolist(), one_by_one)
+        self.assertEqual(runner.batches, 1 + len(games))
+        ## the unit's cell is what sets rows of the same game apart
+        self.assertEqual(runner.act(observations, games[:1], xs[:1], ys[:1])[0], codes[0])
+
+    def test_script_and_quantize(self):
+        observations, games, xs, ys = random_batch(self.rng, games=16)
+        eager = PolicyRunner(self.model).act(observations, games, xs, ys)
+        scripted = PolicyRunner(self.model, script=True).act(observations, games, xs, ys)
+        self.assertEqual(scripted.tolist(), eager.tolist())
+        quantized = PolicyRunner(self.model, quantize=True, script=True)
+        codes = quantized.act(observations, games, xs, ys)
+        self.assertTrue(((codes >= 0) & (codes < 7)).all())
+        ## int8 weights move the logits a little, rarely the chosen action
+        self.assertGreater((codes == eager).mean(), 0.8)
+
+    def test_sampling(self):
+        observations, games, xs, ys = random_batch(self.rng)
+        runs = [PolicyRunner(self.model, greedy=False, generator=torch.Generator().manual_seed(5))
+                .act(observations, games, xs, ys).tolist() for _ in range(2)]
+        self.assertEqual(runs[0], runs[1])
+
+    def test_decode_action(self):
+        self.assertIsNone(decode_action(0))
+        self.assertEqual([decode_action(code) for code in range(1, 7)],
+                         ["up", "down", "left", "right", "bomb", "detonate"])
+
+
+class FakeConnection:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(json.loads(message))
+
+
+class TestBatchedDecisions(IsolatedAsyncioTestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.model = ConvPolicy(7, 7, channels=8, hidden=16)
+
+    async def test_games_share_a_forward_pass(self):
+        runner = PolicyRunner(self.model, max_wait=0.01)
+        observations, games, xs, ys = random_batch(np.random.default_rng(1), games=3)
+        requests = [[(f"u{i}", int(xs[i]), int(ys[i])) for i in range(len(games)) if games[i] == game]
+                    for game in range(3)]
+        results = await asyncio.gather(*(runner.decide(observations[game], requests[game]) for game in range(3)))
+        self.assertEqual(runner.batches, 1)
+        self.assertEqual(runner.units, len(games))
+        expected = PolicyRunner(self.model).act(observations, games, xs, ys)
+        for game, actions in enumerate(results):
+            self.assertEqual(list(actions), [unit_id for unit_id, _, _ in requests[game]])
+            for unit_id, action in actions.items():
+                self.assertEqual(action, decode_action(expected[int(unit_id[1:])]))
+        runner.close()
+
+    async def test_full_batch_does_not_wait(self):
+        runner = PolicyRunner(self.model, max_batch=3, max_wait=10.0)
+        observation = np.zeros((10, 7, 7), dtype=np.int32)
+        actions = await asyncio.wait_for(runner.decide(observation, [("c", 0, 0), ("e", 1, 1), ("g", 2, 2)]), 1.0)
+        self.assertEqual(set(actions), {"c", "e", "g"})
+        self.assertEqual(await runner.decide(observation, []), {})
+        runner.close()
+
+    async def test_policy_callback(self):
+        with open(replay_path) as f:
+            state = json.load(f)["payload"]["initial_state"]
+        state["connection"] = {"id": 1, "role": "agent", "agent_id": "a"}
+        torch.manual_seed(0)
+        runner = PolicyRunner(ConvPolicy(15, 15, channels=8, hidden=16))
+        clients = []
+        for _ in range(2):
+            client = GameState("")
+            client.connection = FakeConnection()
+            with contextlib.redirect_stdout(io.StringIO()):
+                client._on_game_state(json.loads(json.dumps(state)))
+            client.set_game_tick_callback(policy_callback(client, runner))
+            clients.append(client)
+        await asyncio.gather(*(client._on_game_tick({"tick": 1, "events": []}) for client in clients))
+        await asyncio.gather(*(client.wait_decision() for client in clients))
+        self.assertEqual(runner.batches, 1)
+        self.assertEqual(runner.units, 6)
+        self.assertEqual([unit_id for unit_id, _, _ in own_units(state, "a")], state["agents"]["a"]["unit_ids"])
+        state["unit_state"]["e"]["hp"] = 0
+        self.assertEqual([unit_id for unit_id, _, _ in own_units(state, "a")], ["c", "g"])
+        for client in clients:
+            for packet in client.connection.sent:
+                self.assertIn(packet["unit_id"], state["agents"]["a"]["unit_ids"])
+        self.assertEqual(clients[0].connection.sent, clients[1].connection.sent)
+        runner.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+import copy
+import json
+import os
+import tempfile
+
+import numpy as np
+import torch
+
+from observation import COMPACT_DTYPE, ObservationBuilder
+from replay_dataset import ReplayDataset, ingest
+from replay_index import apply_events
+from vec_board_state import ACTION_CODES
+
+replay_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "..", "starter", "agents", "replay.json")
+
+
+class TestReplayDataset(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        with open(replay_path) as f:
+            self.payload = json.load(f)["payload"]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_ingest_and_read(self):
+        index = ingest([replay_path, replay_path], self.directory.name, shard_size=100)
+        ticks = max(tick["tick"] for tick in self.payload["history"])
+        self.assertEqual(index["total"], 2 * ticks)
+        self.assertEqual([shard["count"] for shard in index["shards"]], [100] * 9 + [2 * ticks - 900])
+
+        dataset = ReplayDataset(self.directory.name)
+        self.assertEqual(len(dataset), 2 * ticks)
+
+        ## observation of a tick is the board before its events
+        history = {tick["tick"]: tick["events"] for tick in self.payload["history"]}
+        state = copy.deepcopy(self.payload["initial_state"])
+        for tick in range(1, ticks + 1):
+            if tick in (1, 122, 300, ticks):
+                for i in (tick - 1, ticks + tick - 1):
+                    observation, actions, winner = dataset[i]
+                    builder = ObservationBuilder.from_game_state(state)
+                    builder.tick = tick - 1
+                    expected = builder.write_compact()
+                    self.assertEqual(observation.dtype, torch.float32)
+                    self.assertTrue(np.array_equal(observation.numpy(), expected), f"tick {tick}")
+                    self.assertEqual(winner, 0)
+                    self.assertEqual(int(dataset.sample(i)["tick"]), tick)
+            apply_events(state, history.get(tick, []))
+
+        ## shards hold the compact uint8 layout
+        shard = dataset.shard(0)["observation"]
+        self.assertEqual(shard.dtype, COMPACT_DTYPE)
+        self.assertEqual(shard.shape[1:], expected.shape)
+        self.assertEqual(ReplayDataset(self.directory.name, torch.float16)[0][0].dtype, torch.float16)
+
+        ## unit g moved up on tick 77, units are ordered c e g d f h
+        self.assertEqual(dataset[76][1].tolist(), [0, 0, ACTION_CODES["up"], 0, 0, 0])
+
+    def test_batches_cover_every_sample_once(self):
+        ingest([replay_path], self.directory.name, shard_size=64)
+        dataset = ReplayDataset(self.directory.name)
+        seen = []
+        for observations, actions, winners in dataset.batches(16, shuffle=True, seed=0):
+            self.assertLessEqual(len(observations), 16)
+            self.assertEqual(observations.shape[1:], dataset[0][0].shape)
+            seen.extend(zip(observations.sum(dim=(1, 2, 3)).tolist(), actions.sum(dim=1).tolist()))
+        expected = [(int(dataset[i][0].sum()), int(dataset[i][1].sum())) for i in range(len(dataset))]
+        self.assertEqual(sorted(seen), sorted(expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
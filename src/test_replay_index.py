@@ -0,0 +1,59 @@
+import unittest
+import copy
+import json
+import os
+import tempfile
+
+from replay_index import ReplayIndex, apply_events
+
+replay_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "..", "starter", "agents", "replay.json")
+
+
+def normalise(state):
+    return sorted(json.dumps(e, sort_keys=True) for e in state["entities"]), \
+        json.dumps(state["unit_state"], sort_keys=True), state["tick"]
+
+
+class TestReplayIndex(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        with open(replay_path) as f:
+            self.payload = json.load(f)["payload"]
+        self.index = ReplayIndex.build(replay_path, self.directory.name, keyframe_interval=25)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def expected_states(self):
+        history = {tick["tick"]: tick["events"] for tick in self.payload["history"]}
+        state = copy.deepcopy(self.payload["initial_state"])
+        yield 0, copy.deepcopy(state)
+        for tick in range(1, max(history) + 1):
+            apply_events(state, history.get(tick, []))
+            state["tick"] = tick
+            yield tick, copy.deepcopy(state)
+
+    def test_state_at_matches_full_replay(self):
+        expected = dict(self.expected_states())
+        self.assertEqual(len(self.index), len(expected))
+        for tick in (0, 1, 24, 25, 26, 180, self.index.last_tick):
+            self.assertEqual(normalise(self.index.state_at(tick)), normalise(expected[tick]), f"tick {tick}")
+        self.assertEqual(self.index.winning_agent_id, "a")
+        with self.assertRaises(IndexError):
+            self.index.state_at(self.index.last_tick + 1)
+
+    def test_states_range(self):
+        expected = dict(self.expected_states())
+        ticks = []
+        for tick, state in self.index.states(70, 131):
+            self.assertEqual(normalise(state), normalise(expected[tick]), f"tick {tick}")
+            ticks.append(tick)
+        self.assertEqual(ticks, list(range(70, 131)))
+        self.assertEqual(self.index.events_at(77), next(t["events"] for t in self.payload["history"] if t["tick"] == 77))
+        ## a fresh reader only needs the index file
+        self.assertEqual(normalise(ReplayIndex(self.directory.name).state_at(180)), normalise(expected[180]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+import json
+import os
+
+import numpy as np
+
+from observation import CHANNELS, ObservationBuilder
+from rollout_workers import RolloutWorkers
+from simulator import SimState, UHP, UAGENT
+from vec_board_state import VecBoardState, NOOP, ACTION_CODES, N_OBSERVATION_CHANNELS
+
+replay_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "..", "starter", "agents", "replay.json")
+
+
+class TestRolloutWorkers(unittest.TestCase):
+    def setUp(self):
+        with open(replay_path) as f:
+            self.initial = SimState.from_game_state(json.load(f)["payload"]["initial_state"])
+
+    def test_observations_match_observation_builder(self):
+        self.assertEqual(N_OBSERVATION_CHANNELS, len(CHANNELS))
+        vec = VecBoardState([self.initial] * 2)
+        rng = np.random.default_rng(1)
+        for _ in range(40):
+            vec.step(rng.integers(NOOP, ACTION_CODES["bomb"] + 1, size=(2, len(self.initial.unit_ids))))
+        observations = vec.observations()
+        for i in range(2):
+            expected = ObservationBuilder.from_game_state(vec.state(i).to_game_state()).to_array()
+            self.assertTrue(np.array_equal(observations[i], expected))
+
+    def test_workers_match_one_vec_board_state(self):
+        reference = VecBoardState([self.initial] * 6, max_ticks=30)
+        rng = np.random.default_rng(0)
+        with RolloutWorkers(self.initial, n_workers=3, envs_per_worker=2, max_ticks=30) as workers:
+            self.assertTrue(np.array_equal(workers.reset(), reference.observations()))
+            for tick in range(35):
+                actions = rng.integers(NOOP, ACTION_CODES["detonate"] + 1, size=workers.actions.shape)
+                done, winner = reference.step(actions)
+                observations, rewards, dones = workers.step(actions)
+                self.assertTrue(np.array_equal(observations, reference.observations()))
+                self.assertEqual(dones.tolist(), done.tolist())
+                self.assertTrue((rewards[~done] == 0).all())
+                if tick == 29 - self.initial.tick:
+                    ## every game still running hits max_ticks
+                    self.assertTrue(dones.all())
+
+    def test_rewards_on_win(self):
+        initial = self.initial.copy()
+        ## every unit of the second agent is already dead
+        for unit in initial.units:
+            if unit[UAGENT] == 1:
+                unit[UHP] = 0
+        with RolloutWorkers(initial, n_workers=2, envs_per_worker=1) as workers:
+            workers.reset()
+            workers.step_async(np.zeros(workers.actions.shape, dtype=np.int8))
+            observations, rewards, dones = workers.step_wait()
+            self.assertEqual(dones.tolist(), [True, True])
+            self.assertEqual(rewards.tolist(), [[1.0, -1.0], [1.0, -1.0]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import unittest
+import copy
+import json
+import os
+
+from classes import BoardState, Bomb, Coordinate, Destructible, Fire, Indestructible, UnitState
+from replay_index import apply_events
+from simulator import (SimState, step, successors, fire_progression, KIND, EMPTY, NO_OWNER,
+                       ENTITY_CODES, BOMB, USTUNNED, UX, UY)
+
+replay_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "..", "starter", "agents", "replay.json")
+
+
+def actions_from_events(events):
+    actions = {}
+    for event in events:
+        if event["type"] != "unit":
+            continue
+        packet = event["data"]
+        if packet["type"] == "move":
+            actions[packet["unit_id"]] = packet["move"]
+        elif packet["type"] == "bomb":
+            actions[packet["unit_id"]] = "bomb"
+        elif packet["type"] == "detonate":
+            actions[packet["unit_id"]] = ("detonate", *packet["coordinates"])
+    return actions
+
+
+def normalise(state):
+    entities = sorted(json.dumps(e, sort_keys=True) for e in state["entities"])
+    return entities, json.dumps(state["unit_state"], sort_keys=True)
+
+
+class TestSimulator(unittest.TestCase):
+    def test_fire_progression_matches_engine(self):
+        ## expected values from generateGrowingFireProgression.test.ts
+        self.assertEqual(fire_progression(3, 3), (6, 2, 7, 1, 8, 0, 5, 3, 4))
+        self.assertEqual(fire_progression(4, 4),
+                         (12, 3, 13, 2, 14, 1, 15, 0, 11, 4, 7, 8, 6, 9, 5, 10))
+
+    def test_replay_history(self):
+        with open(replay_path) as f:
+            replay = json.load(f)["payload"]
+        expected = copy.deepcopy(replay["initial_state"])
+        state = SimState.from_game_state(replay["initial_state"])
+        history = {tick["tick"]: tick["events"] for tick in replay["history"]}
+
+        for tick in range(1, max(history) + 1):
+            events = history.get(tick, [])
+            state = step(state, actions_from_events(events))
+            apply_events(expected, events)
+
+            ## item drops and freeze targets are random in the engine, take them from the replay
+            for event in events:
+                data = event.get("data")
+                if event["type"] == "entity_spawned" and data["type"] in ("a", "bp", "fp") \
+                        and state.board[KIND, data["x"], data["y"]] == EMPTY:
+                    state.own_board()[:, data["x"], data["y"]] = (
+                        ENTITY_CODES[data["type"]], data["hp"], data["expires"], tick, NO_OWNER, 0)
+                    state.next_expiry = min(state.next_expiry, data["expires"])
+            for unit_id, unit in zip(state.unit_ids, state.units):
+                unit[USTUNNED] = expected["unit_state"][unit_id]["stunned"]
+
+            self.assertEqual(normalise(state.to_game_state()), normalise(expected), f"tick {tick}")
+
+    def test_board_state_next_state(self):
+        units = [UnitState("c", "a", Coordinate(1, 1), 3, 3, 3, 0),
+                 UnitState("d", "b", Coordinate(3, 3), 3, 3, 3, 0)]
+        entities = units + [Indestructible(0, Coordinate(0, 0)),
+                            Destructible(0, Coordinate(1, 3), 1),
+                            Bomb(0, Coordinate(1, 2), "c", 30, 1, 3)]
+        state = BoardState(5, 5, 29, entities)
+
+        next_state = state.next_state({"c": "right", "d": "up"})
+        self.assertEqual(next_state.tick, 30)
+        by_type = {}
+        for entity in next_state.entities:
+            entity_class = next(c for c in (UnitState, Bomb, Destructible, Fire, Indestructible) if isinstance(entity, c))
+            by_type.setdefault(entity_class, []).append(entity)
+
+        ## the bomb went off: the block above it is gone and the unit that stood next to it was hit
+        self.assertNotIn(Bomb, by_type)
+        self.assertNotIn(Destructible, by_type)
+        self.assertEqual(len(by_type[Fire]), 4)
+        c, d = by_type[UnitState]
+        self.assertEqual((c.coord.x, c.coord.y, c.hp), (2, 1, 2))
+        self.assertEqual((d.coord.x, d.coord.y, d.hp), (3, 4, 3))
+
+    def test_move_into_same_cell_is_dropped(self):
+        units = [UnitState("c", "a", Coordinate(0, 0), 3, 3, 3, 0),
+                 UnitState("d", "b", Coordinate(2, 0), 3, 3, 3, 0)]
+        next_state = BoardState(3, 3, 1, units).next_state({"c": "right", "d": "left"})
+        self.assertEqual([(u.coord.x, u.coord.y) for u in next_state.entities], [(0, 0), (2, 0)])
+
+    def test_permute_all_prunes_and_merges(self):
+        units = [UnitState("c", "a", Coordinate(0, 0), 3, 3, 0, 0),
+                 UnitState("d", "b", Coordinate(2, 2), 3, 3, 3, 0)]
+        entities = units + [Indestructible(0, Coordinate(1, 0)), Destructible(0, Coordinate(2, 1), 1)]
+        results = list(BoardState(3, 3, 1, entities).permute_all())
+
+        ## c: nothing or up (no ammunition, metal to the right), d: nothing, left or bomb
+        self.assertEqual(len(results), 6)
+        self.assertEqual(results[0][0], {})
+        for actions, state in results:
+            self.assertNotEqual(actions.get("c"), "bomb")
+            self.assertNotIn(actions.get("d"), ("up", "right", "down"))
+
+    def test_successors_match_step(self):
+        with open(replay_path) as f:
+            state = SimState.from_game_state(json.load(f)["payload"]["initial_state"])
+        seen = set()
+        for actions, next_state in successors(state):
+            expected = step(state, actions)
+            self.assertEqual(next_state.units, expected.units)
+            self.assertTrue((next_state.board == expected.board).all())
+            key = (next_state.board.tobytes(), str(next_state.units))
+            self.assertNotIn(key, seen)
+            seen.add(key)
+
+    def test_copies_share_the_board_until_written(self):
+        with open(replay_path) as f:
+            state = SimState.from_game_state(json.load(f)["payload"]["initial_state"])
+        state.tick = 1
+        board = state.board.copy()
+        c = state.unit_ids[0]
+        moved = step(state, {c: "up"})
+        self.assertIs(moved.board, state.board)
+        bombed = step(moved, {c: "bomb"})
+        self.assertIsNot(bombed.board, moved.board)
+        self.assertTrue((state.board == board).all())
+        self.assertEqual(bombed.board[KIND, moved.units[0][UX], moved.units[0][UY]], BOMB)
+        ## writing through own_board leaves the other states alone
+        moved.own_board()[KIND, 0, 0] = EMPTY
+        self.assertTrue((state.board == board).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import contextlib
+import copy
+import io
+import json
+import os
+import unittest
+from unittest import IsolatedAsyncioTestCase
+
+import numpy as np
+
+from game_state import GameState
+from observation import ObservationBuilder, observation_buffer
+from state_history import StateHistory
+
+replay_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "..", "starter", "agents", "replay.json")
+
+
+def load_replay():
+    with open(replay_path) as f:
+        return json.load(f)["payload"]
+
+
+def replay_frames():
+    replay = load_replay()
+    builder = ObservationBuilder.from_game_state(replay["initial_state"])
+    frames = [(0, builder.write_compact())]
+    for tick in replay["history"]:
+        builder.on_tick(tick)
+        frames.append((tick["tick"], builder.write_compact()))
+    return frames
+
+
+class TestStateHistory(unittest.TestCase):
+    def setUp(self):
+        self.frames = replay_frames()
+
+    def test_every_kept_tick_comes_back(self):
+        history = StateHistory(stack=4, keyframe_interval=16)
+        for tick, frame in self.frames:
+            history.push(tick, frame)
+        self.assertEqual(len(history), len(self.frames))
+        self.assertEqual((history.first_tick, history.last_tick), (self.frames[0][0], self.frames[-1][0]))
+        for tick, frame in self.frames:
+            self.assertTrue(np.array_equal(history.at(tick), frame), f"tick {tick}")
+        with self.assertRaises(Exception):
+            history.at(1)
+        with self.assertRaises(Exception):
+            history.push(self.frames[-1][0], self.frames[-1][1])
+
+    def test_last(self):
+        history = StateHistory(stack=3)
+        shape = self.frames[0][1].shape
+        history.push(*self.frames[0])
+        stacked = history.last()
+        self.assertEqual(stacked.shape, (3,) + shape)
+        self.assertFalse(stacked[:2].any())
+        self.assertTrue(np.array_equal(stacked[2], self.frames[0][1]))
+        for tick, frame in self.frames[1:6]:
+            history.push(tick, frame)
+        out = np.empty((2,) + shape, dtype=np.uint8)
+        self.assertIs(history.last(2, out), out)
+        self.assertTrue(np.array_equal(out, np.stack([self.frames[4][1], self.frames[5][1]])))
+        with self.assertRaises(Exception):
+            history.last(4)
+
+    def test_memory_cap_drops_old_segments(self):
+        frame_bytes = self.frames[0][1].nbytes
+        history = StateHistory(stack=2, keyframe_interval=8, max_bytes=6 * frame_bytes)
+        for tick, frame in self.frames:
+            history.push(tick, frame)
+            self.assertLessEqual(history.nbytes, 8 * frame_bytes)
+        self.assertGreater(history.first_tick, 0)
+        self.assertTrue(np.array_equal(history.at(history.first_tick),
+                                       dict(self.frames)[history.first_tick]))
+        with self.assertRaises(Exception):
+            history.at(0)
+
+    def test_new_board_size_starts_over(self):
+        history = StateHistory()
+        history.push(*self.frames[0])
+        history.push(1, observation_buffer(3, 3))
+        self.assertEqual((len(history), history.first_tick), (1, 1))
+
+
+class TestGameStateHistory(IsolatedAsyncioTestCase):
+    async def test_ticks_are_recorded(self):
+        replay = load_replay()
+        state = copy.deepcopy(replay["initial_state"])
+        state["connection"] = {"id": 1, "role": "agent", "agent_id": "a"}
+        client = GameState("", history=StateHistory(stack=4, keyframe_interval=10, max_bytes=1 << 16))
+        printed = io.StringIO()
+        with contextlib.redirect_stdout(printed):
+            client._on_game_state(state)
+        self.assertEqual(printed.getvalue(), "")
+        for tick in replay["history"]:
+            await client._on_game_tick(copy.deepcopy(tick))
+        frames = dict(replay_frames())
+        self.assertEqual(client.history.last_tick, replay["history"][-1]["tick"])
+        self.assertLessEqual(client.history.nbytes, 1 << 16)
+        last = client.history.last(2)
+        self.assertTrue(np.array_equal(last[1], frames[replay["history"][-1]["tick"]]))
+        self.assertTrue(np.array_equal(last[0], frames[replay["history"][-2]["tick"]]))
+
+        ## the next match starts from an empty history
+        with contextlib.redirect_stdout(io.StringIO()):
+            client._on_game_state(copy.deepcopy(state))
+        self.assertEqual((len(client.history), client.history.last_tick), (1, 0))
+
+    async def test_no_history_by_default(self):
+        replay = load_replay()
+        state = dict(copy.deepcopy(replay["initial_state"]), connection={"id": 1, "role": "agent", "agent_id": "a"})
+        client = GameState("")
+        client._on_game_state(state)
+        for tick in replay["history"][:20]:
+            await client._on_game_tick(copy.deepcopy(tick))
+        self.assertIsNone(client.history)
+        self.assertEqual(client.observation.tick, replay["history"][19]["tick"])
+
+
+if __name__ == "__main__":
+    unittest.main()
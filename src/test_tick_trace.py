@@ -0,0 +1,107 @@
+import unittest
+from unittest import IsolatedAsyncioTestCase
+from collections import deque
+import copy
+import json
+import os
+
+import websockets
+
+from game_state import GameState
+from tick_trace import STAGES, TickTracer
+
+replay_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "..", "starter", "agents", "replay.json")
+
+
+class FakeConnection:
+    ## frames are queued up front, like a client that fell behind the server
+    def __init__(self, packets):
+        self.messages = deque(json.dumps(packet) for packet in packets)
+        self.sent = []
+
+    async def recv(self):
+        if not self.messages:
+            raise websockets.exceptions.ConnectionClosed(None, None)
+        return self.messages.popleft()
+
+    async def send(self, message):
+        self.sent.append(message)
+
+
+class TestTickTracer(unittest.TestCase):
+    def test_durations_and_flags(self):
+        tracer = TickTracer(tick_rate_hz=10)
+        for tick in range(1, 101):
+            trace = tracer.start(received_at=0.0)
+            trace.tick = tick
+            trace.mark("decode", 0.001)
+            trace.mark("update", 0.003)
+            trace.sent(0.004)
+            trace.sent(0.006)
+            ## every tenth tick takes longer than the 100 ms budget
+            trace.mark("callback", 0.150 if tick % 10 == 0 else 0.007)
+            tracer.finish(trace, next_frame_waiting=tick == 100)
+
+        self.assertEqual(tracer.ticks, 100)
+        self.assertEqual(tracer.over_budget_ticks, 10)
+        self.assertEqual(tracer.late_ticks, 1)
+        self.assertTrue(tracer.recent[-1].late)
+        self.assertEqual([stage for stage, _, _ in tracer.recent[0].spans()], ["decode", "update", "callback", "send"])
+
+        percentiles = tracer.percentiles()
+        self.assertEqual(set(percentiles), set(STAGES))
+        self.assertAlmostEqual(percentiles["decode"]["p50"], 1.0)
+        self.assertAlmostEqual(percentiles["update"]["p99"], 2.0)
+        self.assertAlmostEqual(percentiles["send"]["p95"], 2.0)
+        self.assertAlmostEqual(percentiles["total"]["p50"], 7.0)
+        self.assertGreater(percentiles["total"]["p99"], 100.0)
+        self.assertIn("10 over budget", tracer.summary())
+
+    def test_window_keeps_recent_ticks(self):
+        tracer = TickTracer(window=8)
+        for tick in range(20):
+            trace = tracer.start(received_at=0.0)
+            trace.mark("decode", tick / 1000.0)
+            tracer.finish(trace)
+        self.assertEqual(len(tracer.recent), 8)
+        self.assertAlmostEqual(tracer.percentiles(q=(0,))["decode"]["p0"], 12.0)
+        self.assertIsNone(tracer.budget)
+
+
+class TestGameStateTracing(IsolatedAsyncioTestCase):
+    async def test_ticks_are_traced(self):
+        with open(replay_path) as f:
+            replay = json.load(f)["payload"]
+        game_state = dict(copy.deepcopy(replay["initial_state"]), connection={"id": 1, "role": "agent", "agent_id": "a"},
+                          config={"tick_rate_hz": 10, "game_duration_ticks": 300, "fire_spawn_interval_ticks": 2})
+        ticks = replay["history"][:30]
+        connection = FakeConnection([{"type": "game_state", "payload": game_state}] +
+                                    [{"type": "tick", "payload": tick} for tick in ticks])
+        client = GameState("")
+        client.connection = connection
+
+        async def on_tick(tick_number, state):
+            await client.send_move("up", "c")
+
+        client.set_game_tick_callback(on_tick)
+        await client._handle_messages(connection)
+
+        tracer = client.tracer
+        self.assertEqual(tracer.budget, 0.1)
+        self.assertEqual(tracer.ticks, len(ticks))
+        self.assertEqual([trace.tick for trace in tracer.recent], [tick["tick"] for tick in ticks])
+        ## every frame was queued before the first decision could start, so only
+        ## the newest tick was decided on
+        self.assertEqual(len(connection.sent), 1)
+        self.assertEqual((client.decisions, client.skipped_ticks), (1, len(ticks) - 1))
+        self.assertEqual(client.max_queue_depth, len(ticks))
+        self.assertEqual(tracer.late_ticks, 0)
+        for trace in list(tracer.recent)[:-1]:
+            self.assertEqual([stage for stage, _, _ in trace.spans()], ["decode", "update"])
+        self.assertEqual([stage for stage, _, _ in tracer.recent[-1].spans()], ["decode", "update", "callback", "send"])
+        for trace in tracer.recent:
+            self.assertTrue(all(start <= end for _, start, end in trace.spans()))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+import json
+import os
+
+import numpy as np
+
+from classes import ACTIONS
+from simulator import SimState, step, UHP, UAGENT
+from vec_board_state import VecBoardState, ACTION_CODES, NOOP
+
+replay_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "..", "starter", "agents", "replay.json")
+
+
+class TestVecBoardState(unittest.TestCase):
+    def setUp(self):
+        with open(replay_path) as f:
+            self.initial = SimState.from_game_state(json.load(f)["payload"]["initial_state"])
+
+    def test_matches_simulator_without_bombs(self):
+        ## moves only, so there is no blast ordering to disagree on
+        games = 8
+        vec = VecBoardState([self.initial] * games)
+        states = [self.initial.copy() for _ in range(games)]
+        rng = np.random.default_rng(0)
+        names = [None] + list(ACTIONS)
+        for _ in range(50):
+            codes = rng.integers(NOOP, ACTION_CODES["right"] + 1, size=(games, len(self.initial.unit_ids)))
+            vec.step(codes)
+            for i in range(games):
+                states[i] = step(states[i], {u: names[c] for u, c in zip(self.initial.unit_ids, codes[i])})
+                self.assertEqual(vec.state(i).units, states[i].units)
+                self.assertTrue(np.array_equal(vec.state(i).board, states[i].board))
+
+    def test_matches_simulator_in_random_play(self):
+        ## bombs, detonations and pickups, each tick stepped from the same state
+        names = [None] + list(ACTIONS)
+        ticks = 0
+        for seed in range(12):
+            rng = np.random.default_rng(seed)
+            state = self.initial.copy()
+            for _ in range(300):
+                codes = rng.integers(NOOP, len(names), size=(1, len(state.unit_ids)))
+                vec = VecBoardState([state])
+                done, _ = vec.step(codes)
+                if done[0]:
+                    break
+                state = step(state, {u: names[c] for u, c in zip(state.unit_ids, codes[0]) if c})
+                self.assertEqual(vec.state(0).units, state.units, f"seed {seed} tick {state.tick}")
+                self.assertTrue(np.array_equal(vec.state(0).board, state.board), f"seed {seed} tick {state.tick}")
+                ticks += 1
+        self.assertGreater(ticks, 500)
+
+    def test_games_stepped_together_match_simulator(self):
+        ## the scalar fallback of one game must leave the others alone
+        games = 6
+        vec = VecBoardState([self.initial] * games)
+        states = [self.initial.copy() for _ in range(games)]
+        live = [True] * games
+        compared = 0
+        rng = np.random.default_rng(7)
+        names = [None] + list(ACTIONS)
+        for _ in range(200):
+            codes = rng.integers(NOOP, len(names), size=(games, len(self.initial.unit_ids)))
+            done, _ = vec.step(codes)
+            for i in range(games):
+                live[i] = live[i] and not done[i]
+                if not live[i]:
+                    continue
+                states[i] = step(states[i], {u: names[c] for u, c in zip(self.initial.unit_ids, codes[i]) if c})
+                self.assertEqual(vec.state(i).units, states[i].units)
+                self.assertTrue(np.array_equal(vec.state(i).board, states[i].board))
+                compared += 1
+        self.assertGreater(compared, 200)
+
+    def test_finished_games_are_reset(self):
+        vec = VecBoardState([self.initial] * 3)
+        ## every unit of the second agent in game 1 is already dead
+        second = vec.units[0, :, UAGENT] == 1
+        vec.units[1, second, UHP] = 0
+        done, winner = vec.step(np.zeros((3, len(self.initial.unit_ids)), dtype=np.int8))
+        self.assertEqual(done.tolist(), [False, True, False])
+        self.assertEqual(winner.tolist(), [-1, 0, -1])
+        self.assertEqual(vec.tick.tolist(), [self.initial.tick + 1, self.initial.tick, self.initial.tick + 1])
+        self.assertEqual(vec.state(1).units, self.initial.units)
+
+    def test_encode_actions(self):
+        codes = VecBoardState.encode_actions({"c": "bomb", "e": "left"}, ["c", "d", "e"])
+        self.assertEqual(codes.tolist(), [ACTION_CODES["bomb"], NOOP, ACTION_CODES["left"]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+import json
+import os
+
+import numpy as np
+
+from classes import ACTIONS, BoardState, Coordinate, Destructible, Indestructible, UnitState
+from simulator import SimState, step
+from zobrist import TranspositionTable, board_key
+
+replay_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "..", "starter", "agents", "replay.json")
+
+
+class TestZobrist(unittest.TestCase):
+    def test_incremental_hash_matches_full_hash(self):
+        with open(replay_path) as f:
+            state = SimState.from_game_state(json.load(f)["payload"]["initial_state"])
+        state.zobrist_hash()
+        rng = np.random.default_rng(0)
+        for _ in range(200):
+            actions = {unit_id: ACTIONS[i] for unit_id, i in zip(state.unit_ids, rng.integers(len(ACTIONS), size=6))}
+            state = step(state, actions, rng)
+            self.assertEqual(state.board_hash, board_key(state.board), f"tick {state.tick}")
+
+    def test_board_state_hash(self):
+        units = [UnitState("c", "a", Coordinate(0, 0), 3, 3, 3, 0),
+                 UnitState("d", "b", Coordinate(2, 2), 3, 3, 3, 0)]
+        blocks = [Indestructible(0, Coordinate(1, 1)), Destructible(0, Coordinate(1, 2), 1)]
+        state = BoardState(3, 3, 1, units + blocks)
+
+        self.assertEqual(hash(state), hash(BoardState(3, 3, 1, blocks[::-1] + units)))
+        self.assertNotEqual(hash(state), hash(BoardState(3, 3, 2, units + blocks)))
+        self.assertNotEqual(hash(state), hash(state.next_state({"c": "up"})))
+        ## invulnerability that ran out before this tick makes no difference
+        worn_off = [UnitState("c", "a", Coordinate(0, 0), 3, 3, 3, 1)] + units[1:]
+        self.assertEqual(hash(state), hash(BoardState(3, 3, 1, worn_off + blocks)))
+        self.assertEqual({state: "seen"}[BoardState(3, 3, 1, units + blocks)], "seen")
+
+    def test_transposition_table_replacement(self):
+        table = TranspositionTable(capacity=4)
+        self.assertTrue(table.put(1, "deep", depth=3))
+        ## 5 shares a slot with 1, a shallower entry does not replace it
+        self.assertFalse(table.put(5, "shallow", depth=1))
+        self.assertEqual(table.get(1), "deep")
+        self.assertIsNone(table.get(5))
+        ## until the deep entry is from an earlier search
+        table.new_search()
+        self.assertTrue(table.put(5, "shallow", depth=1))
+        self.assertNotIn(1, table)
+        self.assertEqual(len(table), 1)
+
+        always = TranspositionTable(capacity=4, replacement="always")
+        always.put(1, "deep", depth=3)
+        always.put(5, "shallow", depth=1)
+        self.assertEqual(always.get(5), "shallow")
+
+        never = TranspositionTable(capacity=4, replacement=lambda old, depth, generation: False)
+        never.put(1, "first")
+        never.put(5, "second")
+        self.assertEqual(never.get(1), "first")
+        self.assertEqual((never.hits, never.misses), (1, 0))
+
+        with self.assertRaises(Exception):
+            TranspositionTable(replacement="random")
+
+
+if __name__ == '__main__':
+    unittest.main()
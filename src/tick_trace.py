@@ -0,0 +1,123 @@
+## Per-tick latency tracing.
+##
+## For every tick the client records when the frame was received and when each
+## stage after it ended:
+##   decode    recv returned -> packet parsed
+##   update    -> events applied to the game state, indexes and observation
+##   callback  -> the agent's tick callback returned (its sends included)
+##   send      first action sent -> last action sent, inside the callback
+##   total     recv returned -> last action sent (or callback end if nothing was sent)
+## Durations go into a ring buffer of the last `window` ticks, percentiles are
+## only computed when asked for, so a tick costs a few perf_counter calls and
+## one row write.
+##
+## The budget of a tick is 1 / tick_rate_hz from the game config. A tick is
+## over budget when its total is longer than that, and late when the next frame
+## was already waiting on the connection (or applied) by the time its actions were
+## out: the server had moved on before our actions for the tick were sent. Ticks
+## whose decision GameState skipped for a newer tick only have decode and update.
+
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+STAGES = ("decode", "update", "callback", "send", "total")
+_DECODE, _UPDATE, _CALLBACK, _SEND, _TOTAL = range(len(STAGES))
+
+
+class TickTrace:
+    __slots__ = ("tick", "received_at", "marks", "first_send", "last_send", "sends", "late", "over_budget")
+
+    def __init__(self, received_at: float):
+        self.tick: Optional[int] = None
+        self.received_at = received_at
+        ## (stage, perf_counter when it ended)
+        self.marks: List[Tuple[str, float]] = []
+        self.first_send: Optional[float] = None
+        self.last_send: Optional[float] = None
+        self.sends = 0
+        self.late = False
+        self.over_budget = False
+
+    def mark(self, stage: str, at: Optional[float] = None):
+        self.marks.append((stage, time.perf_counter() if at is None else at))
+
+    def sent(self, at: Optional[float] = None):
+        at = time.perf_counter() if at is None else at
+        if self.first_send is None:
+            self.first_send = at
+        self.last_send = at
+        self.sends += 1
+
+    ## (stage, start, end) spans, stages follow each other from received_at
+    def spans(self) -> List[Tuple[str, float, float]]:
+        spans, start = [], self.received_at
+        for stage, end in self.marks:
+            spans.append((stage, start, end))
+            start = end
+        if self.first_send is not None:
+            spans.append(("send", self.first_send, self.last_send))
+        return spans
+
+    def durations(self) -> List[float]:
+        ends = dict(self.marks)
+        decode = ends.get("decode", self.received_at)
+        update = ends.get("update", decode)
+        callback = ends.get("callback", update)
+        send = 0.0 if self.first_send is None else self.last_send - self.first_send
+        end = callback if self.last_send is None else max(callback, self.last_send)
+        return [decode - self.received_at, update - decode, callback - update, send, end - self.received_at]
+
+
+class TickTracer:
+    def __init__(self, tick_rate_hz: Optional[float] = None, window: int = 1024):
+        self.tick_rate_hz = tick_rate_hz
+        self.window = window
+        ## seconds, one row per tick: STAGES
+        self._durations = np.zeros((window, len(STAGES)))
+        self._count = 0
+        ## last `window` traces, for looking at individual ticks
+        self.recent: Deque[TickTrace] = deque(maxlen=window)
+        self.late_ticks = 0
+        self.over_budget_ticks = 0
+
+    @property
+    def budget(self) -> Optional[float]:
+        return None if not self.tick_rate_hz else 1.0 / self.tick_rate_hz
+
+    @property
+    def ticks(self) -> int:
+        return self._count
+
+    def start(self, received_at: Optional[float] = None) -> TickTrace:
+        return TickTrace(time.perf_counter() if received_at is None else received_at)
+
+    ## Record a finished tick. next_frame_waiting: a newer frame had already
+    ## arrived when the tick's actions were out
+    def finish(self, trace: TickTrace, next_frame_waiting: bool = False):
+        durations = trace.durations()
+        budget = self.budget
+        trace.over_budget = budget is not None and durations[_TOTAL] > budget
+        trace.late = next_frame_waiting and trace.sends > 0
+        self.late_ticks += trace.late
+        self.over_budget_ticks += trace.over_budget
+        self._durations[self._count % self.window] = durations
+        self._count += 1
+        self.recent.append(trace)
+
+    ## stage -> {p50, p95, p99, ...} in milliseconds over the window
+    def percentiles(self, q: Sequence[float] = (50, 95, 99)) -> Dict[str, Dict[str, float]]:
+        filled = self._durations[:min(self._count, self.window)]
+        if len(filled) == 0:
+            return {}
+        values = np.percentile(filled, q, axis=0) * 1000.0
+        return {stage: {f"p{p:g}": float(values[i, s]) for i, p in enumerate(q)} for s, stage in enumerate(STAGES)}
+
+    def summary(self) -> str:
+        lines = [f"{self._count} ticks, {self.late_ticks} late, {self.over_budget_ticks} over budget"
+                 + ("" if self.budget is None else f" ({self.budget * 1000.0:.1f} ms)")]
+        for stage, values in self.percentiles().items():
+            lines.append(f"  {stage:<9}" + " ".join(f"{p} {v:8.3f} ms" for p, v in values.items()))
+        return "\n".join(lines)
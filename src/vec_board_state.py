@@ -0,0 +1,422 @@
+## Batched version of the simulator: N games held as stacked arrays and stepped
+## together, so the python overhead of a tick is paid once per batch instead of
+## once per game.
+##
+## Layout matches simulator.SimState: board is [N, C, W, H] with the same channels
+## (kind, hp, expires, created, owner, blast diameter) and units is [N, U, 8] with
+## the same columns. Actions are an int array [N, U] of action codes.
+##
+## Blasts are laid down for every game at once, which gives the engine's result as
+## long as the order they go off in can't matter. The engine lays them down one at
+## a time: expiries in board order, chains depth first, and an expiring cell a
+## blast reached earlier in the tick still expires after it. Games where a bomb is
+## hit (a chain), a cell is hit by two blasts, or a blast reaches another expiring
+## cell are handed to the scalar simulator for that step (simulator.set_off_bomb,
+## simulator.expire_entities), which works on views of their rows. Detonations and
+## bombs dropped into fire are resolved unit by unit, as in the engine.
+##
+## Known divergences from simulator.step: with an rng, item drops are drawn in a
+## different order, so the pickups that appear differ (the drop rates don't).
+## Without one (as in the tests) random play matches it tick for tick.
+
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from classes import ACTIONS
+from simulator import (SimState, SimConfig, fire_progression, expire_entities, set_off_bomb,
+                       EMPTY, METAL, WOOD, ORE, AMMO, BLAST_POWERUP, FREEZE_POWERUP, BOMB, FIRE,
+                       KIND, HP, EXPIRES, CREATED, OWNER, DIAMETER, N_CHANNELS,
+                       UX, UY, UHP, UBOMBS, UDIAMETER, UINVULNERABLE, USTUNNED, UAGENT,
+                       NO_EXPIRY, NO_OWNER, MOVES)
+
+## action codes, 0 is "do nothing" and the rest follow classes.ACTIONS
+NOOP = 0
+ACTION_CODES = {action: code for code, action in enumerate(ACTIONS, start=1)}
+UP, DOWN, LEFT, RIGHT, PLACE_BOMB, DETONATE = (ACTION_CODES[action] for action in ACTIONS)
+_MOVE_CODES = {ACTION_CODES[name]: delta for name, delta in MOVES.items()}
+
+## len(observation.CHANNELS), not imported so this module does not pull in torch
+N_OBSERVATION_CHANNELS = 10
+
+
+def _shift(a: np.ndarray, dx: int, dy: int, fill) -> np.ndarray:
+    ## out[:, x + dx, y + dy] = a[:, x, y], cells shifted off the board are dropped
+    out = np.full_like(a, fill)
+    width, height = a.shape[1], a.shape[2]
+    out[:, max(dx, 0):width + min(dx, 0), max(dy, 0):height + min(dy, 0)] = \
+        a[:, max(-dx, 0):width - max(dx, 0), max(-dy, 0):height - max(dy, 0)]
+    return out
+
+
+class VecBoardState:
+    def __init__(self, initial_states: Sequence[SimState], max_ticks: Optional[int] = None,
+                 rng: Optional[np.random.Generator] = None):
+        first = initial_states[0]
+        for state in initial_states:
+            if (state.width, state.height, len(state.units)) != (first.width, first.height, len(first.units)):
+                raise Exception("all games in a VecBoardState need the same board and unit count")
+
+        self.n = len(initial_states)
+        self.width = first.width
+        self.height = first.height
+        self.unit_ids = first.unit_ids
+        self.agent_ids = first.agent_ids
+        self.config: SimConfig = first.config
+        ## games that run this long are finished even if both agents have units left
+        self.max_ticks = max_ticks
+        self.rng = rng
+
+        self._initial_board = np.stack([state.board for state in initial_states])
+        self._initial_units = np.array([state.units for state in initial_states], dtype=np.int32)
+        self._initial_tick = np.array([state.tick for state in initial_states], dtype=np.int32)
+        self.board = self._initial_board.copy()
+        self.units = self._initial_units.copy()
+        self.tick = self._initial_tick.copy()
+
+        progression = np.array(fire_progression(self.width, self.height))
+        self._fire_x = progression % self.width
+        self._fire_y = progression // self.width
+        self._games = np.arange(self.n)
+
+    @staticmethod
+    def from_game_states(game_states: List[dict], **kwargs) -> 'VecBoardState':
+        return VecBoardState([SimState.from_game_state(state) for state in game_states], **kwargs)
+
+    @staticmethod
+    def encode_actions(actions: dict, unit_ids: Sequence[str]) -> np.ndarray:
+        ## one game's {unit_id: action} dict to a row of action codes
+        return np.array([ACTION_CODES.get(actions.get(unit_id), NOOP) for unit_id in unit_ids],
+                        dtype=np.int8)
+
+    def state(self, i: int) -> SimState:
+        return SimState(self.width, self.height, int(self.tick[i]), self.board[i].copy(),
+                        self.units[i].tolist(), self.unit_ids, self.agent_ids, self.config)
+
+    def reset(self, mask: Optional[np.ndarray] = None):
+        if mask is None:
+            mask = np.ones(self.n, dtype=bool)
+        self.board[mask] = self._initial_board[mask]
+        self.units[mask] = self._initial_units[mask]
+        self.tick[mask] = self._initial_tick[mask]
+
+    ## [N, len(observation.CHANNELS), W, H] int32 maps in the channel order of
+    ## ObservationBuilder.to_array, written into `out` if given
+    def observations(self, out: Optional[np.ndarray] = None) -> np.ndarray:
+        if out is None:
+            out = np.empty((self.n, N_OBSERVATION_CHANNELS, self.width, self.height), dtype=np.int32)
+        board = self.board
+        kind = board[:, KIND]
+        bombs, fire = kind == BOMB, kind == FIRE
+        out[:, 0] = 0
+        ## dead units stay on the board, as in ObservationBuilder
+        out[self._games[:, None], 0, self.units[:, :, UX], self.units[:, :, UY]] = 1
+        out[:, 1] = kind == METAL
+        out[:, 2] = np.where((kind == WOOD) | (kind == ORE), board[:, HP], 0)
+        out[:, 3] = kind == AMMO
+        out[:, 4] = kind == BLAST_POWERUP
+        out[:, 5] = kind == FREEZE_POWERUP
+        out[:, 6] = np.where(bombs, board[:, EXPIRES], 0)
+        out[:, 7] = np.where(bombs, board[:, HP], 0)
+        out[:, 8] = np.where(bombs, board[:, DIAMETER], 0)
+        out[:, 9] = np.where(fire, board[:, EXPIRES], 0)
+        return out
+
+    def alive_agents(self) -> np.ndarray:
+        ## [N, agents] whether each agent still has a unit with hp left
+        alive = self.units[:, :, UHP] > 0
+        agents = self.units[:, :, UAGENT]
+        return np.stack([(alive & (agents == a)).any(axis=1) for a in range(len(self.agent_ids))], axis=1)
+
+    ## Advance every game by one tick. Returns (done, winner): which games finished
+    ## on this tick and the index into agent_ids of the agent left standing (-1 for
+    ## a draw or a game that is still running). Finished games are reset before
+    ## returning, so board/units already hold the start of their next episode
+    def step(self, actions: np.ndarray):
+        actions = np.asarray(actions)
+        units = self.units
+        valid = (actions != NOOP) & (units[:, :, UHP] > 0) & (units[:, :, USTUNNED] < self.tick[:, None])
+        actions = np.where(valid, actions, NOOP)
+
+        self.tick += 1
+        self._spread_end_game_fire()
+        self._expire_entities()
+        self._check_collisions()
+        self._place_bombs(actions)
+        self._detonate(actions)
+        self._move(actions)
+
+        alive = self.alive_agents()
+        done = alive.sum(axis=1) <= 1
+        if self.max_ticks is not None:
+            done |= self.tick >= self.max_ticks
+        winner = np.where(done & (alive.sum(axis=1) == 1), alive.argmax(axis=1), -1)
+        if done.any():
+            self.reset(done)
+        return done, winner
+
+    def _spread_end_game_fire(self):
+        config = self.config
+        delta = self.tick - config.game_duration_ticks
+        index = delta // config.fire_spawn_interval_ticks
+        spreading = (delta >= 0) & (delta % config.fire_spawn_interval_ticks == 0) & (index < len(self._fire_x))
+        if not spreading.any():
+            return
+        games = self._games[spreading]
+        xs, ys = self._fire_x[index[spreading]], self._fire_y[index[spreading]]
+        exploding = np.zeros(self.board.shape[:1] + self.board.shape[2:], dtype=bool)
+        exploding[games, xs, ys] = self.board[games, KIND, xs, ys] == BOMB
+        if exploding.any():
+            self._explode(exploding)
+        self.board[games, :, xs, ys] = (FIRE, 0, NO_EXPIRY, 0, NO_OWNER, 0)
+        self.board[games, CREATED, xs, ys] = self.tick[games]
+
+    def _expire_entities(self):
+        board = self.board
+        expiring = board[:, EXPIRES] <= self.tick[:, None, None]
+        if not expiring.any():
+            return
+        exploding = expiring & (board[:, KIND] == BOMB)
+        wave = None
+        if exploding.any():
+            wave = self._wave(exploding)
+            hits, _, tangled = wave
+            ## a blast reaching a cell that expires later in the engine's order
+            tangled = tangled | ((hits > 0) & expiring & ~exploding).any(axis=(1, 2))
+            for n in np.nonzero(tangled)[0]:
+                expire_entities(self._scalar(n), self.rng)
+            simple = ~tangled[:, None, None]
+            expiring &= simple
+            exploding &= simple
+        self._clear(expiring & ~exploding)
+        if exploding.any():
+            self._explode(exploding, wave)
+
+    def _check_collisions(self):
+        board, units = self.board, self.units
+        games = self._games[:, None]
+        xs, ys = units[:, :, UX], units[:, :, UY]
+        kind = board[games, KIND, xs, ys]
+
+        self._damage_units(kind == FIRE)
+        units[:, :, UBOMBS] += kind == AMMO
+        units[:, :, UDIAMETER] += 2 * (kind == BLAST_POWERUP)
+        for n, u in zip(*np.nonzero(kind == FREEZE_POWERUP)):
+            self._freeze_enemy(n, u)
+
+        picked = (kind == AMMO) | (kind == BLAST_POWERUP) | (kind == FREEZE_POWERUP)
+        if picked.any():
+            n, u = np.nonzero(picked)
+            board[n, :, xs[n, u], ys[n, u]] = (EMPTY, 0, NO_EXPIRY, 0, NO_OWNER, 0)
+
+    def _freeze_enemy(self, n: int, u: int):
+        units = self.units[n]
+        enemies = np.nonzero((units[:, UAGENT] != units[u, UAGENT]) & (units[:, UHP] > 0))[0]
+        if len(enemies) == 0:
+            return
+        target = enemies[0] if self.rng is None else enemies[self.rng.integers(len(enemies))]
+        units[target, USTUNNED] = self.tick[n] + self.config.freeze_debuff_duration_ticks
+
+    def _agent_bomb_counts(self) -> np.ndarray:
+        ## [N, agents] bombs each agent has on the board
+        board = self.board
+        bombs = board[:, KIND] == BOMB
+        owner_agent = np.take_along_axis(
+            self.units[:, :, UAGENT], np.clip(board[:, OWNER], 0, None).reshape(self.n, -1), axis=1
+        ).reshape(bombs.shape)
+        return np.stack([(bombs & (owner_agent == a)).sum(axis=(1, 2)) for a in range(len(self.agent_ids))],
+                        axis=1)
+
+    def _place_bombs(self, actions: np.ndarray):
+        wants = actions == PLACE_BOMB
+        if not wants.any():
+            return
+        board, units, config = self.board, self.units, self.config
+        counts = self._agent_bomb_counts()
+        games = self._games
+
+        ## one unit at a time, a unit's bomb counts towards its team mates' limit and
+        ## a bomb dropped into fire goes off before the next unit acts
+        for u in range(units.shape[1]):
+            agent = units[:, u, UAGENT]
+            xs, ys = units[:, u, UX], units[:, u, UY]
+            kind = board[games, KIND, xs, ys]
+            ok = wants[:, u] & (units[:, u, UBOMBS] > 0) & \
+                (counts[games, agent] < config.maximum_concurrent_bombs)
+            place = ok & ((kind == EMPTY) | (kind == FIRE))
+            if not place.any():
+                continue
+            into_fire = place & (kind == FIRE)
+            g, x, y = games[into_fire], xs[into_fire], ys[into_fire]
+            end_game = board[g, EXPIRES, x, y] == NO_EXPIRY
+            fire_expires = np.where(end_game, NO_EXPIRY, self.tick[g] + config.blast_duration_ticks)
+            fire_owner = np.where(end_game, NO_OWNER, board[g, OWNER, x, y])
+
+            g_all = games[place]
+            board[g_all, :, xs[place], ys[place]] = np.stack([
+                np.full(len(g_all), BOMB), np.ones(len(g_all)), self.tick[g_all] + config.bomb_duration_ticks,
+                self.tick[g_all], np.full(len(g_all), u), units[g_all, u, UDIAMETER]], axis=1)
+            units[g_all, u, UBOMBS] -= 1
+            counts[games[place & ~into_fire], agent[place & ~into_fire]] += 1
+
+            if into_fire.any():
+                ## the bomb goes off straight away and the fire it landed in is put back
+                exploding = np.zeros(board.shape[:1] + board.shape[2:], dtype=bool)
+                exploding[g, x, y] = True
+                self._explode(exploding)
+                board[g, :, x, y] = np.stack([
+                    np.full(len(g), FIRE), np.zeros(len(g)), fire_expires, self.tick[g],
+                    fire_owner, np.zeros(len(g))], axis=1)
+                ## its blast may have set off bombs of the next units' agents
+                counts = self._agent_bomb_counts()
+
+    def _detonate(self, actions: np.ndarray):
+        wants = actions == DETONATE
+        if not wants.any():
+            return
+        board = self.board
+        cells = board.shape[2] * board.shape[3]
+        ## unit by unit like the engine, an earlier detonation can set off or clear
+        ## what a later one would have hit
+        for u in np.nonzero(wants.any(axis=0))[0]:
+            kind = board[:, KIND].reshape(self.n, cells)
+            created = board[:, CREATED].reshape(self.n, cells)
+            ## the unit's oldest bomb, if it is armed
+            mine = (kind == BOMB) & (board[:, OWNER].reshape(self.n, cells) == u)
+            oldest = np.where(mine, created, np.iinfo(np.int32).max).argmin(axis=1)
+            has_bomb = mine[self._games, oldest]
+            armed = self.tick - created[self._games, oldest] > self.config.bomb_armed_ticks
+            go = wants[:, u] & has_bomb & armed
+            if go.any():
+                exploding = np.zeros((self.n, cells), dtype=bool)
+                exploding[self._games[go], oldest[go]] = True
+                self._explode(exploding.reshape(board.shape[:1] + board.shape[2:]))
+
+    def _move(self, actions: np.ndarray):
+        moving = (actions >= UP) & (actions <= RIGHT)
+        if not moving.any():
+            return
+        units, board = self.units, self.board
+        dx = np.zeros_like(actions, dtype=np.int32)
+        dy = np.zeros_like(actions, dtype=np.int32)
+        for code, (mx, my) in _MOVE_CODES.items():
+            dx[actions == code] = mx
+            dy[actions == code] = my
+        tx = units[:, :, UX] + dx
+        ty = units[:, :, UY] + dy
+
+        ## units trying to step into the same cell all stay put
+        cell = np.where(moving, tx * self.height + ty, -1 - np.arange(actions.shape[1]))
+        same = (cell[:, :, None] == cell[:, None, :]).sum(axis=2) > 1
+        moving &= ~same
+
+        in_bounds = (tx >= 0) & (tx < self.width) & (ty >= 0) & (ty < self.height)
+        moving &= in_bounds
+        for u in range(actions.shape[1]):
+            go = moving[:, u]
+            if not go.any():
+                continue
+            g = self._games[go]
+            x, y = tx[go, u], ty[go, u]
+            kind = board[g, KIND, x, y]
+            passable = (kind == EMPTY) | (kind == AMMO) | (kind == BLAST_POWERUP) | \
+                (kind == FREEZE_POWERUP) | (kind == FIRE)
+            ## dead units still block the cell
+            occupied = ((units[g, :, UX] == x[:, None]) & (units[g, :, UY] == y[:, None])).any(axis=1)
+            ok = passable & ~occupied
+            units[g[ok], u, UX] = x[ok]
+            units[g[ok], u, UY] = y[ok]
+
+    def _damage_units(self, hit: np.ndarray):
+        ## hit is [N, U]
+        units = self.units
+        hurt = hit & (units[:, :, UINVULNERABLE] < self.tick[:, None])
+        units[:, :, UHP] -= hurt
+        units[:, :, UINVULNERABLE] = np.where(
+            hurt, self.tick[:, None] + self.config.invulnerability_ticks, units[:, :, UINVULNERABLE])
+
+    def _clear(self, mask: np.ndarray):
+        board = self.board
+        for channel, value in ((KIND, EMPTY), (HP, 0), (EXPIRES, NO_EXPIRY), (CREATED, 0),
+                               (OWNER, NO_OWNER), (DIAMETER, 0)):
+            board[:, channel][mask] = value
+
+    ## SimState of game n sharing its board and units, for the scalar simulator
+    def _scalar(self, n: int) -> SimState:
+        return SimState(self.width, self.height, int(self.tick[n]), self.board[n], self.units[n],
+                        self.unit_ids, self.agent_ids, self.config)
+
+    ## The blasts of the bombs in `exploding` (a [N, W, H] mask) laid down together:
+    ## [N, W, H] blasts reaching each cell, [N, W, H] owner of the last one and the
+    ## [N] games where that is not what the engine would do (see the header)
+    def _wave(self, exploding: np.ndarray):
+        board = self.board
+        kind = board[:, KIND]
+        radius = np.where(exploding, (board[:, DIAMETER] - 1) // 2, 0)
+        owner = np.where(exploding, board[:, OWNER], NO_OWNER)
+        blocking = (kind != EMPTY) & (kind != FIRE) & ~exploding
+        hits = exploding.astype(np.int32)
+        hit_owner = owner.copy()
+        for dx, dy in ((0, 1), (0, -1), (-1, 0), (1, 0)):
+            front, remaining, front_owner = exploding & (radius >= 1), radius, owner
+            while front.any():
+                front = _shift(front, dx, dy, False)
+                remaining = _shift(remaining, dx, dy, 0) - 1
+                front_owner = _shift(front_owner, dx, dy, NO_OWNER)
+                hits += front
+                hit_owner = np.where(front, front_owner, hit_owner)
+                front = front & ~blocking & (remaining >= 1)
+        tangled = ((hits > 1) | ((hits > 0) & blocking & (kind == BOMB))).any(axis=(1, 2))
+        return hits, hit_owner, tangled
+
+    ## Set off the bombs in `exploding` (a [N, W, H] mask) and every bomb their
+    ## blasts reach. `wave` is _wave(exploding) if the caller already has it
+    def _explode(self, exploding: np.ndarray, wave=None):
+        board, config = self.board, self.config
+        hits, hit_owner, tangled = self._wave(exploding) if wave is None else wave
+        for n in np.nonzero(tangled)[0]:
+            xs, ys = np.nonzero(exploding[n])
+            for x, y in zip(xs.tolist(), ys.tolist()):
+                if board[n, KIND, x, y] == BOMB:
+                    set_off_bomb(self._scalar(n), x, y, self.rng)
+        simple = ~tangled[:, None, None]
+        exploding = exploding & simple
+        if not exploding.any():
+            return
+        games = self._games[:, None]
+        tick = self.tick[:, None, None]
+        self._clear(exploding)
+        kind = board[:, KIND]
+        blocking = (kind != EMPTY) & (kind != FIRE)
+        hit = (hits > 0) & simple
+        self._damage_units(hit[games, self.units[:, :, UX], self.units[:, :, UY]])
+
+        ## fire on open cells, end game fire stays end game fire
+        open_cells = hit & ~blocking
+        expires = np.where((kind == FIRE) & (board[:, EXPIRES] == NO_EXPIRY), NO_EXPIRY,
+                           tick + config.blast_duration_ticks)
+        for channel, value in ((KIND, FIRE), (HP, 0), (EXPIRES, expires), (CREATED, tick),
+                               (OWNER, hit_owner), (DIAMETER, 0)):
+            board[:, channel] = np.where(open_cells, value, board[:, channel])
+
+        ## everything else but metal loses one hp, no bomb is among them (that
+        ## would be a chain, left to the scalar simulator)
+        damaged = hit & blocking & (kind != METAL)
+        board[:, HP] -= damaged
+        destroyed = damaged & (board[:, HP] <= 0)
+        self._clear(destroyed)
+        if self.rng is not None and destroyed.any():
+            self._drop_items(destroyed)
+
+    def _drop_items(self, blocks: np.ndarray):
+        config, board = self.config, self.board
+        g, xs, ys = np.nonzero(blocks)
+        drop = self.rng.random(len(g)) < config.item_drop_probability
+        g, xs, ys = g[drop], xs[drop], ys[drop]
+        weights = np.array([config.ammo_spawn_weighting, config.blast_powerup_spawn_weighting,
+                            config.freeze_powerup_spawn_weighting])
+        kinds = np.array([AMMO, BLAST_POWERUP, FREEZE_POWERUP])[
+            self.rng.choice(3, size=len(g), p=weights / weights.sum())]
+        board[g, :, xs, ys] = np.stack([
+            kinds, np.ones(len(g)), self.tick[g] + config.pickup_duration_ticks, self.tick[g],
+            np.full(len(g), NO_OWNER), np.zeros(len(g))], axis=1)
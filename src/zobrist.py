@@ -0,0 +1,136 @@
+## Zobrist style hashing of simulator states and a bounded transposition table.
+##
+## Every cell, unit and the tick gets a 64 bit key and a state's hash is the XOR
+## of them, so changing one cell only needs its old key XORed out and the new one
+## in (see simulator._place / _remove). Each board cell and unit slot has its own
+## random seed; the cell contents are packed into an int and run through the
+## splitmix64 finaliser together with the seed, which keeps the tables small
+## while still covering unbounded values like bomb expiry ticks.
+##
+## Empty cells hash to 0. The functions here take the simulator layouts
+## (board channels kind, hp, expires, created, owner, diameter and the unit
+## columns) but do not import it, simulator imports this module.
+
+from functools import lru_cache
+from typing import Any, Callable, List, Optional, Sequence
+
+import numpy as np
+
+MASK = (1 << 64) - 1
+_SEED = 0x5EED_B0B5
+
+
+def _mix(v):
+    ## splitmix64 finaliser, works on python ints and uint64 arrays alike
+    v = (v ^ (v >> 30)) * 0xBF58476D1CE4E5B9 & MASK
+    v = (v ^ (v >> 27)) * 0x94D049BB133111EB & MASK
+    return v ^ (v >> 31)
+
+
+@lru_cache(maxsize=None)
+def _seeds(count: int, salt: int) -> tuple:
+    seeds = np.random.default_rng((_SEED, count, salt)).integers(0, 1 << 63, size=(2, count), dtype=np.uint64)
+    return seeds, seeds[0].tolist(), seeds[1].tolist()
+
+
+## Key of one cell (index x * height + y on a board of `cells` cells)
+def cell_key(cells: int, cell: int, kind: int, hp: int, expires: int, created: int, owner: int, diameter: int) -> int:
+    if kind == 0:
+        return 0
+    _, low, high = _seeds(cells, 0)
+    packed = kind | hp << 4 | (owner + 1) << 8 | diameter << 16 | created << 32
+    return _mix(low[cell] ^ packed) ^ _mix(high[cell] ^ expires)
+
+
+## XOR of the keys of every cell of a [6, W, H] board, same result as summing cell_key
+def board_key(board: np.ndarray) -> int:
+    kind, hp, expires, created, owner, diameter = (board[c].ravel().astype(np.uint64) for c in range(6))
+    (low, high), _, _ = _seeds(kind.size, 0)
+    ## owner is -1 for no owner, the +1 wraps it back round to 0
+    packed = kind | hp << 4 | (owner + 1) << 8 | diameter << 16 | created << 32
+    keys = _mix(low ^ packed) ^ _mix(high ^ expires)
+    return int(np.bitwise_xor.reduce(keys[kind != 0], initial=np.uint64(0)))
+
+
+## Key of the unit rows plus the tick. Invulnerability and stun ticks that are
+## already over do not change what can happen next, so they are clamped first and
+## states that only differ there hash the same
+def units_key(units: Sequence[Sequence[int]], tick: int) -> int:
+    _, low, high = _seeds(len(units), 1)
+    key = _mix(_SEED ^ tick)
+    for i, (x, y, hp, bombs, diameter, invulnerable, stunned, agent) in enumerate(units):
+        key ^= _mix(low[i] ^ (x | y << 8 | hp << 16 | diameter << 24 | bombs << 32))
+        key ^= _mix(high[i] ^ (max(invulnerable, tick) | max(stunned, tick - 1) << 32))
+    return key
+
+
+## Replacement policies: called with the entry already in a slot (key, value,
+## depth, generation), the depth of the new entry and the table's current
+## generation, return True to overwrite
+def replace_always(old: tuple, depth: int, generation: int) -> bool:
+    return True
+
+
+def replace_deeper(old: tuple, depth: int, generation: int) -> bool:
+    ## keep the more expensive result unless the old one is from an earlier search
+    return depth >= old[2] or old[3] != generation
+
+
+REPLACEMENT_POLICIES = {"always": replace_always, "depth": replace_deeper}
+
+
+## Fixed size hash table keyed on Zobrist hashes. Each hash maps to one slot
+## (hash % capacity), a new entry for an occupied slot goes through the
+## replacement policy. Stored keys are compared in full, so a slot collision is a
+## miss rather than a wrong hit
+class TranspositionTable:
+    def __init__(self, capacity: int = 1 << 16,
+                 replacement: 'str | Callable[[tuple, int, int], bool]' = "depth"):
+        if capacity <= 0:
+            raise Exception("transposition table capacity must be positive")
+        if isinstance(replacement, str):
+            if replacement not in REPLACEMENT_POLICIES:
+                raise Exception(f"unknown replacement policy {replacement}, expected one of {list(REPLACEMENT_POLICIES)}")
+            replacement = REPLACEMENT_POLICIES[replacement]
+        self.capacity = capacity
+        self.replacement = replacement
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._slots: List[Optional[tuple]] = [None] * capacity
+        self._size = 0
+
+    def get(self, key: int, default: Any = None) -> Any:
+        entry = self._slots[key % self.capacity]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return default
+
+    ## Returns whether the entry was stored
+    def put(self, key: int, value: Any, depth: int = 0) -> bool:
+        slot = key % self.capacity
+        old = self._slots[slot]
+        if old is None:
+            self._size += 1
+        elif old[0] != key and not self.replacement(old, depth, self.generation):
+            return False
+        self._slots[slot] = (key, value, depth, self.generation)
+        return True
+
+    ## Mark everything stored so far as from an earlier search, e.g. once per tick
+    def new_search(self):
+        self.generation += 1
+
+    def clear(self):
+        self._slots = [None] * self.capacity
+        self._size = 0
+        self.hits = self.misses = 0
+
+    def __contains__(self, key: int) -> bool:
+        entry = self._slots[key % self.capacity]
+        return entry is not None and entry[0] == key
+
+    def __len__(self) -> int:
+        return self._size
@@ -4,8 +4,9 @@ from gym import Gym
 import os
 import time
 
-fwd_model_uri = os.environ.get(
-    "FWD_MODEL_CONNECTION_STRING") or "ws://127.0.0.1:6969/?role=admin"
+# comma separated to spread the requests over several forward model servers
+fwd_model_uri = (os.environ.get(
+    "FWD_MODEL_CONNECTION_STRING") or "ws://127.0.0.1:6969/?role=admin").split(",")
 
 mock_6x6_state: Dict = {
   "game_id": "dev",
@@ -113,7 +114,7 @@ def calculate_reward(state: Dict):
 
 
 async def main():
-    gym = Gym(fwd_model_uri)
+    gym = Gym(fwd_model_uri if len(fwd_model_uri) > 1 else fwd_model_uri[0])
     for i in range(0,10):
         while True:
             try:
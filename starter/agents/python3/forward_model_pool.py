@@ -0,0 +1,125 @@
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+import websockets
+from forward_model import ForwardModel
+
+
+# Several forward model connections (one per engine process) behind the
+# ForwardModel interface, so Gym can use either.
+#
+# Each evaluate_next_state goes to the connected member with the fewest
+# requests still waiting on it. Replies carry the request's sequence_id and are
+# handed to the next state callback whichever member answered. When a member's
+# connection drops, the requests it still owed are sent again to the other
+# members (or held until one is back) and the member is reconnected in the
+# background, so no request is lost with it.
+class ForwardModelPool:
+    def __init__(self, connection_strings: List[str], reconnect_delay: float = 1.0):
+        if len(connection_strings) == 0:
+            raise Exception("ForwardModelPool needs at least one connection string")
+        self._members = [ForwardModel(uri) for uri in connection_strings]
+        for member in self._members:
+            member.set_next_state_callback(self._on_next_state)
+        self._reconnect_delay = reconnect_delay
+        self._next_state_callback = None
+        self._connected = [False] * len(self._members)
+        # per member: sequence_id -> (state, actions) of the requests it still owes
+        self._outstanding: List[Dict[int, Tuple[Dict, List[Dict]]]] = [{} for _ in self._members]
+        # sequence_id -> member it was sent to
+        self._owner: Dict[int, int] = {}
+        # requests that came in while no member was connected
+        self._backlog: Dict[int, Tuple[Dict, List[Dict]]] = {}
+        self._closed = False
+
+    def set_next_state_callback(self, next_state_callback):
+        self._next_state_callback = next_state_callback
+
+    @property
+    def queue_depths(self) -> List[int]:
+        return [len(outstanding) for outstanding in self._outstanding]
+
+    @property
+    def connected(self) -> List[bool]:
+        return list(self._connected)
+
+    async def connect(self):
+        results = await asyncio.gather(*(member.connect() for member in self._members), return_exceptions=True)
+        for i, result in enumerate(results):
+            self._connected[i] = not isinstance(result, BaseException)
+        if not any(self._connected):
+            raise ConnectionError(f"could not connect to any forward model: {results}")
+        return self
+
+    async def close(self):
+        self._closed = True
+        await asyncio.gather(*(member.close() for member in self._members))
+
+    # Runs every member's receive loop, reconnecting members that drop. Returns
+    # once the pool is closed. The argument is ignored, it is there to match
+    # ForwardModel._handle_messages(connection)
+    async def _handle_messages(self, connection=None):
+        await asyncio.gather(*(self._run_member(i) for i in range(len(self._members))))
+
+    async def _run_member(self, i: int):
+        member = self._members[i]
+        while not self._closed:
+            if self._connected[i]:
+                await member._handle_messages(member.connection)
+                await self._on_member_lost(i)
+                continue
+            await asyncio.sleep(self._reconnect_delay)
+            if self._closed:
+                break
+            try:
+                await member.connect()
+            except (OSError, websockets.exceptions.WebSocketException) as e:
+                print(f"reconnecting forward model {i} failed: {e}")
+                continue
+            self._connected[i] = True
+            await self._flush_backlog()
+
+    async def _on_member_lost(self, i: int):
+        self._connected[i] = False
+        owed, self._outstanding[i] = self._outstanding[i], {}
+        for sequence_id, (state, actions) in owed.items():
+            self._owner.pop(sequence_id, None)
+            await self.send_next_state(sequence_id, state, actions)
+
+    async def _flush_backlog(self):
+        backlog, self._backlog = self._backlog, {}
+        for sequence_id, (state, actions) in backlog.items():
+            await self.send_next_state(sequence_id, state, actions)
+
+    def _pick_member(self) -> Optional[int]:
+        connected = [i for i, up in enumerate(self._connected) if up]
+        if not connected:
+            return None
+        return min(connected, key=lambda i: len(self._outstanding[i]))
+
+    async def send_next_state(self, sequence_id: int, game_state: Dict, actions: List[Dict]):
+        while True:
+            i = self._pick_member()
+            if i is None:
+                self._backlog[sequence_id] = (game_state, actions)
+                return
+            self._outstanding[i][sequence_id] = (game_state, actions)
+            self._owner[sequence_id] = i
+            try:
+                await self._members[i].send_next_state(sequence_id, game_state, actions)
+                return
+            except websockets.exceptions.ConnectionClosed:
+                # the receive loop will notice too, take the request back and try another member
+                self._outstanding[i].pop(sequence_id, None)
+                self._owner.pop(sequence_id, None)
+                self._connected[i] = False
+
+    async def _on_next_state(self, payload):
+        sequence_id = payload.get("sequence_id")
+        i = self._owner.pop(sequence_id, None)
+        if i is None:
+            # a request that was already answered or sent elsewhere
+            return
+        self._outstanding[i].pop(sequence_id, None)
+        if self._next_state_callback is not None:
+            await self._next_state_callback(payload)
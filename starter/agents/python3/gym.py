@@ -1,9 +1,11 @@
 import asyncio
+import itertools
 import json
-from typing import Callable, Dict, List
+from typing import Callable, Dict, List, Optional, Union
 
 import websockets
 from forward_model import ForwardModel
+from forward_model_pool import ForwardModelPool
 
 
 class GymEnv():
@@ -24,31 +26,52 @@ class GymEnv():
         return [state.get("next_state"), state.get("is_complete"), state.get("tick_result").get("events")]
 
 
+# `max_in_flight` bounds how many evaluate_next_state requests can be waiting
+# on the forward model at once, across all environments. Further steps wait
+# for a slot instead of piling onto the socket.
+# A list of forward model URIs spreads the requests over a ForwardModelPool.
 class Gym():
-    def __init__(self, fwd_model_uri: str):
-        self._client_fwd = ForwardModel(fwd_model_uri)
+    def __init__(self, fwd_model_uri: Union[str, List[str]], max_in_flight: int = 64):
+        if isinstance(fwd_model_uri, str):
+            self._client_fwd = ForwardModel(fwd_model_uri)
+        else:
+            self._client_fwd = ForwardModelPool(fwd_model_uri)
         self._channel_counter = 0
-        self._channel_is_busy_status: Dict[int, bool] = {}
-        self._channel_buffer: Dict[int, Dict] = {}
+        # every request gets its own sequence_id, so one env can have several in flight
+        self._sequence_ids = itertools.count()
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._receive_task: Optional[asyncio.Task] = None
         self._client_fwd.set_next_state_callback(self._on_next_game_state)
         self._environments: Dict[str, GymEnv] = {}
 
     async def connect(self):
-        loop = asyncio.get_event_loop()
-
         client_fwd_connection = await self._client_fwd.connect()
 
         loop = asyncio.get_event_loop()
-        loop.create_task(
+        self._receive_task = loop.create_task(
             self._client_fwd._handle_messages(client_fwd_connection))
+        self._receive_task.add_done_callback(self._on_connection_lost)
 
     async def close(self):
         await self._client_fwd.close()
 
+    @property
+    def in_flight(self) -> int:
+        return len(self._pending)
+
     async def _on_next_game_state(self, state):
-        channel = state.get("sequence_id")
-        self._channel_is_busy_status[channel] = False
-        self._channel_buffer[channel] = state
+        future = self._pending.pop(state.get("sequence_id"), None)
+        if future is not None and not future.done():
+            future.set_result(state)
+
+    def _on_connection_lost(self, task: asyncio.Task):
+        # nothing will answer the requests still waiting, fail them instead of hanging
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(
+                    "forward model connection closed before the next state arrived"))
 
     def make(self, name: str, initial_state: Dict) -> GymEnv:
         if self._environments.get(name) is not None:
@@ -60,11 +83,13 @@ class Gym():
         return self._environments[name]
 
     async def _send_next_state(self, state, actions, channel: int):
-        self._channel_is_busy_status[channel] = True
-        await self._client_fwd.send_next_state(channel, state, actions)
-        while self._channel_is_busy_status[channel] == True:
-            # TODO figure out why packets are not received without some sleep
-            await asyncio.sleep(0.0001)
-        result = self._channel_buffer[channel]
-        del self._channel_buffer[channel]
-        return result
+        async with self._in_flight:
+            sequence_id = next(self._sequence_ids)
+            future = asyncio.get_event_loop().create_future()
+            self._pending[sequence_id] = future
+            try:
+                await self._client_fwd.send_next_state(sequence_id, state, actions)
+                # resolved by _on_next_game_state from the receive loop
+                return await future
+            finally:
+                self._pending.pop(sequence_id, None)
@@ -0,0 +1,91 @@
+import asyncio
+import json
+import unittest
+from unittest import IsolatedAsyncioTestCase
+
+import websockets
+from forward_model_pool import ForwardModelPool
+from gym import Gym
+
+
+class FakeForwardModel:
+    # answers evaluate_next_state with the state it was sent, after `delay`.
+    # With drop_after set, closes the connection instead of answering that request
+    def __init__(self, delay=0.0, drop_after=None):
+        self.delay = delay
+        self.drop_after = drop_after
+        self.received = []
+
+    async def handler(self, connection, path=None):
+        async for message in connection:
+            packet = json.loads(message)
+            self.received.append(packet["sequence_id"])
+            if self.drop_after is not None and len(self.received) > self.drop_after:
+                self.drop_after = None
+                await connection.close()
+                return
+            asyncio.ensure_future(self.reply(connection, packet))
+
+    async def reply(self, connection, packet):
+        await asyncio.sleep(self.delay)
+        await connection.send(json.dumps({"type": "next_game_state", "payload": {
+            "sequence_id": packet["sequence_id"], "is_complete": False,
+            "next_state": packet["state"], "tick_result": {"events": []}}}))
+
+
+class TestForwardModelPool(IsolatedAsyncioTestCase):
+    async def serve(self, fake):
+        server = await websockets.serve(fake.handler, "127.0.0.1", 0)
+        self.servers.append(server)
+        return f"ws://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+
+    async def asyncSetUp(self):
+        self.servers = []
+
+    async def asyncTearDown(self):
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+
+    async def test_requests_are_balanced_by_queue_depth(self):
+        fast, slow = FakeForwardModel(delay=0.0), FakeForwardModel(delay=0.05)
+        gym = Gym([await self.serve(fast), await self.serve(slow)])
+        await gym.connect()
+        envs = [gym.make(str(i), {"env": i}) for i in range(40)]
+
+        for _ in range(3):
+            results = await asyncio.gather(*(env.step([]) for env in envs))
+            self.assertEqual([result[0]["env"] for result in results], list(range(40)))
+        self.assertEqual(gym._client_fwd.queue_depths, [0, 0])
+        self.assertGreater(len(fast.received), 0)
+        self.assertGreater(len(slow.received), 0)
+        await gym.close()
+
+    async def test_dropped_member_loses_no_requests(self):
+        healthy, flaky = FakeForwardModel(delay=0.01), FakeForwardModel(delay=0.01, drop_after=2)
+        pool = ForwardModelPool([await self.serve(healthy), await self.serve(flaky)], reconnect_delay=0.01)
+        replies = {}
+
+        async def on_next_state(payload):
+            replies[payload["sequence_id"]] = payload
+
+        pool.set_next_state_callback(on_next_state)
+        await pool.connect()
+        receive = asyncio.ensure_future(pool._handle_messages())
+        for sequence_id in range(20):
+            await pool.send_next_state(sequence_id, {"n": sequence_id}, [])
+        for _ in range(200):
+            if len(replies) == 20:
+                break
+            await asyncio.sleep(0.01)
+
+        self.assertEqual(sorted(replies), list(range(20)))
+        self.assertTrue(all(replies[i]["next_state"]["n"] == i for i in replies))
+        # the flaky member came back
+        self.assertEqual(pool.connected, [True, True])
+        await pool.close()
+        await receive
+
+
+if __name__ == '__main__':
+    unittest.main()
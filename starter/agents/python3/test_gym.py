@@ -0,0 +1,59 @@
+import asyncio
+import unittest
+from unittest import IsolatedAsyncioTestCase
+
+from gym import Gym
+
+
+class TestGym(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.gym = Gym("", max_in_flight=2)
+        self.sent = []
+        self.most_in_flight = 0
+
+        async def send_next_state(sequence_id, game_state, actions):
+            self.sent.append((sequence_id, game_state["name"]))
+            self.most_in_flight = max(self.most_in_flight, self.gym.in_flight)
+
+        self.gym._client_fwd.send_next_state = send_next_state
+
+    async def settle(self):
+        # let the waiting steps run until they block again
+        for _ in range(5):
+            await asyncio.sleep(0)
+
+    async def reply(self, sequence_id, name):
+        await self.gym._client_fwd._on_data({"type": "next_game_state", "payload": {
+            "sequence_id": sequence_id, "is_complete": False,
+            "next_state": {"name": name + "'"}, "tick_result": {"events": []}}})
+
+    async def test_replies_are_routed_by_sequence_id(self):
+        envs = [self.gym.make(name, {"name": name}) for name in ("a", "b", "c")]
+        steps = asyncio.gather(*(env.step([]) for env in envs))
+        await self.settle()
+        # only two requests fit in the window
+        self.assertEqual(len(self.sent), 2)
+
+        # answer out of order
+        for sequence_id, name in reversed(self.sent[:2]):
+            await self.reply(sequence_id, name)
+        await self.settle()
+        self.assertEqual(len(self.sent), 3)
+        await self.reply(*self.sent[2])
+
+        results = await steps
+        self.assertEqual([result[0]["name"] for result in results], ["a'", "b'", "c'"])
+        self.assertEqual(self.most_in_flight, 2)
+        self.assertEqual(self.gym.in_flight, 0)
+
+    async def test_lost_connection_fails_pending_steps(self):
+        env = self.gym.make("a", {"name": "a"})
+        step = asyncio.ensure_future(env.step([]))
+        await self.settle()
+        self.gym._on_connection_lost(None)
+        with self.assertRaises(ConnectionError):
+            await step
+
+
+if __name__ == '__main__':
+    unittest.main()